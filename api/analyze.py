@@ -3,60 +3,676 @@ Vercel Serverless Function for Real AI Sales Call Analysis
 Provides actual Anthropic Claude AI analysis for marriage coaching transcripts
 """
 
-import json
 import os
 import asyncio
+from collections import OrderedDict
 from datetime import datetime
+import hashlib
 import logging
+import random
+import re
+import time
 
-try:
-    from anthropic import AsyncAnthropic
-except ImportError:
-    # Fallback for deployment
-    pass
+import orjson
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Sonnet for the transcript analyses, Haiku for the small JSON transforms
+# (archetype, coaching) that only work over already-analyzed input and for
+# short transcripts
+ANALYSIS_MODEL = "claude-3-5-sonnet-20241022"
+FAST_MODEL = "claude-3-5-haiku-20241022"
+
+# Transcripts shorter than this are analyzed with FAST_MODEL as well
+SHORT_TRANSCRIPT_CHARS = 3000
+
+
+def transcript_model(content):
+    """Model for the transcript analyses - Haiku for short transcripts, Sonnet otherwise"""
+    return FAST_MODEL if len(content) < SHORT_TRANSCRIPT_CHARS else ANALYSIS_MODEL
+
+# Static prompt instructions. Kept at module scope so the text is byte-identical
+# across requests - Anthropic prompt caching only hits on an identical prefix.
+# The JSON shape of each answer lives in the matching tool's input_schema.
+PSYCHOLOGICAL_INSTRUCTIONS = """Analyze this marriage coaching sales conversation for deep psychological insights.
+
+Score the client's Big Five personality traits (1-100) with your confidence and the coaching implications of each, then describe their decision-making style, emotional state and communication preferences.
+
+Record the analysis with the emit_psych_profile tool."""
+
+SALES_INSTRUCTIONS = """Analyze this marriage coaching sales conversation for performance metrics.
+
+Assess the rep's overall performance, score each core sales skill (1-10) with specific feedback, and capture the conversation metrics and client buying signals.
+
+Record the analysis with the emit_sales_performance tool."""
+
+ARCHETYPE_INSTRUCTIONS = """Based on the psychological and sales analysis provided, classify the client into one of these 5 archetypes:
+
+1. ANALYTICAL RESEARCHER - Data-driven, needs facts and logical arguments
+2. DESPERATE SAVER - High urgency, emotional, facing relationship crisis
+3. HOPEFUL BUILDER - Optimistic, growth-focused, future-oriented
+4. SKEPTICAL EVALUATOR - Cautious, needs proof and guarantees
+5. CONSENSUS SEEKER - Involves others, needs group approval
+
+Record the classification with the emit_archetype tool."""
+
+COACHING_INSTRUCTIONS = """Generate specific coaching recommendations for this sales conversation.
+
+Based on the client archetype and sales performance score provided, give actionable, psychology-based coaching.
+
+Record the recommendations with the emit_coaching tool."""
+
+
+# Transcript budget per prompt. Counted in tokens via the API; the character
+# limit only applies when counting is unavailable.
+MAX_CONTENT_TOKENS = 3000
+MAX_CONTENT_CHARS = 12000
+
+# Transcripts run about 4 characters per token. Text within the budget at a
+# pessimistic 3 chars/token can't exceed it, and text over it even at an
+# optimistic 6 chars/token can't fit, so only the band between is counted;
+# longer text is cut to MAX_CONTENT_CHARS, the budget at the usual ratio.
+MIN_CHARS_PER_TOKEN = 3
+MAX_CHARS_PER_TOKEN = 6
+TRUNCATION_SUFFIX = "... [Content truncated for analysis]"
+
+# Fixed framing around the per-request data in each user message
+PSYCHOLOGICAL_PROMPT_PREFIX = "CONVERSATION:\n"
+SALES_PROMPT_PREFIX = "SALES CONVERSATION:\n"
+ARCHETYPE_PROMPT_PREFIX = "PSYCHOLOGICAL PROFILE:\n"
+ARCHETYPE_PROMPT_SEPARATOR = "\n\nSALES PERFORMANCE:\n"
+COACHING_PROMPT_PREFIX = "CLIENT ARCHETYPE: "
+COACHING_PROMPT_SEPARATOR = "\nSALES PERFORMANCE SCORE: "
+COACHING_PROMPT_SUFFIX = "/100"
+
+
+def _object(properties):
+    """JSON schema for an object whose listed properties are all required"""
+    return {"type": "object", "properties": properties, "required": list(properties)}
+
+
+def _integer(minimum, maximum):
+    return {"type": "integer", "minimum": minimum, "maximum": maximum}
+
+
+def _enum(*values):
+    return {"type": "string", "enum": list(values)}
+
+
+_STRING = {"type": "string"}
+_STRING_LIST = {"type": "array", "items": _STRING}
+
+_TRAIT = _object({
+    "score": _integer(1, 100),
+    "confidence": _integer(0, 100),
+    "implications": _STRING
+})
+_SKILL = _object({"score": _integer(1, 10), "feedback": _STRING})
+_ARCHETYPES = _enum(
+    "ANALYTICAL RESEARCHER", "DESPERATE SAVER", "HOPEFUL BUILDER",
+    "SKEPTICAL EVALUATOR", "CONSENSUS SEEKER"
+)
+
+# Tool definitions used as structured output: each request forces its tool,
+# so the answer arrives as an already-parsed tool_use input.
+PSYCHOLOGICAL_TOOL = {
+    "name": "emit_psych_profile",
+    "description": "Record the client's psychological profile.",
+    "input_schema": _object({
+        "big_five_personality": _object({
+            "openness": _TRAIT,
+            "conscientiousness": _TRAIT,
+            "extraversion": _TRAIT,
+            "agreeableness": _TRAIT,
+            "neuroticism": _TRAIT
+        }),
+        "decision_making_style": _object({
+            "primary_style": _enum("analytical", "emotional", "intuitive", "consensus"),
+            "confidence": _integer(0, 100),
+            "time_preference": _enum("immediate", "days", "weeks", "months"),
+            "information_needs": _enum("minimal", "moderate", "extensive")
+        }),
+        "emotional_state": _object({
+            "primary_emotion": _enum("hopeful", "anxious", "skeptical", "desperate", "calm"),
+            "intensity": _integer(1, 10),
+            "stability": _integer(1, 10)
+        }),
+        "communication_preferences": _object({
+            "directness": _integer(1, 10),
+            "detail_level": _enum("high", "medium", "low"),
+            "pace": _enum("fast", "moderate", "slow")
+        })
+    })
+}
+
+SALES_TOOL = {
+    "name": "emit_sales_performance",
+    "description": "Record the sales performance analysis.",
+    "input_schema": _object({
+        "overall_assessment": _object({
+            "performance_score": _integer(1, 100),
+            "grade": _enum("A", "B", "C", "D", "F"),
+            "conversion_likelihood": _integer(1, 100),
+            "key_strengths": {**_STRING_LIST, "description": "top 3 strengths"},
+            "improvement_areas": {**_STRING_LIST, "description": "top 3 areas needing work"}
+        }),
+        "skills_breakdown": _object({
+            "rapport_building": _SKILL,
+            "discovery_quality": _SKILL,
+            "presentation": _SKILL,
+            "objection_handling": _SKILL,
+            "closing": _SKILL
+        }),
+        "conversation_metrics": _object({
+            "talk_ratio": {**_STRING, "description": "rep_percentage:client_percentage"},
+            "emotional_connection": _integer(1, 10),
+            "trust_building": _integer(1, 10)
+        }),
+        "client_signals": _object({
+            "buying_signals": _STRING_LIST,
+            "objections": _STRING_LIST,
+            "engagement_level": _integer(1, 10)
+        })
+    })
+}
+
+ARCHETYPE_TOOL = {
+    "name": "emit_archetype",
+    "description": "Record the client archetype classification.",
+    "input_schema": _object({
+        "primary_archetype": _ARCHETYPES,
+        "confidence_score": {"type": "number", "minimum": 0, "maximum": 1},
+        "secondary_archetype": _ARCHETYPES,
+        "reasoning": {**_STRING, "description": "brief explanation of classification"},
+        "key_characteristics": {**_STRING_LIST, "description": "3 key traits that led to this classification"}
+    })
+}
+
+COACHING_TOOL = {
+    "name": "emit_coaching",
+    "description": "Record coaching recommendations for the rep.",
+    "input_schema": _object({
+        "immediate_action_plan": _object({
+            "top_3_priorities": {**_STRING_LIST, "description": "specific action items for next interaction"},
+            "follow_up_timing": _enum("1-2 days", "3-5 days", "1 week", "2+ weeks"),
+            "follow_up_method": _enum("email", "phone", "text", "video"),
+            "key_message_focus": _STRING
+        }),
+        "communication_strategy": _object({
+            "tone_adjustments": _STRING,
+            "language_style": _enum("formal", "conversational", "empathetic", "direct"),
+            "key_phrases_to_use": _STRING_LIST,
+            "topics_to_emphasize": _STRING_LIST,
+            "topics_to_avoid": _STRING_LIST
+        }),
+        "sales_technique_improvements": _object({
+            "discovery_improvements": _STRING_LIST,
+            "presentation_adjustments": _STRING_LIST,
+            "closing_recommendations": _STRING_LIST,
+            "objection_handling": _STRING_LIST
+        })
+    })
+}
+
+# Single-call variant of the whole pipeline: one request returns all four
+# sections, so the transcript is sent once instead of twice and the two
+# dependent calls disappear. The staged calls remain as the fallback.
+COMBINED_INSTRUCTIONS = """Analyze this marriage coaching sales conversation in one pass:
+
+1. Psychological profile - score the client's Big Five personality traits (1-100) with your confidence and the coaching implications of each, then describe their decision-making style, emotional state and communication preferences.
+2. Sales performance - assess the rep's overall performance, score each core sales skill (1-10) with specific feedback, and capture the conversation metrics and client buying signals.
+3. Archetype - based on 1 and 2, classify the client into one of these 5 archetypes:
+   ANALYTICAL RESEARCHER - Data-driven, needs facts and logical arguments
+   DESPERATE SAVER - High urgency, emotional, facing relationship crisis
+   HOPEFUL BUILDER - Optimistic, growth-focused, future-oriented
+   SKEPTICAL EVALUATOR - Cautious, needs proof and guarantees
+   CONSENSUS SEEKER - Involves others, needs group approval
+4. Coaching - based on the archetype and sales performance, give actionable, psychology-based coaching for the rep.
+
+Record all four sections with the emit_full_analysis tool."""
+
+COMBINED_TOOL = {
+    "name": "emit_full_analysis",
+    "description": "Record the complete analysis of the conversation.",
+    "input_schema": _object({
+        "psychological_profile": PSYCHOLOGICAL_TOOL["input_schema"],
+        "sales_performance": SALES_TOOL["input_schema"],
+        "archetype_analysis": ARCHETYPE_TOOL["input_schema"],
+        "coaching_recommendations": COACHING_TOOL["input_schema"]
+    })
+}
+COMBINED_PROMPT_PREFIX = "SALES CONVERSATION:\n"
+
+
+def schema_error(value, schema, path="$"):
+    """
+    Check value against the subset of JSON Schema used by the tools above.
+
+    Returns a description of the first problem found, or None if it fits.
+    Numbers are accepted for integer fields since models sometimes answer
+    7.5 for a 1-10 score.
+    """
+    schema_type = schema.get("type")
+    if schema_type == "object":
+        if not isinstance(value, dict):
+            return f"{path} should be an object"
+        for key in schema.get("required", ()):
+            if key not in value:
+                return f"{path}.{key} is missing"
+        for key, subschema in schema.get("properties", {}).items():
+            if key in value:
+                error = schema_error(value[key], subschema, f"{path}.{key}")
+                if error is not None:
+                    return error
+    elif schema_type == "array":
+        if not isinstance(value, list):
+            return f"{path} should be an array"
+        for i, item in enumerate(value):
+            error = schema_error(item, schema["items"], f"{path}[{i}]")
+            if error is not None:
+                return error
+    elif schema_type == "string":
+        if not isinstance(value, str):
+            return f"{path} should be a string"
+        if "enum" in schema and value not in schema["enum"]:
+            return f"{path} should be one of {schema['enum']}"
+    elif schema_type in ("integer", "number"):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return f"{path} should be a number"
+        if value < schema.get("minimum", value) or value > schema.get("maximum", value):
+            return f"{path} should be between {schema['minimum']} and {schema['maximum']}"
+    return None
+
+
+def forced_tool(tool):
+    """tools/tool_choice request params that make the model answer through tool"""
+    return {"tools": [tool], "tool_choice": {"type": "tool", "name": tool["name"]}}
+
+
+class ResponseCache:
+    """Small in-process TTL + LRU cache for parsed analyzer responses"""
+
+    def __init__(self, maxsize=1000, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+# Warm serverless containers keep this between invocations
+RESPONSE_CACHE = ResponseCache()
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def transcript_shingles(content, size=5):
+    """Hashed, case-folded word 5-grams of a transcript"""
+    words = content.lower().split()
+    if len(words) < size:
+        return frozenset([hash(" ".join(words))])
+    return frozenset(hash(" ".join(words[i:i + size])) for i in range(len(words) - size + 1))
+
+
+class SimilarTranscriptCache:
+    """
+    In-process cache of full analysis results for near-duplicate transcripts.
+
+    Transcripts are compared by Jaccard similarity of their word shingles,
+    so templated intakes that only differ in a few words reuse the stored
+    result instead of running the whole pipeline again. A linear scan is
+    fine at this size; an embedding index would need a model or an extra
+    service in every cold container.
+    """
+
+    def __init__(self, maxsize=200, ttl=3600, threshold=0.95):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries = OrderedDict()
+
+    def get(self, shingles):
+        now = time.monotonic()
+        best_key, best_similarity = None, self.threshold
+        for key, (expires_at, cached_shingles, _) in list(self._entries.items()):
+            if expires_at < now:
+                del self._entries[key]
+                continue
+            union = len(shingles | cached_shingles)
+            similarity = len(shingles & cached_shingles) / union if union else 0.0
+            if similarity >= best_similarity:
+                best_key, best_similarity = key, similarity
+
+        if best_key is None:
+            return None
+        self._entries.move_to_end(best_key)
+        return self._entries[best_key][2]
+
+    def set(self, shingles, result):
+        self._entries[shingles] = (time.monotonic() + self.ttl, shingles, result)
+        self._entries.move_to_end(shingles)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+SIMILAR_TRANSCRIPT_CACHE = SimilarTranscriptCache()
+
+# Exact-match tier in front of the similarity scan, keyed by transcript digest
+RESULT_CACHE = ResponseCache(maxsize=256, ttl=3600)
+
+# Token counts by model and transcript digest; counts are deterministic
+TOKEN_COUNT_CACHE = ResponseCache(maxsize=256, ttl=3600)
+
+# Analyses currently running, keyed like RESULT_CACHE, so concurrent uploads of
+# the same transcript share one set of API calls
+IN_FLIGHT_ANALYSES = {}
+
+
+def response_cache_key(params):
+    """
+    Cache key for one analyzer request.
+
+    The system instructions are part of the key, so editing a prompt
+    invalidates its entries. Whitespace in the user message is collapsed
+    so re-uploads that only differ in line endings or spacing still hit.
+    """
+    user_content = _WHITESPACE_RE.sub(' ', params["messages"][-1]["content"]).strip()
+    key_source = "\x1f".join((params["model"], params["system"][0]["text"], user_content))
+    return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+
+# Retry/concurrency policy for analyzer requests. Retries are handled by
+# stream_with_backoff rather than the SDK so they can share the semaphore.
+MAX_CONCURRENT_REQUESTS = 10
+MAX_ATTEMPTS = 5
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+MAX_BACKOFF_SECONDS = 30
+
+# Connection pool size. One analysis opens at most two concurrent requests, so
+# the pool is sized for a handful of overlapping analyses rather than the SDK
+# default of 1000.
+MAX_CONNECTIONS = 16
+MAX_KEEPALIVE_CONNECTIONS = 8
+
+# Shared client so warm containers reuse the httpx connection pool (and its
+# TLS sessions) instead of building a new one per request.
+_CLIENT = None
+_CLIENT_API_KEY = None
+_CLIENT_LOOP = None
+_CLOSING_CLIENTS = set()  # Close tasks of replaced clients, referenced until done
+
+
+async def close_client(client):
+    """Close a replaced client's pool; one opened on a since-closed loop may fail to"""
+    try:
+        await client.close()
+    except Exception as e:
+        logger.warning(f"Could not close replaced Anthropic client: {str(e)}")
+
+
+def get_client(api_key):
+    """
+    Return the module-level AsyncAnthropic client, creating it on first use.
+
+    httpx async connections belong to the event loop that opened them, so the
+    client is rebuilt when requested from a different loop or with another key,
+    and the one it replaces is closed in the background. Must be called from
+    inside a running event loop.
+
+    anthropic is imported here rather than at module level so preflight and
+    rejected requests don't pay for importing the SDK on a cold start.
+    """
+    global _CLIENT, _CLIENT_API_KEY, _CLIENT_LOOP
+
+    loop = asyncio.get_running_loop()
+    if _CLIENT is None or _CLIENT_API_KEY != api_key or _CLIENT_LOOP is not loop:
+        import httpx
+        from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient
+
+        if _CLIENT is not None:
+            task = asyncio.ensure_future(close_client(_CLIENT))
+            _CLOSING_CLIENTS.add(task)
+            task.add_done_callback(_CLOSING_CLIENTS.discard)
+        _CLIENT = AsyncAnthropic(
+            api_key=api_key,
+            max_retries=0,
+            timeout=60.0,
+            http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS
+            ))
+        )
+        _CLIENT_API_KEY = api_key
+        _CLIENT_LOOP = loop
+    return _CLIENT
+
+
+_SEMAPHORE = None
+_SEMAPHORE_LOOP = None
+
+
+def get_semaphore():
+    """Module-level request semaphore, bound to the running loop like the client"""
+    global _SEMAPHORE, _SEMAPHORE_LOOP
+
+    loop = asyncio.get_running_loop()
+    if _SEMAPHORE is None or _SEMAPHORE_LOOP is not loop:
+        _SEMAPHORE = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        _SEMAPHORE_LOOP = loop
+    return _SEMAPHORE
+
+
+def retry_delay(error, attempt):
+    """Seconds to wait before retrying error, or None if it should not be retried"""
+    from anthropic import APIConnectionError, APIStatusError
+
+    if isinstance(error, APIStatusError):
+        if error.status_code not in RETRYABLE_STATUS_CODES:
+            return None
+        retry_after = error.response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    elif not isinstance(error, APIConnectionError):
+        return None
+    # Jitter keeps concurrent requests that failed together from retrying together
+    return min(2 ** attempt + random.uniform(0, 1), MAX_BACKOFF_SECONDS)
+
+
+async def stream_with_backoff(client, params):
+    """
+    Run one Messages request and return the final message.
+
+    The response is streamed so long generations keep the connection
+    active instead of sitting idle until the whole completion is ready;
+    tool input is only usable once complete, so we just collect the
+    final message.
+    """
+    async def request():
+        async with client.messages.stream(**params) as stream:
+            return await stream.get_final_message()
+
+    return await call_with_backoff(request)
+
+
+async def call_with_backoff(request):
+    """
+    Await request() and return its result.
+
+    Retries use exponential backoff on rate limits, 5xx/overloaded and
+    connection errors, honoring Retry-After when the API sends it. Every
+    attempt holds the shared semaphore; the backoff sleep does not.
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            async with get_semaphore():
+                return await request()
+        except Exception as e:
+            delay = retry_delay(e, attempt)
+            if delay is None or attempt == MAX_ATTEMPTS - 1:
+                raise
+            logger.warning(f"Anthropic request failed ({str(e)}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+_THINK_RE = re.compile(r'<think>.*?</think>', re.DOTALL)
+_TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+_FENCE_RE = re.compile(r'^```(?:json)?\s*|\s*```$')
+
+
+def find_json_object(text):
+    """Return the first balanced {...} span in text, skipping braces inside strings"""
+    start = text.find('{')
+    if start == -1:
+        return None
+
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+
+def count_words(text):
+    """
+    Whitespace-separated word count.
+
+    str.split() runs in C and measured ~8x faster than iterating regex
+    matches on a 60 KB transcript; the temporary list is short-lived.
+    """
+    return len(text.split())
+
+
+def cached_system(instructions):
+    """System prompt block marked for Anthropic prompt caching"""
+    return [{"type": "text", "text": instructions, "cache_control": {"type": "ephemeral"}}]
+
+
+# Fallback results returned when an analysis step fails. Shared, never mutated:
+# the analyzer compares against them by identity to detect a fallback.
+FALLBACK_PSYCHOLOGICAL_ANALYSIS = {
+    "big_five_personality": {
+        "openness": {"score": 50, "confidence": 50, "implications": "analysis unavailable"},
+        "conscientiousness": {"score": 50, "confidence": 50, "implications": "analysis unavailable"},
+        "extraversion": {"score": 50, "confidence": 50, "implications": "analysis unavailable"},
+        "agreeableness": {"score": 50, "confidence": 50, "implications": "analysis unavailable"},
+        "neuroticism": {"score": 50, "confidence": 50, "implications": "analysis unavailable"}
+    },
+    "decision_making_style": {"primary_style": "mixed", "confidence": 50},
+    "emotional_state": {"primary_emotion": "neutral", "intensity": 5, "stability": 5}
+}
+
+FALLBACK_SALES_ANALYSIS = {
+    "overall_assessment": {
+        "performance_score": 50,
+        "grade": "C",
+        "conversion_likelihood": 50,
+        "key_strengths": ["analysis unavailable"],
+        "improvement_areas": ["analysis unavailable"]
+    },
+    "skills_breakdown": {
+        "rapport_building": {"score": 5, "feedback": "analysis unavailable"},
+        "discovery_quality": {"score": 5, "feedback": "analysis unavailable"},
+        "presentation": {"score": 5, "feedback": "analysis unavailable"},
+        "objection_handling": {"score": 5, "feedback": "analysis unavailable"},
+        "closing": {"score": 5, "feedback": "analysis unavailable"}
+    }
+}
+
+FALLBACK_ARCHETYPE = {
+    "primary_archetype": "Mixed Profile",
+    "confidence_score": 0.5,
+    "secondary_archetype": "Hopeful Builder",
+    "reasoning": "analysis unavailable"
+}
+
+FALLBACK_COACHING = {
+    "immediate_action_plan": {
+        "top_3_priorities": ["follow up within 48 hours", "address main concerns", "provide additional value"],
+        "follow_up_timing": "2-3 days",
+        "follow_up_method": "email"
+    }
+}
+
+
 class ServerlessAnalyzer:
     """Serverless version of Enhanced Sales Analyzer for web deployment"""
 
     def __init__(self, api_key):
-        self.client = AsyncAnthropic(api_key=api_key)
+        self.api_key = api_key
+
+    @property
+    def client(self):
+        return get_client(self.api_key)
 
     async def analyze_transcript_content(self, content, filename="transcript.txt"):
         """Main analysis function optimized for serverless deployment"""
 
         try:
-            # Limit content length for API efficiency
-            if len(content) > 12000:
-                content = content[:12000] + "... [Content truncated for analysis]"
-
-            # Run comprehensive analysis
-            psychological_analysis = await self.analyze_psychological_profile(content)
-            sales_analysis = await self.analyze_sales_performance(content)
-            archetype_classification = await self.classify_archetype(psychological_analysis, sales_analysis)
-            coaching_recommendations = await self.generate_coaching_recommendations(
-                psychological_analysis, sales_analysis, archetype_classification
-            )
-
-            # Calculate success probability
-            success_probability = self.calculate_success_probability(
-                sales_analysis, psychological_analysis, archetype_classification
-            )
+            content_key = hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+            cached = RESULT_CACHE.get(content_key)
+            if cached is None:
+                shingles = transcript_shingles(content)
+                cached = SIMILAR_TRANSCRIPT_CACHE.get(shingles)
+            if cached is not None:
+                logger.info(f"Reusing cached analysis for {filename}")
+                return {
+                    **cached,
+                    'transcript_id': filename,
+                    'analysis_timestamp': datetime.now().isoformat(),
+                    'word_count': count_words(content)
+                }
+
+            # Identical transcripts that arrive while one is being analyzed
+            # wait for that analysis instead of starting their own
+            in_flight = IN_FLIGHT_ANALYSES.get(content_key)
+            if in_flight is None:
+                in_flight = asyncio.ensure_future(self._run_analysis(content, filename, content_key, shingles))
+                IN_FLIGHT_ANALYSES[content_key] = in_flight
+                in_flight.add_done_callback(lambda _: IN_FLIGHT_ANALYSES.pop(content_key, None))
+            else:
+                logger.info(f"Joining in-flight analysis of the same transcript for {filename}")
 
-            return {
-                'transcript_id': filename,
-                'analysis_timestamp': datetime.now().isoformat(),
-                'status': 'success',
-                'word_count': len(content.split()),
-                'psychological_profile': psychological_analysis,
-                'sales_performance': sales_analysis,
-                'archetype_analysis': archetype_classification,
-                'coaching_recommendations': coaching_recommendations,
-                'success_probability': success_probability
-            }
+            # shield() so a disconnecting caller doesn't cancel the shared analysis
+            result = await asyncio.shield(in_flight)
+            if result['transcript_id'] != filename:
+                result = {**result, 'transcript_id': filename}
+            return result
 
         except Exception as e:
             logger.error(f"Analysis failed: {str(e)}")
@@ -67,412 +683,752 @@ class ServerlessAnalyzer:
                 'analysis_timestamp': datetime.now().isoformat()
             }
 
-    async def analyze_psychological_profile(self, content):
-        """Big Five personality analysis with coaching insights"""
-
-        prompt = f"""
-        Analyze this marriage coaching sales conversation for deep psychological insights.
-
-        CONVERSATION:
-        {content}
-
-        Provide Big Five personality analysis in JSON format:
-        {{
-          "big_five_personality": {{
-            "openness": {{
-              "score": 1-100,
-              "confidence": 80,
-              "implications": "detailed coaching implications"
-            }},
-            "conscientiousness": {{
-              "score": 1-100,
-              "confidence": 85,
-              "implications": "follow-through and structure needs"
-            }},
-            "extraversion": {{
-              "score": 1-100,
-              "confidence": 75,
-              "implications": "communication and social interaction style"
-            }},
-            "agreeableness": {{
-              "score": 1-100,
-              "confidence": 85,
-              "implications": "cooperation and conflict handling approach"
-            }},
-            "neuroticism": {{
-              "score": 1-100,
-              "confidence": 80,
-              "implications": "emotional stability and stress management"
-            }}
-          }},
-          "decision_making_style": {{
-            "primary_style": "analytical|emotional|intuitive|consensus",
-            "confidence": 85,
-            "time_preference": "immediate|days|weeks|months",
-            "information_needs": "minimal|moderate|extensive"
-          }},
-          "emotional_state": {{
-            "primary_emotion": "hopeful|anxious|skeptical|desperate|calm",
-            "intensity": 1-10,
-            "stability": 1-10
-          }},
-          "communication_preferences": {{
-            "directness": 1-10,
-            "detail_level": "high|medium|low",
-            "pace": "fast|moderate|slow"
-          }}
-        }}
-
-        Respond with ONLY the JSON object.
+    async def _run_analysis(self, content, filename, content_key, shingles):
+        """Analyze one transcript through the API and cache the result"""
+
+        # Truncated once here; every prompt below reuses the same text
+        analysis_content = await self.truncate_content(content)
+
+        analyses = await self.analyze_combined(analysis_content)
+        if analyses is None:
+            analyses = await self.analyze_in_stages(analysis_content)
+        (psychological_analysis, sales_analysis, archetype_classification,
+         coaching_recommendations, used_fallback) = analyses
+
+        result = self.build_result(
+            filename, content, psychological_analysis, sales_analysis,
+            archetype_classification, coaching_recommendations
+        )
+        # Results containing a fallback are not reused for other transcripts
+        if not used_fallback:
+            RESULT_CACHE.set(content_key, result)
+            SIMILAR_TRANSCRIPT_CACHE.set(shingles, result)
+        return result
+
+    async def analyze_combined(self, content):
         """
+        Run the whole analysis as one request.
 
+        Returns (psych, sales, archetype, coaching, used_fallback), or None
+        when the call or its output is unusable so the caller can fall back
+        to the staged pipeline.
+        """
         try:
-            response = await self.client.messages.create(
-                model="claude-3-5-sonnet-20241022",
-                max_tokens=2000,
-                messages=[{"role": "user", "content": prompt}]
+            combined = await self._complete_json(self._combined_params(content))
+            return (
+                combined['psychological_profile'],
+                combined['sales_performance'],
+                combined['archetype_analysis'],
+                combined['coaching_recommendations'],
+                False
             )
+        except Exception as e:
+            logger.error(f"Combined analysis error, falling back to staged calls: {str(e)}")
+            return None
 
-            response_text = response.content[0].text.strip()
-            if response_text.startswith('```json'):
-                response_text = response_text.replace('```json', '').replace('```', '').strip()
+    async def analyze_in_stages(self, content):
+        """
+        Run the analysis as separate psych/sales, archetype and coaching calls.
 
-            return json.loads(response_text)
+        Returns (psych, sales, archetype, coaching, used_fallback).
+        """
+        # Psychological and sales analyses are independent - run them in parallel.
+        # Each method returns a fallback on API/parse errors; return_exceptions
+        # keeps anything that still escapes from discarding the other result.
+        psychological_analysis, sales_analysis = await asyncio.gather(
+            self.analyze_psychological_profile(content),
+            self.analyze_sales_performance(content),
+            return_exceptions=True
+        )
+        if isinstance(psychological_analysis, BaseException):
+            logger.error(f"Psychological analysis error: {str(psychological_analysis)}")
+            psychological_analysis = self.get_fallback_psychological_analysis()
+        if isinstance(sales_analysis, BaseException):
+            logger.error(f"Sales analysis error: {str(sales_analysis)}")
+            sales_analysis = self.get_fallback_sales_analysis()
+
+        # Archetype and coaching built on a fallback stub would only restate
+        # the stub, so skip both calls when either analysis failed
+        used_fallback = (psychological_analysis is FALLBACK_PSYCHOLOGICAL_ANALYSIS
+                         or sales_analysis is FALLBACK_SALES_ANALYSIS)
+        if used_fallback:
+            archetype_classification = self.get_fallback_archetype()
+            coaching_recommendations = self.get_fallback_coaching()
+        else:
+            # Archetype needs both analyses, coaching needs the archetype
+            archetype_classification = await self.classify_archetype(psychological_analysis, sales_analysis)
+            coaching_recommendations = await self.generate_coaching_recommendations(
+                psychological_analysis, sales_analysis, archetype_classification
+            )
+            used_fallback = (archetype_classification is FALLBACK_ARCHETYPE
+                             or coaching_recommendations is FALLBACK_COACHING)
 
-        except Exception as e:
-            logger.error(f"Psychological analysis error: {str(e)}")
-            return self.get_fallback_psychological_analysis()
+        return (psychological_analysis, sales_analysis, archetype_classification,
+                coaching_recommendations, used_fallback)
 
-    async def analyze_sales_performance(self, content):
-        """Sales conversation performance analysis"""
+    def _combined_params(self, content):
+        """Request parameters for analyze_combined"""
+        return {
+            "model": transcript_model(content),
+            "max_tokens": 3600,
+            "system": cached_system(COMBINED_INSTRUCTIONS),
+            **forced_tool(COMBINED_TOOL),
+            "messages": [{"role": "user", "content": COMBINED_PROMPT_PREFIX + content}]
+        }
 
-        prompt = f"""
-        Analyze this marriage coaching sales conversation for performance metrics.
-
-        SALES CONVERSATION:
-        {content}
-
-        Provide sales performance analysis in JSON format:
-        {{
-          "overall_assessment": {{
-            "performance_score": 1-100,
-            "grade": "A|B|C|D|F",
-            "conversion_likelihood": 1-100,
-            "key_strengths": ["top 3 strengths"],
-            "improvement_areas": ["top 3 areas needing work"]
-          }},
-          "skills_breakdown": {{
-            "rapport_building": {{ "score": 1-10, "feedback": "specific feedback" }},
-            "discovery_quality": {{ "score": 1-10, "feedback": "question effectiveness" }},
-            "presentation": {{ "score": 1-10, "feedback": "solution presentation quality" }},
-            "objection_handling": {{ "score": 1-10, "feedback": "concern management" }},
-            "closing": {{ "score": 1-10, "feedback": "asking for commitment" }}
-          }},
-          "conversation_metrics": {{
-            "talk_ratio": "rep_percentage:client_percentage",
-            "emotional_connection": 1-10,
-            "trust_building": 1-10
-          }},
-          "client_signals": {{
-            "buying_signals": ["positive indicators"],
-            "objections": ["concerns raised"],
-            "engagement_level": 1-10
-          }}
-        }}
-
-        Respond with ONLY the JSON object.
+    async def analyze_transcript_batch(self, contents, filenames=None, poll_interval=30):
         """
+        Bulk analysis through the Message Batches API.
 
-        try:
-            response = await self.client.messages.create(
-                model="claude-3-5-sonnet-20241022",
-                max_tokens=2000,
-                messages=[{"role": "user", "content": prompt}]
+        Batched requests are billed at half the token price but may take
+        minutes to hours to complete, so this path is meant for offline
+        ingestion - interactive requests use analyze_transcript_content.
+        The pipeline runs as three batches (psych + sales, archetype,
+        coaching) because each stage depends on the previous one.
+        """
+        analysis_contents = await asyncio.gather(*(self.truncate_content(content) for content in contents))
+        filenames = filenames or [f"transcript_{i}.txt" for i in range(len(contents))]
+
+        stage_requests = {}
+        for i, content in enumerate(analysis_contents):
+            stage_requests[f"{i}-psych"] = self._psychological_params(content)
+            stage_requests[f"{i}-sales"] = self._sales_params(content)
+        messages = await self._run_message_batch(stage_requests, poll_interval)
+
+        psych_results = [
+            self._parse_batch_result(messages, f"{i}-psych", PSYCHOLOGICAL_TOOL, self.get_fallback_psychological_analysis)
+            for i in range(len(contents))
+        ]
+        sales_results = [
+            self._parse_batch_result(messages, f"{i}-sales", SALES_TOOL, self.get_fallback_sales_analysis)
+            for i in range(len(contents))
+        ]
+
+        messages = await self._run_message_batch({
+            f"{i}-archetype": self._archetype_params(psych_results[i], sales_results[i])
+            for i in range(len(contents))
+        }, poll_interval)
+        archetype_results = [
+            self._parse_batch_result(messages, f"{i}-archetype", ARCHETYPE_TOOL, self.get_fallback_archetype)
+            for i in range(len(contents))
+        ]
+
+        messages = await self._run_message_batch({
+            f"{i}-coaching": self._coaching_params(psych_results[i], sales_results[i], archetype_results[i])
+            for i in range(len(contents))
+        }, poll_interval)
+        coaching_results = [
+            self._parse_batch_result(messages, f"{i}-coaching", COACHING_TOOL, self.get_fallback_coaching)
+            for i in range(len(contents))
+        ]
+
+        probabilities = self.calculate_success_probability_batch(sales_results, psych_results, archetype_results)
+        return [
+            self.build_result(
+                filenames[i], contents[i], psych_results[i], sales_results[i],
+                archetype_results[i], coaching_results[i], probabilities[i]
             )
+            for i in range(len(contents))
+        ]
+
+    async def submit_transcript_batch(self, transcripts):
+        """
+        Queue [{content, filename}, ...] for analysis without waiting for it.
+
+        Each transcript becomes one fused request in a single message
+        batch, billed at the batch discount. Returns the batch id plus the
+        filename and word count per custom_id, which the results endpoint
+        has no way to recover later.
+        """
+        contents = [transcript['content'] for transcript in transcripts]
+        analysis_contents = await asyncio.gather(*(self.truncate_content(content) for content in contents))
 
-            response_text = response.content[0].text.strip()
-            if response_text.startswith('```json'):
-                response_text = response_text.replace('```json', '').replace('```', '').strip()
+        batch = await self._create_message_batch({
+            str(i): self._combined_params(content) for i, content in enumerate(analysis_contents)
+        })
+        return {
+            'batch_id': batch.id,
+            'processing_status': batch.processing_status,
+            'transcripts': {
+                str(i): {
+                    'filename': transcript.get('filename', f"transcript_{i}.txt"),
+                    'word_count': count_words(transcript['content'])
+                }
+                for i, transcript in enumerate(transcripts)
+            }
+        }
 
-            return json.loads(response_text)
+    async def get_transcript_batch_results(self, batch_id):
+        """
+        Status of a batch from submit_transcript_batch, with the analyses
+        keyed by custom_id once it has ended.
+        """
+        batch = await self.client.messages.batches.retrieve(batch_id)
+        response = {
+            'batch_id': batch.id,
+            'processing_status': batch.processing_status,
+            'request_counts': {
+                name: getattr(batch.request_counts, name)
+                for name in ('processing', 'succeeded', 'errored', 'canceled', 'expired')
+            }
+        }
+        if batch.processing_status != "ended":
+            return response
+
+        messages = await self._message_batch_results(batch.id)
+        results = {}
+        for custom_id in map(str, range(sum(response['request_counts'].values()))):
+            if custom_id not in messages:
+                results[custom_id] = {'status': 'error', 'error': 'Batch request did not succeed'}
+                continue
+            combined = self._parse_batch_result(messages, custom_id, COMBINED_TOOL, lambda: None)
+            if combined is None:
+                results[custom_id] = {'status': 'error', 'error': 'Analysis output unusable'}
+                continue
+            results[custom_id] = {
+                'status': 'success',
+                'psychological_profile': combined['psychological_profile'],
+                'sales_performance': combined['sales_performance'],
+                'archetype_analysis': combined['archetype_analysis'],
+                'coaching_recommendations': combined['coaching_recommendations'],
+                'success_probability': self.calculate_success_probability(
+                    combined['sales_performance'], combined['psychological_profile'], combined['archetype_analysis']
+                )
+            }
+        response['results'] = results
+        return response
+
+    async def _run_message_batch(self, requests, poll_interval):
+        """Submit {custom_id: params} as one batch, wait for it to end and return {custom_id: message}"""
+
+        batch = await self._create_message_batch(requests)
+        while batch.processing_status != "ended":
+            await asyncio.sleep(poll_interval)
+            batch = await self.client.messages.batches.retrieve(batch.id)
+
+        return await self._message_batch_results(batch.id)
+
+    async def _create_message_batch(self, requests):
+        """Submit {custom_id: params} as one message batch"""
+        batch = await self.client.messages.batches.create(
+            requests=[{"custom_id": custom_id, "params": params} for custom_id, params in requests.items()]
+        )
+        logger.info(f"Submitted message batch {batch.id} with {len(requests)} requests")
+        return batch
+
+    async def _message_batch_results(self, batch_id):
+        """{custom_id: message} for the succeeded requests of an ended batch"""
+        messages = {}
+        async for entry in await self.client.messages.batches.results(batch_id):
+            if entry.result.type == "succeeded":
+                messages[entry.custom_id] = entry.result.message
+            else:
+                logger.error(f"Batch request {entry.custom_id} did not succeed: {entry.result.type}")
+        return messages
 
+    def _parse_batch_result(self, messages, custom_id, tool, fallback):
+        """Parse one batch result, falling back when it failed or does not match the tool schema"""
+        try:
+            result = self.parse_message(messages[custom_id])
+            error = schema_error(result, tool["input_schema"])
+            if error is not None:
+                raise ValueError(f"{tool['name']} output invalid: {error}")
+            return result
         except Exception as e:
-            logger.error(f"Sales analysis error: {str(e)}")
-            return self.get_fallback_sales_analysis()
+            logger.error(f"Batch result {custom_id} unusable: {str(e)}")
+            return fallback()
 
-    async def classify_archetype(self, psychological_profile, sales_performance):
-        """Classify client into one of 5 archetypes using AI analysis"""
+    async def truncate_content(self, content):
+        """
+        Limit content to MAX_CONTENT_TOKENS for API efficiency.
 
-        prompt = f"""
-        Based on this psychological and sales analysis, classify the client into one of these 5 archetypes:
+        Only transcripts whose length leaves the token count in doubt are
+        counted; shorter ones pass through and far longer ones, like any
+        whose count fails, are cut to the old character limit. Otherwise
+        the cut is proportional to the measured tokens-per-character ratio.
+        """
+        if len(content) <= MAX_CONTENT_TOKENS * MIN_CHARS_PER_TOKEN:
+            return content
 
-        1. ANALYTICAL RESEARCHER - Data-driven, needs facts and logical arguments
-        2. DESPERATE SAVER - High urgency, emotional, facing relationship crisis
-        3. HOPEFUL BUILDER - Optimistic, growth-focused, future-oriented
-        4. SKEPTICAL EVALUATOR - Cautious, needs proof and guarantees
-        5. CONSENSUS SEEKER - Involves others, needs group approval
+        if len(content) > MAX_CONTENT_TOKENS * MAX_CHARS_PER_TOKEN:
+            cut = MAX_CONTENT_CHARS
+        else:
+            try:
+                input_tokens = await self.count_tokens(content)
+                if input_tokens <= MAX_CONTENT_TOKENS:
+                    return content
+                cut = int(len(content) * MAX_CONTENT_TOKENS / input_tokens * 0.95)
+            except Exception as e:
+                logger.error(f"Token count error: {str(e)}")
+                if len(content) <= MAX_CONTENT_CHARS:
+                    return content
+                cut = MAX_CONTENT_CHARS
+
+        # Cut on a word boundary when there is one near the limit
+        boundary = content.rfind(' ', cut - 200, cut)
+        if boundary != -1:
+            cut = boundary
+        return content[:cut] + TRUNCATION_SUFFIX
+
+    async def count_tokens(self, content):
+        """Input tokens of content as a user message, cached per transcript"""
+        cache_key = hashlib.sha256(f"{ANALYSIS_MODEL}\x1f{content}".encode('utf-8')).hexdigest()
+        input_tokens = TOKEN_COUNT_CACHE.get(cache_key)
+        if input_tokens is None:
+            count = await call_with_backoff(lambda: self.client.messages.count_tokens(
+                model=ANALYSIS_MODEL,
+                messages=[{"role": "user", "content": content}]
+            ))
+            input_tokens = count.input_tokens
+            TOKEN_COUNT_CACHE.set(cache_key, input_tokens)
+        return input_tokens
+
+    def build_result(self, filename, content, psychological_analysis, sales_analysis,
+                     archetype_classification, coaching_recommendations, success_probability=None):
+        """
+        Assemble the response payload shared by the interactive and batch paths.
 
-        PSYCHOLOGICAL PROFILE:
-        {json.dumps(psychological_profile, indent=2)}
+        content is the original transcript, so word_count is not affected by
+        truncation. The batch path passes a precomputed success_probability.
+        """
 
-        SALES PERFORMANCE:
-        {json.dumps(sales_performance, indent=2)}
+        if success_probability is None:
+            success_probability = self.calculate_success_probability(
+                sales_analysis, psychological_analysis, archetype_classification
+            )
 
-        Respond with JSON:
-        {{
-          "primary_archetype": "exact archetype name from list above",
-          "confidence_score": 0.0-1.0,
-          "secondary_archetype": "second most likely archetype",
-          "reasoning": "brief explanation of classification",
-          "key_characteristics": ["3 key traits that led to this classification"]
-        }}
+        return {
+            'transcript_id': filename,
+            'analysis_timestamp': datetime.now().isoformat(),
+            'status': 'success',
+            'word_count': count_words(content),
+            'psychological_profile': psychological_analysis,
+            'sales_performance': sales_analysis,
+            'archetype_analysis': archetype_classification,
+            'coaching_recommendations': coaching_recommendations,
+            'success_probability': success_probability
+        }
 
-        Respond with ONLY the JSON object.
+    async def _analyze(self, build_params, args, fallback, operation_name):
         """
+        Shared body of the four analyzer methods.
 
+        The public methods are plain functions returning this coroutine
+        rather than async wrappers around it, which saves a coroutine
+        frame per call. Building the params happens in here so prompt
+        errors still end in the fallback.
+        """
         try:
-            response = await self.client.messages.create(
-                model="claude-3-5-sonnet-20241022",
-                max_tokens=1000,
-                messages=[{"role": "user", "content": prompt}]
-            )
+            return await self._complete_json(build_params(*args))
 
-            response_text = response.content[0].text.strip()
-            if response_text.startswith('```json'):
-                response_text = response_text.replace('```json', '').replace('```', '').strip()
+        except Exception as e:
+            logger.error(f"{operation_name} error: {str(e)}")
+            return fallback()
 
-            return json.loads(response_text)
+    async def _complete_json(self, params):
+        """
+        Run one analyzer request, serving repeats from the response cache.
 
-        except Exception as e:
-            logger.error(f"Archetype classification error: {str(e)}")
-            return self.get_fallback_archetype()
+        Output that does not match the tool schema gets one retry with the
+        problem pointed out; a second miss raises so the caller falls back.
+        """
+        cache_key = response_cache_key(params)
+        cached = RESPONSE_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
+
+        tool = params["tools"][0]
+        result = await self._request_json(params)
+        error = schema_error(result, tool["input_schema"])
+        if error is not None:
+            logger.warning(f"{tool['name']} output invalid ({error}), retrying once")
+            result = await self._request_json({
+                **params,
+                "system": params["system"] + [{
+                    "type": "text",
+                    "text": f"Your previous answer was rejected: {error}. "
+                            f"Call {tool['name']} with input that matches its schema exactly."
+                }]
+            })
+            error = schema_error(result, tool["input_schema"])
+            if error is not None:
+                raise ValueError(f"{tool['name']} output invalid: {error}")
+
+        # Only validated results are cached - fallbacks are never stored
+        RESPONSE_CACHE.set(cache_key, result)
+        return result
+
+    async def _request_json(self, params):
+        """Send one request and return its parsed tool input"""
+        response = await stream_with_backoff(self.client, params)
+        if logger.isEnabledFor(logging.DEBUG):
+            # Prompts under the model's minimum cacheable length are silently not cached
+            usage = response.usage
+            logger.debug(
+                f"{params['tools'][0]['name']}: {usage.input_tokens} input tokens, "
+                f"{usage.cache_read_input_tokens or 0} read from prompt cache, "
+                f"{usage.cache_creation_input_tokens or 0} written to it"
+            )
+        if response.stop_reason == "max_tokens":
+            logger.warning(f"Response hit max_tokens={params['max_tokens']} - raise the limit if this repeats")
+        return self.parse_message(response)
 
-    async def generate_coaching_recommendations(self, psychological_profile, sales_performance, archetype):
-        """Generate actionable coaching recommendations"""
+    @classmethod
+    def parse_message(cls, message):
+        """
+        Extract the analysis dict from a Messages API response.
 
-        archetype_name = archetype.get('primary_archetype', 'Mixed Profile')
-        sales_score = sales_performance.get('overall_assessment', {}).get('performance_score', 50)
+        Requests force a tool call, so the answer is normally the tool_use
+        block's already-parsed input; text output is still parsed as JSON
+        in case a response comes back without the tool call.
+        """
+        for block in message.content:
+            if block.type == "tool_use":
+                return block.input
+        text = "".join(block.text for block in message.content if block.type == "text")
+        return cls.parse_json_response(text)
+
+    @staticmethod
+    def parse_json_response(response_text):
+        """
+        Parse model output into a dict, tolerating common format drift.
 
-        prompt = f"""
-        Generate specific coaching recommendations for this sales conversation.
-
-        CLIENT ARCHETYPE: {archetype_name}
-        SALES PERFORMANCE SCORE: {sales_score}/100
-
-        Based on the analysis, provide actionable coaching in JSON format:
-        {{
-          "immediate_action_plan": {{
-            "top_3_priorities": ["specific action items for next interaction"],
-            "follow_up_timing": "1-2 days|3-5 days|1 week|2+ weeks",
-            "follow_up_method": "email|phone|text|video",
-            "key_message_focus": "primary theme for follow-up"
-          }},
-          "communication_strategy": {{
-            "tone_adjustments": "specific tone recommendations",
-            "language_style": "formal|conversational|empathetic|direct",
-            "key_phrases_to_use": ["effective phrases for this archetype"],
-            "topics_to_emphasize": ["important points to highlight"],
-            "topics_to_avoid": ["sensitive areas to avoid"]
-          }},
-          "sales_technique_improvements": {{
-            "discovery_improvements": ["better questions to ask"],
-            "presentation_adjustments": ["how to present solutions"],
-            "closing_recommendations": ["effective closing approaches"],
-            "objection_handling": ["how to address likely concerns"]
-          }}
-        }}
-
-        Focus on actionable, psychology-based recommendations. Respond with ONLY the JSON object.
+        Tries a direct parse first, then the first balanced {...} block
+        (surrounding prose, stray fences), then the same block with
+        trailing commas removed. Raises ValueError if nothing parses.
         """
+        if '<think>' in response_text:
+            response_text = _THINK_RE.sub('', response_text)
+        response_text = response_text.strip()
+        if response_text.startswith('```'):
+            response_text = _FENCE_RE.sub('', response_text)
 
         try:
-            response = await self.client.messages.create(
-                model="claude-3-5-sonnet-20241022",
-                max_tokens=1500,
-                messages=[{"role": "user", "content": prompt}]
-            )
+            return orjson.loads(response_text)
+        except orjson.JSONDecodeError:
+            pass
 
-            response_text = response.content[0].text.strip()
-            if response_text.startswith('```json'):
-                response_text = response_text.replace('```json', '').replace('```', '').strip()
+        candidate = find_json_object(response_text)
+        if candidate is None:
+            raise ValueError("No JSON object found in model response")
+        try:
+            return orjson.loads(candidate)
+        except orjson.JSONDecodeError:
+            return orjson.loads(_TRAILING_COMMA_RE.sub(r'\1', candidate))
 
-            return json.loads(response_text)
+    def _psychological_params(self, content):
+        """Request parameters for analyze_psychological_profile"""
+        return {
+            "model": transcript_model(content),
+            "max_tokens": 1200,
+            "system": cached_system(PSYCHOLOGICAL_INSTRUCTIONS),
+            **forced_tool(PSYCHOLOGICAL_TOOL),
+            "messages": [{"role": "user", "content": PSYCHOLOGICAL_PROMPT_PREFIX + content}]
+        }
 
-        except Exception as e:
-            logger.error(f"Coaching recommendations error: {str(e)}")
-            return self.get_fallback_coaching()
+    def analyze_psychological_profile(self, content):
+        """Big Five personality analysis with coaching insights"""
+        return self._analyze(self._psychological_params, (content,), self.get_fallback_psychological_analysis, "Psychological analysis")
 
-    def calculate_success_probability(self, sales_performance, psychological_profile, archetype):
-        """Calculate conversion probability based on analysis"""
+    def _sales_params(self, content):
+        """Request parameters for analyze_sales_performance"""
+        return {
+            "model": transcript_model(content),
+            "max_tokens": 1200,
+            "system": cached_system(SALES_INSTRUCTIONS),
+            **forced_tool(SALES_TOOL),
+            "messages": [{"role": "user", "content": SALES_PROMPT_PREFIX + content}]
+        }
 
-        try:
-            # Base score from sales performance
-            base_score = sales_performance.get('overall_assessment', {}).get('performance_score', 50) / 100
-
-            # Archetype confidence factor
-            archetype_confidence = archetype.get('confidence_score', 0.5)
-
-            # Emotional state factor
-            emotional_state = psychological_profile.get('emotional_state', {})
-            emotional_intensity = emotional_state.get('intensity', 5)
-            emotional_factor = min(emotional_intensity / 10, 1.0)
-
-            # Weighted calculation
-            success_probability = (
-                base_score * 0.6 +
-                archetype_confidence * 0.2 +
-                emotional_factor * 0.2
-            )
+    def analyze_sales_performance(self, content):
+        """Sales conversation performance analysis"""
+        return self._analyze(self._sales_params, (content,), self.get_fallback_sales_analysis, "Sales analysis")
 
-            return min(max(success_probability, 0.1), 0.95)  # Keep between 10% and 95%
+    def _archetype_params(self, psychological_profile, sales_performance):
+        """Request parameters for classify_archetype"""
 
-        except Exception as e:
-            logger.error(f"Success probability calculation error: {str(e)}")
-            return 0.5
+        # Compact JSON - indentation only adds input tokens
+        prompt = (
+            ARCHETYPE_PROMPT_PREFIX
+            + orjson.dumps(psychological_profile).decode()
+            + ARCHETYPE_PROMPT_SEPARATOR
+            + orjson.dumps(sales_performance).decode()
+        )
 
-    # Fallback methods for error handling
-    def get_fallback_psychological_analysis(self):
         return {
-            "big_five_personality": {
-                "openness": {"score": 50, "confidence": 50, "implications": "analysis unavailable"},
-                "conscientiousness": {"score": 50, "confidence": 50, "implications": "analysis unavailable"},
-                "extraversion": {"score": 50, "confidence": 50, "implications": "analysis unavailable"},
-                "agreeableness": {"score": 50, "confidence": 50, "implications": "analysis unavailable"},
-                "neuroticism": {"score": 50, "confidence": 50, "implications": "analysis unavailable"}
-            },
-            "decision_making_style": {"primary_style": "mixed", "confidence": 50},
-            "emotional_state": {"primary_emotion": "neutral", "intensity": 5, "stability": 5}
+            "model": FAST_MODEL,
+            "max_tokens": 400,
+            "system": cached_system(ARCHETYPE_INSTRUCTIONS),
+            **forced_tool(ARCHETYPE_TOOL),
+            "messages": [{"role": "user", "content": prompt}]
         }
 
-    def get_fallback_sales_analysis(self):
+    def classify_archetype(self, psychological_profile, sales_performance):
+        """Classify client into one of 5 archetypes using AI analysis"""
+        return self._analyze(self._archetype_params, (psychological_profile, sales_performance), self.get_fallback_archetype, "Archetype classification")
+
+    def _coaching_params(self, psychological_profile, sales_performance, archetype):
+        """Request parameters for generate_coaching_recommendations"""
+
+        archetype_name = archetype.get('primary_archetype', 'Mixed Profile')
+        sales_score = sales_performance.get('overall_assessment', {}).get('performance_score', 50)
+
         return {
-            "overall_assessment": {
-                "performance_score": 50,
-                "grade": "C",
-                "conversion_likelihood": 50,
-                "key_strengths": ["analysis unavailable"],
-                "improvement_areas": ["analysis unavailable"]
-            },
-            "skills_breakdown": {
-                "rapport_building": {"score": 5, "feedback": "analysis unavailable"},
-                "discovery_quality": {"score": 5, "feedback": "analysis unavailable"},
-                "presentation": {"score": 5, "feedback": "analysis unavailable"},
-                "objection_handling": {"score": 5, "feedback": "analysis unavailable"},
-                "closing": {"score": 5, "feedback": "analysis unavailable"}
-            }
+            "model": FAST_MODEL,
+            "max_tokens": 800,
+            "system": cached_system(COACHING_INSTRUCTIONS),
+            **forced_tool(COACHING_TOOL),
+            "messages": [{
+                "role": "user",
+                "content": (
+                    COACHING_PROMPT_PREFIX + str(archetype_name)
+                    + COACHING_PROMPT_SEPARATOR + str(sales_score) + COACHING_PROMPT_SUFFIX
+                )
+            }]
         }
 
+    def generate_coaching_recommendations(self, psychological_profile, sales_performance, archetype):
+        """Generate actionable coaching recommendations"""
+        return self._analyze(self._coaching_params, (psychological_profile, sales_performance, archetype), self.get_fallback_coaching, "Coaching recommendations")
+
+    def calculate_success_probability(self, sales_performance, psychological_profile, archetype):
+        """
+        Calculate conversion probability based on analysis.
+
+        Inputs are tool-schema validated results or fallbacks, so missing
+        sections just take the neutral defaults.
+        """
+        base_score = ((sales_performance.get('overall_assessment') or {}).get('performance_score') or 50) / 100
+        archetype_confidence = archetype.get('confidence_score') or 0.5
+        emotional_factor = min(((psychological_profile.get('emotional_state') or {}).get('intensity') or 5) / 10, 1.0)
+
+        # Weighted calculation, kept between 10% and 95%
+        success_probability = base_score * 0.6 + archetype_confidence * 0.2 + emotional_factor * 0.2
+        return min(max(success_probability, 0.1), 0.95)
+
+    def calculate_success_probability_batch(self, sales_performances, psychological_profiles, archetypes):
+        """calculate_success_probability over parallel lists of batch results"""
+        calculate = self.calculate_success_probability
+        return list(map(calculate, sales_performances, psychological_profiles, archetypes))
+
+    # Fallback methods for error handling
+    def get_fallback_psychological_analysis(self):
+        return FALLBACK_PSYCHOLOGICAL_ANALYSIS
+
+    def get_fallback_sales_analysis(self):
+        return FALLBACK_SALES_ANALYSIS
+
     def get_fallback_archetype(self):
-        return {
-            "primary_archetype": "Mixed Profile",
-            "confidence_score": 0.5,
-            "secondary_archetype": "Hopeful Builder",
-            "reasoning": "analysis unavailable"
-        }
+        return FALLBACK_ARCHETYPE
 
     def get_fallback_coaching(self):
-        return {
-            "immediate_action_plan": {
-                "top_3_priorities": ["follow up within 48 hours", "address main concerns", "provide additional value"],
-                "follow_up_timing": "2-3 days",
-                "follow_up_method": "email"
-            }
-        }
+        return FALLBACK_COACHING
 
-# Vercel serverless function handler
-from http.server import BaseHTTPRequestHandler
+# Vercel serverless function entry point (ASGI)
 import urllib.parse
 
-class handler(BaseHTTPRequestHandler):
-    def do_OPTIONS(self):
-        """Handle CORS preflight requests"""
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
-
-    def do_POST(self):
-        """Handle POST requests for AI analysis"""
-        try:
-            # Get API key from environment with debugging
-            api_key = os.environ.get('ANTHROPIC_API_KEY')
-
-            # Debug logging for environment variables
-            logger.info(f"Environment variables available: {list(os.environ.keys())}")
-            logger.info(f"ANTHROPIC_API_KEY present: {'ANTHROPIC_API_KEY' in os.environ}")
-            if api_key:
-                logger.info(f"API key found, length: {len(api_key)}, starts with: {api_key[:10]}...")
-            else:
-                logger.error("API key not found in environment variables")
-
-            if not api_key:
-                self.send_error_response(500, {
-                    'error': 'API key not configured',
-                    'message': 'Please set ANTHROPIC_API_KEY environment variable in Vercel',
-                    'debug': {
-                        'env_vars_count': len(os.environ),
-                        'has_anthropic_key': 'ANTHROPIC_API_KEY' in os.environ,
-                        'available_keys': [k for k in os.environ.keys() if 'API' in k.upper() or 'ANTHROP' in k.upper()]
-                    }
-                })
-                return
-
-            # Read request body
-            content_length = int(self.headers.get('Content-Length', 0))
-            if content_length == 0:
-                self.send_error_response(400, {'error': 'Empty request body'})
-                return
-
-            post_data = self.rfile.read(content_length)
-
-            # Parse JSON
-            try:
-                body = json.loads(post_data.decode('utf-8'))
-            except json.JSONDecodeError:
-                self.send_error_response(400, {'error': 'Invalid JSON in request body'})
-                return
-
-            # Validate required fields
-            if 'content' not in body:
-                self.send_error_response(400, {'error': 'Missing required field: content'})
-                return
-
-            content = body['content']
-            filename = body.get('filename', 'transcript.txt')
-
-            # Validate content
-            if not content or len(content.strip()) < 100:
-                self.send_error_response(400, {
-                    'error': 'Content too short. Please provide at least 100 characters of transcript content.'
-                })
-                return
-
-            # Initialize analyzer and run analysis
-            analyzer = ServerlessAnalyzer(api_key)
-            result = asyncio.run(analyzer.analyze_transcript_content(content, filename))
-
-            # Send success response
-            self.send_response(200)
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(result).encode('utf-8'))
-
-        except Exception as e:
-            logger.error(f"Serverless function error: {str(e)}")
-            self.send_error_response(500, {
-                'error': 'Internal server error',
-                'message': str(e)
+# Vercel injects environment variables at container start, so read the key once
+_API_KEY = os.environ.get('ANTHROPIC_API_KEY')
+
+# Static response headers and error bodies, built once per container
+JSON_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'content-type', b'application/json'),
+]
+PREFLIGHT_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-methods', b'GET, POST, OPTIONS'),
+    (b'access-control-allow-headers', b'Content-Type'),
+]
+EMPTY_BODY_ERROR = orjson.dumps({'error': 'Empty request body'})
+INVALID_JSON_ERROR = orjson.dumps({'error': 'Invalid JSON in request body'})
+MISSING_CONTENT_ERROR = orjson.dumps({'error': 'Missing required field: content'})
+CONTENT_TOO_SHORT_ERROR = orjson.dumps({
+    'error': 'Content too short. Please provide at least 100 characters of transcript content.'
+})
+MISSING_TRANSCRIPTS_ERROR = orjson.dumps({'error': 'Missing required field: transcripts'})
+NOT_FOUND_ERROR = orjson.dumps({'error': 'Not found'})
+METHOD_NOT_ALLOWED_ERROR = orjson.dumps({'error': 'Method not allowed'})
+
+# Asynchronous batch analysis lives under /api/analyze/batch: POST submits,
+# GET /api/analyze/batch/<batch_id> polls. vercel.json rewrites both to this
+# function with the route in the query string.
+BATCH_PATH = '/api/analyze/batch'
+MAX_BATCH_TRANSCRIPTS = 100
+
+
+def batch_route(path):
+    """(is_batch_request, batch_id or None) for a request path"""
+    url = urllib.parse.urlsplit(path)
+    query = urllib.parse.parse_qs(url.query)
+    if query.get('batch_id'):
+        return True, query['batch_id'][0]
+    if url.path.startswith(BATCH_PATH):
+        return True, url.path[len(BATCH_PATH):].strip('/') or None
+    return 'batch' in query, None
+
+
+def api_key_error():
+    """Error body for a missing API key, or None when it is configured"""
+
+    # Environment introspection walks every variable, so only on debug
+    debug_enabled = logger.isEnabledFor(logging.DEBUG)
+    if debug_enabled:
+        logger.debug(f"Environment variables available: {list(os.environ.keys())}")
+        if _API_KEY:
+            logger.debug(f"API key found, length: {len(_API_KEY)}, starts with: {_API_KEY[:10]}...")
+
+    if _API_KEY:
+        return None
+
+    logger.error("API key not found in environment variables")
+    debug = {
+        'env_vars_count': len(os.environ),
+        'has_anthropic_key': 'ANTHROPIC_API_KEY' in os.environ
+    }
+    if debug_enabled:
+        debug['available_keys'] = [k for k in os.environ if 'API' in k.upper() or 'ANTHROP' in k.upper()]
+    return orjson.dumps({
+        'error': 'API key not configured',
+        'message': 'Please set ANTHROPIC_API_KEY environment variable in Vercel',
+        'debug': debug
+    })
+
+
+async def handle_get(path):
+    """Batch status/result polling. Returns (status, body)"""
+    batch_id = batch_route(path)[1]
+    if not batch_id:
+        return 404, NOT_FOUND_ERROR
+
+    key_error = api_key_error()
+    if key_error is not None:
+        return 500, key_error
+
+    result = await ServerlessAnalyzer(_API_KEY).get_transcript_batch_results(batch_id)
+    return 200, orjson.dumps(result)
+
+
+async def handle_post(path, raw_body):
+    """Interactive analysis, or batch submission on the batch route. Returns (status, body)"""
+    key_error = api_key_error()
+    if key_error is not None:
+        return 500, key_error
+
+    if not raw_body:
+        return 400, EMPTY_BODY_ERROR
+
+    # Parse JSON straight from the body bytes - orjson validates the UTF-8
+    try:
+        body = orjson.loads(raw_body)
+    except orjson.JSONDecodeError:
+        return 400, INVALID_JSON_ERROR
+
+    if batch_route(path)[0]:
+        return await submit_batch(body)
+
+    # Validate required fields
+    if not isinstance(body, dict) or 'content' not in body:
+        return 400, MISSING_CONTENT_ERROR
+
+    content = body['content']
+    filename = body.get('filename', 'transcript.txt')
+
+    # Validate content
+    if not content or len(content.strip()) < 100:
+        return 400, CONTENT_TOO_SHORT_ERROR
+
+    result = await ServerlessAnalyzer(_API_KEY).analyze_transcript_content(content, filename)
+    return 200, orjson.dumps(result)
+
+
+async def submit_batch(body):
+    """Validate {transcripts: [{content, filename}, ...]} and queue it as a message batch"""
+    transcripts = body.get('transcripts') if isinstance(body, dict) else None
+    if not isinstance(transcripts, list) or not transcripts:
+        return 400, MISSING_TRANSCRIPTS_ERROR
+    if len(transcripts) > MAX_BATCH_TRANSCRIPTS:
+        return 400, orjson.dumps({
+            'error': f'Too many transcripts. Submit at most {MAX_BATCH_TRANSCRIPTS} per batch.'
+        })
+    for i, transcript in enumerate(transcripts):
+        content = transcript.get('content') if isinstance(transcript, dict) else None
+        if not content or len(content.strip()) < 100:
+            return 400, orjson.dumps({
+                'error': f'Transcript {i}: content too short. Please provide at least 100 characters of transcript content.'
             })
 
-    def send_error_response(self, status_code, error_data):
-        """Send error response with CORS headers"""
-        self.send_response(status_code)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Content-Type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps(error_data).encode('utf-8'))
+    result = await ServerlessAnalyzer(_API_KEY).submit_transcript_batch(transcripts)
+    return 202, orjson.dumps(result)
+
+
+async def read_body(receive):
+    """Collect the full ASGI request body"""
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+async def send_body(send, status, body, headers=JSON_HEADERS):
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def lifespan(receive, send):
+    """Close the shared client's connection pool when the container shuts down"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _CLIENT is not None:
+                await _CLIENT.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """
+    ASGI application served by the Vercel Python runtime.
+
+    Requests run directly on the server's event loop, so a warm container
+    can have several analyses in flight at once, all sharing the module
+    client's connection pool.
+    """
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    method = scope['method']
+    path = scope['path']
+    if scope.get('query_string'):
+        path += '?' + scope['query_string'].decode('latin-1')
+
+    try:
+        if method == 'OPTIONS':
+            # Handle CORS preflight requests
+            await send_body(send, 200, b'', PREFLIGHT_HEADERS)
+            return
+        if method == 'GET':
+            status, body = await handle_get(path)
+        elif method == 'POST':
+            status, body = await handle_post(path, await read_body(receive))
+        else:
+            status, body = 405, METHOD_NOT_ALLOWED_ERROR
+
+    except Exception as e:
+        logger.error(f"Serverless function error: {str(e)}")
+        status, body = 500, orjson.dumps({
+            'error': 'Internal server error',
+            'message': str(e)
+        })
+
+    await send_body(send, status, body)
 
 # For local testing
 if __name__ == "__main__":
@@ -3,36 +3,64 @@ Simple health check endpoint to verify Vercel environment variables
 """
 
 import os
-import json
+import logging
 from http.server import BaseHTTPRequestHandler
 
+import orjson
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Vercel injects environment variables at container start, so read the key once
+_API_KEY = os.environ.get('ANTHROPIC_API_KEY')
+
+
+def env_var_names():
+    """Names of API, Anthropic and Vercel variables, collected in one pass over os.environ"""
+    api_keys, anthropic_vars, vercel_vars = [], [], []
+    for name in os.environ:
+        upper = name.upper()
+        if 'API' in upper:
+            api_keys.append(name)
+        if 'ANTHROP' in upper:
+            anthropic_vars.append(name)
+        if 'VERCEL' in upper:
+            vercel_vars.append(name)
+    return api_keys, anthropic_vars, vercel_vars
+
+
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
         """Health check endpoint"""
         try:
-            # Get API key from environment
-            api_key = os.environ.get('ANTHROPIC_API_KEY')
+            api_key = _API_KEY
 
             health_data = {
                 'status': 'healthy',
                 'timestamp': '2024-01-01T00:00:00Z',
                 'environment': {
                     'total_env_vars': len(os.environ),
-                    'has_anthropic_key': 'ANTHROPIC_API_KEY' in os.environ,
+                    'has_anthropic_key': api_key is not None,
                     'api_key_length': len(api_key) if api_key else 0,
-                    'api_key_prefix': api_key[:15] + '...' if api_key and len(api_key) > 15 else 'NOT_FOUND',
-                    'all_api_keys': [k for k in os.environ.keys() if 'API' in k.upper()],
-                    'anthropic_vars': [k for k in os.environ.keys() if 'ANTHROP' in k.upper()],
-                    'vercel_vars': [k for k in os.environ.keys() if 'VERCEL' in k.upper()]
+                    'api_key_prefix': api_key[:15] + '...' if api_key and len(api_key) > 15 else 'NOT_FOUND'
                 }
             }
 
+            # Variable name listings walk the whole environment, so only on debug
+            if logger.isEnabledFor(logging.DEBUG):
+                api_keys, anthropic_vars, vercel_vars = env_var_names()
+                health_data['environment'].update({
+                    'all_api_keys': api_keys,
+                    'anthropic_vars': anthropic_vars,
+                    'vercel_vars': vercel_vars
+                })
+
             # Send response
             self.send_response(200)
             self.send_header('Content-Type', 'application/json')
             self.send_header('Access-Control-Allow-Origin', '*')
             self.end_headers()
-            self.wfile.write(json.dumps(health_data, indent=2).encode('utf-8'))
+            self.wfile.write(orjson.dumps(health_data, option=orjson.OPT_INDENT_2))
 
         except Exception as e:
             error_data = {
@@ -48,4 +76,4 @@ class handler(BaseHTTPRequestHandler):
             self.send_header('Content-Type', 'application/json')
             self.send_header('Access-Control-Allow-Origin', '*')
             self.end_headers()
-            self.wfile.write(json.dumps(error_data, indent=2).encode('utf-8'))
\ No newline at end of file
+            self.wfile.write(orjson.dumps(error_data, option=orjson.OPT_INDENT_2))
\ No newline at end of file
@@ -3,18 +3,22 @@ Enhanced Marriage Coaching Sales Call Analyzer
 Surgical analysis for marriage coaching sales with empathetic confrontation tracking
 """
 
-import json
 import os
 import asyncio
+import copy
+import random
+from collections import OrderedDict, defaultdict, deque
 from datetime import datetime
 import logging
 import time
 import re
 import hashlib
-from http.server import BaseHTTPRequestHandler
+
+import orjson
 
 try:
-    from anthropic import AsyncAnthropic, APIError, RateLimitError, APITimeoutError
+    import httpx
+    from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient, APIError, RateLimitError, APITimeoutError
 except ImportError:
     pass
 
@@ -123,111 +127,404 @@ def convert_timestamp_to_simple(timestamp):
         logger.warning(f"Failed to parse timestamp '{timestamp}': {e}")
     return timestamp
 
-class MarriageCoachingAnalyzer:
-    """Surgical marriage coaching sales analyzer with framework from proven systems"""
-
-    def __init__(self, api_key, max_retries=3, timeout=120):
-        self.client = AsyncAnthropic(api_key=api_key, timeout=timeout)
-        # Model configuration - easy to update when models change
-        self.model = "claude-sonnet-4-5"  # Upgraded to Claude Sonnet 4.5 (latest)
-        self.max_retries = max_retries
-        self.timeout = timeout
-
-        # Marriage Reset package definitions
-        self.packages = {
-            'MRL': {'name': 'Marriage Reset Light', 'price': 2300, 'description': 'Self-paced course'},
-            'MRS': {'name': 'Marriage Reset Standard', 'price': None, 'description': 'Course + 2 coaching calls + weekly group'},
-            'MRP': {'name': 'Marriage Reset Plus', 'price': None, 'description': 'Course + 5 coaching sessions + weekly group'},
-            'MRI': {'name': 'Marriage Reset Intensive', 'price': 11800, 'description': 'Course + 16 coaching sessions + weekly group'}
-        }
-
-    async def _call_api_with_retry(self, prompt, max_tokens, operation_name="API call"):
-        """
-        Make API call with exponential backoff retry logic
-
-        Args:
-            prompt: The prompt to send to Claude
-            max_tokens: Maximum tokens for response
-            operation_name: Name of the operation for logging
-
-        Returns:
-            API response text
-
-        Raises:
-            Exception: If all retries fail
-        """
-        last_error = None
-
-        for attempt in range(self.max_retries):
-            try:
-                logger.info(f"{operation_name} - Attempt {attempt + 1}/{self.max_retries}")
-
-                response = await self.client.messages.create(
-                    model=self.model,
-                    max_tokens=max_tokens,
-                    temperature=0.3,  # Low temperature for consistent, deterministic scoring
-                    messages=[{"role": "user", "content": prompt}]
-                )
-
-                response_text = response.content[0].text.strip()
-                logger.info(f"{operation_name} - Success on attempt {attempt + 1}")
-                return response_text
-
-            except RateLimitError as e:
-                last_error = e
-                wait_time = (2 ** attempt) * 2  # Exponential backoff: 2s, 4s, 8s
-                logger.warning(f"{operation_name} - Rate limit hit on attempt {attempt + 1}. Waiting {wait_time}s before retry...")
-                if attempt < self.max_retries - 1:
-                    await asyncio.sleep(wait_time)
-                else:
-                    logger.error(f"{operation_name} - Rate limit exceeded after {self.max_retries} attempts")
+def cached_system(instructions):
+    """System prompt block marked for Anthropic prompt caching"""
+    return [{"type": "text", "text": instructions, "cache_control": {"type": "ephemeral"}}]
 
-            except APITimeoutError as e:
-                last_error = e
-                logger.warning(f"{operation_name} - Timeout on attempt {attempt + 1}/{self.max_retries}")
-                if attempt < self.max_retries - 1:
-                    wait_time = 2 ** attempt  # Exponential backoff: 1s, 2s, 4s
-                    await asyncio.sleep(wait_time)
-                else:
-                    logger.error(f"{operation_name} - Timeout after {self.max_retries} attempts")
+# Connection pool for the shared client; one analysis runs up to eight calls at once
+MAX_CONNECTIONS = 20
+MAX_KEEPALIVE_CONNECTIONS = 10
 
-            except APIError as e:
-                last_error = e
-                error_code = getattr(e, 'status_code', 'unknown')
-                logger.warning(f"{operation_name} - API error ({error_code}) on attempt {attempt + 1}: {str(e)}")
+# Shared client so warm containers reuse the httpx connection pool (and its
+# TLS sessions) instead of building a new one per analyzer.
+_CLIENT = None
+_CLIENT_CONFIG = None
+_CLOSING_CLIENTS = set()  # Close tasks of replaced clients, referenced until done
 
-                # Don't retry on client errors (4xx), only server errors (5xx)
-                if error_code and str(error_code).startswith('4'):
-                    logger.error(f"{operation_name} - Client error, not retrying")
-                    raise
+async def close_client(client):
+    """Close a replaced client's pool; one opened on a since-closed loop may fail to"""
+    try:
+        await client.close()
+    except Exception as e:
+        logger.warning(f"Could not close replaced Anthropic client: {str(e)}")
 
-                if attempt < self.max_retries - 1:
-                    wait_time = 2 ** attempt
-                    await asyncio.sleep(wait_time)
-                else:
-                    logger.error(f"{operation_name} - API error persisted after {self.max_retries} attempts")
+def get_client(api_key, timeout):
+    """
+    Return the module-level AsyncAnthropic client, creating it on first use.
 
-            except Exception as e:
-                last_error = e
-                logger.error(f"{operation_name} - Unexpected error on attempt {attempt + 1}: {type(e).__name__}: {str(e)}")
-                if attempt < self.max_retries - 1:
-                    wait_time = 2 ** attempt
-                    await asyncio.sleep(wait_time)
-                else:
-                    logger.error(f"{operation_name} - Failed after {self.max_retries} attempts")
+    httpx async connections belong to the event loop that opened them, so the
+    client is rebuilt if requested from a different loop or with other
+    settings, and the one it replaces is closed in the background. Under the
+    ASGI app every request shares the server's loop and therefore the same
+    pool. Must be called from inside a running event loop.
 
-        # If we get here, all retries failed
-        raise Exception(f"{operation_name} failed after {self.max_retries} attempts: {str(last_error)}")
+    SDK retries are off; _create_message_with_retry handles retries itself so
+    the attempts don't multiply.
+    """
+    global _CLIENT, _CLIENT_CONFIG
+
+    config = (api_key, timeout, asyncio.get_running_loop())
+    if _CLIENT is None or _CLIENT_CONFIG != config:
+        if _CLIENT is not None:
+            task = asyncio.ensure_future(close_client(_CLIENT))
+            _CLOSING_CLIENTS.add(task)
+            task.add_done_callback(_CLOSING_CLIENTS.discard)
+        _CLIENT = AsyncAnthropic(
+            api_key=api_key,
+            max_retries=0,
+            timeout=timeout,
+            http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS
+            ))
+        )
+        _CLIENT_CONFIG = config
+    return _CLIENT
+
+# Cap on in-flight Claude requests per container, so concurrent analyses
+# queue locally instead of tripping the account's rate limit
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('ANTHROPIC_MAX_CONCURRENCY', '20'))
+
+# Status codes worth retrying; other 4xx errors fail immediately
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+MAX_BACKOFF_SECONDS = 30
+
+def backoff_seconds(error, attempt, base=1):
+    """
+    Seconds to wait before retrying after error.
 
-    async def detect_call_outcome(self, content):
-        """
-        Detect if call was won/lost and identify which package was discussed/purchased.
-        Specific to Marriage Reset methodology with early price positioning.
-        """
-        prompt = f"""Analyze this marriage coaching sales call to determine the outcome and packages discussed.
+    Honors the API's Retry-After header when it sends one; otherwise
+    exponential backoff with jitter, so concurrent calls that failed
+    together don't all retry at the same instant.
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    retry_after = headers.get('retry-after')
+    if retry_after:
+        try:
+            return min(float(retry_after), MAX_BACKOFF_SECONDS)
+        except ValueError:
+            pass
+    return min(base * 2 ** attempt + random.uniform(0, base), MAX_BACKOFF_SECONDS)
+
+# Wall-clock budget for each separately gathered analysis, retries included,
+# so one stalled call falls back instead of running past Vercel's 60s limit
+ANALYSIS_TIMEOUT_SECONDS = float(os.environ.get('ANALYSIS_TIMEOUT_SECONDS', '45'))
+
+# Wall-clock budget for a whole request across every stage, a little under
+# Vercel's 60s maxDuration; a stage that runs out of it takes its fallback
+REQUEST_DEADLINE_SECONDS = float(os.environ.get('REQUEST_DEADLINE_SECONDS', '55'))
+
+# Share of the request deadline held back from the first-stage analyses so the
+# talk track, which builds on them, still gets a real attempt
+TALK_TRACK_RESERVE_SECONDS = float(os.environ.get('TALK_TRACK_RESERVE_SECONDS', '15'))
+
+def time_left(deadline):
+    """Seconds until a time.perf_counter() deadline, never negative"""
+    return max(deadline - time.perf_counter(), 0)
+
+_SEMAPHORE = None
+_SEMAPHORE_LOOP = None
+
+def get_semaphore():
+    """Module-level request semaphore, bound to the running loop like the client"""
+    global _SEMAPHORE, _SEMAPHORE_LOOP
+
+    loop = asyncio.get_running_loop()
+    if _SEMAPHORE is None or _SEMAPHORE_LOOP is not loop:
+        _SEMAPHORE = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        _SEMAPHORE_LOOP = loop
+    return _SEMAPHORE
+
+class ResponseCache:
+    """Small in-process TTL + LRU cache for parsed analyzer responses"""
+
+    def __init__(self, maxsize=1000, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+# Warm serverless containers keep this between invocations, so re-analyzing
+# the same transcript skips the Claude round-trip for every repeated call
+ANALYSIS_CACHE = ResponseCache(maxsize=512, ttl=3600)
+
+def analysis_cache_key(model, system, prompt):
+    """blake2b digest of everything that determines a Claude reply"""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (model, system or '', prompt):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+# Analyses currently running, keyed by request digest, so concurrent requests
+# for the same transcript await one shared task instead of repeating it
+IN_FLIGHT_ANALYSES = {}
+
+def request_key(*parts):
+    """blake2b digest of an analysis request's arguments"""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def all_in_one_problem(result):
+    """Why a merged all-in-one reply can't be used, or None"""
+    missing = [key for key, _ in ALL_IN_ONE_SECTIONS if not isinstance(result.get(key), dict)]
+    if missing:
+        return f"missing sections {missing}"
+    if not result['emotional_journey'].get('emotional_journey_phases'):
+        return "missing emotional_journey_phases"
+    return None
+
+def emotional_journey_problem(result):
+    """Why an emotional journey reply can't be used, or None"""
+    return None if result.get('emotional_journey_phases') else "missing emotional_journey_phases"
+
+# Reply budget for each first-stage analysis when it runs as its own call
+SECTION_MAX_TOKENS = {
+    'call_outcome': 1500,
+    'discovery_quality': 2000,
+    'sales_framework_analysis': 3500,
+    'psychological_profile': 2000,
+    'marriage_coaching_analysis': 3500,
+    'emotional_journey': 1200,
+    'archetype_analysis': 800,
+}
+
+# Reply budget for the merged first-stage call of the batch path, which writes
+# every section in one reply and has no deadline to meet. Interactive requests
+# run the sections as parallel calls instead.
+ALL_IN_ONE_MAX_TOKENS = sum(SECTION_MAX_TOKENS.values())
+TALK_TRACK_MAX_TOKENS = 4000
+
+# Transcripts this short, or with no relationship vocabulary at all, are test
+# uploads or the wrong file; they get fallback results without any Claude call
+MIN_TRANSCRIPT_WORDS = 200
+MARRIAGE_KEYWORD_RE = re.compile(
+    r'\b(marriage|married|marry|wife|husband|spouse|divorce|separated|relationship|partner)\b',
+    re.IGNORECASE
+)
+
+def degenerate_transcript_reason(content, word_count):
+    """Why a transcript isn't worth analyzing, or None if it is"""
+    if word_count < MIN_TRANSCRIPT_WORDS:
+        return f"Transcript too short ({word_count} words, minimum {MIN_TRANSCRIPT_WORDS})"
+    if not MARRIAGE_KEYWORD_RE.search(content):
+        return "Transcript does not mention a marriage or relationship"
+    return None
+
+def fill_defaults(result, defaults):
+    """
+    Fill keys Claude dropped, or returned with the wrong container type, from
+    the analysis fallback so downstream code always sees the expected shape.
+    Mutates and returns result.
+    """
+    for key, default in defaults.items():
+        value = result.get(key)
+        if isinstance(default, dict):
+            if isinstance(value, dict):
+                fill_defaults(value, default)
+            else:
+                result[key] = default
+        elif value is None or (isinstance(default, list) and not isinstance(value, list)):
+            result[key] = default
+    return result
+
+# Recent output sizes per operation. The success log reports the p99 so each
+# max_tokens budget can be tuned to measured output plus a margin.
+OUTPUT_TOKEN_SAMPLES = defaultdict(lambda: deque(maxlen=500))
+
+def record_output_tokens(operation_name, output_tokens):
+    """Record one reply's output size; returns (p99, sample count) for the operation"""
+    samples = OUTPUT_TOKEN_SAMPLES[operation_name]
+    samples.append(output_tokens)
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], len(ordered)
+
+# Prospect phrases specific to one archetype, compiled once. Single words like
+# "data" or "improve" come up in almost any sales call, so every cue is a
+# phrase. A preview that clearly leans to one archetype is classified without
+# a Claude call; the keyword fallback scores with the same lexicon.
+ARCHETYPE_LEXICON = {
+    archetype: [re.compile(rf'\b{cue}\b', re.IGNORECASE) for cue in cues]
+    for archetype, cues in {
+        'DESPERATE SAVER': ['last chance', 'running out of time', 'falling apart', "before it'?s too late",
+                            'filed for divorce', 'wants a divorce', 'moved out', 'end of my rope',
+                            "(i'?m|i am) desperate", "(don'?t|do not) know what else to do"],
+        'ANALYTICAL RESEARCHER': ['success rate', 'what percentage', 'how many couples', 'track record',
+                                  '(any|the) (studies|research) (on|show|behind)',
+                                  '(compare|comparing) (it|this|you) (to|with)',
+                                  "what'?s the (methodology|data)"],
+        'SKEPTICAL EVALUATOR': ['sounds too good', 'is this a scam', 'burned before', "what'?s the catch",
+                                '(tried|done) (counseling|therapy) (before|already)', "(don'?t|do not) trust",
+                                'money[- ]back guarantee', 'how do i know (this|it) (will )?works?'],
+        'CONSENSUS SEEKER': [r'(talk|check) (to|with) my (wife|husband|spouse|partner)', 'decide together',
+                             'we need to discuss', '(run|think) it (by|over with) my (wife|husband|spouse|partner)',
+                             '(he|she) (has|needs) to (agree|be on board)', 'get (his|her) (buy-in|blessing)'],
+        'HOPEFUL BUILDER': ['looking forward to', "(i'?m|i am) (really |so )?(excited|hopeful)",
+                            '(make|build) (it|us|our marriage) stronger', '(we|i) (still )?love each other',
+                            'fresh start', 'best years ahead'],
+    }.items()
+}
+
+# Cue confidence a preview needs before its archetype skips the Claude call;
+# 0.8 takes three more distinct cues than any other archetype
+FAST_ARCHETYPE_MIN_CONFIDENCE = 0.8
+
+def archetype_cue_scores(text):
+    """Number of distinct lexicon cues each archetype hits in text"""
+    return {
+        archetype: sum(1 for pattern in patterns if pattern.search(text))
+        for archetype, patterns in ARCHETYPE_LEXICON.items()
+    }
+
+def archetype_cue_confidence(top_score, second_score):
+    """Confidence in the leading archetype from its cue margin over the runner-up"""
+    return min(0.9, 0.5 + 0.1 * (top_score - second_score))
+
+# Sales framework categories scored out of 10 each (60 total)
+FRAMEWORK_CATEGORIES = ('call_control', 'discovery_depth', 'empathetic_confrontation',
+                        'objection_handling', 'value_positioning', 'closing_strength')
+_EMPTY = {}  # Shared read-only default for missing categories
+
+# Readiness to change by the caller's emotional state (stages of change)
+DEFAULT_CHANGE_STAGE_SCORE = 0.6  # Contemplation stage
+CHANGE_STAGE_SCORES = {
+    'desperate': 0.85,  # Action stage - crisis creates immediate readiness
+    'hopeful': 0.75,  # Preparation stage - motivated and planning
+    'angry': 0.45,  # Precontemplation - resistance to change
+    'analytical': 0.65,  # Late contemplation - weighing options
+}
+
+# Relationship investment by archetype (Rusbult investment model)
+DEFAULT_INVESTMENT_SCORE = 0.6
+ARCHETYPE_INVESTMENT_SCORES = {
+    'DESPERATE SAVER': 0.9,  # High investment, few alternatives, low satisfaction
+    'HOPEFUL BUILDER': 0.8,  # High satisfaction, high investment
+    'ANALYTICAL RESEARCHER': 0.5,  # Methodical decision-making, comparing alternatives
+    'SKEPTICAL EVALUATOR': 0.3,  # Low trust, considering alternatives
+    'CONSENSUS SEEKER': 0.4,  # Dependent on partner buy-in, divided investment
+}
+
+# Transcript budget shared by every analysis. Full 45-60 minute sales calls run
+# ~50k characters (~12k tokens), so the budget keeps them whole.
+MAX_CONTENT_TOKENS = 25000
+MAX_CONTENT_CHARS = 100000  # Used when the token count is unavailable
+# Transcripts run about 4 characters per token; at a pessimistic 3, anything
+# under 75k characters is within the budget without counting
+MIN_CHARS_PER_TOKEN = 3
+TRUNCATION_SUFFIX = "\n\n... [Content truncated for analysis - call exceeded the token budget]"
+
+# Emotional journey and archetype read only the opening of the call
+PREVIEW_CHARS = 3000
+
+# When a call is over budget, the opening and the closing stretch (price,
+# objections, decision) are kept whole, plus any middle turns on money or
+# the marriage; the rest of the middle is dropped
+OPENING_SHARE = 0.2
+CLOSING_SHARE = 0.5
+HIGH_SIGNAL_RE = re.compile(
+    r'\b(price|cost|invest|spouse|wife|husband|divorce|separat|money|afford)',
+    re.IGNORECASE
+)
+OMISSION_MARKER = "[...omitted...]"
+
+def discriminative_window(content, budget):
+    """
+    Cut content to about budget characters on line boundaries, keeping the
+    opening, the closing and high-signal middle lines. Returns None when the
+    text has no usable line structure.
+    """
+    lines = content.split('\n')
 
-TRANSCRIPT:
-{content}
+    head, used = 0, 0
+    while head < len(lines) and used + len(lines[head]) + 1 <= budget * OPENING_SHARE:
+        used += len(lines[head]) + 1
+        head += 1
+
+    tail, tail_used = len(lines), 0
+    while tail > head and tail_used + len(lines[tail - 1]) + 1 <= budget * CLOSING_SHARE:
+        tail -= 1
+        tail_used += len(lines[tail]) + 1
+
+    if head == 0 or tail == len(lines):
+        return None
+
+    remaining = budget - used - tail_used
+    kept = []
+    for line in lines[head:tail]:
+        if len(line) + 1 <= remaining and HIGH_SIGNAL_RE.search(line):
+            kept.append(line)
+            remaining -= len(line) + 1
+
+    parts = lines[:head] + [OMISSION_MARKER]
+    if kept:
+        parts += kept + [OMISSION_MARKER]
+    return '\n'.join(parts + lines[tail:])
+
+# Every analysis returns a JSON object; prefilling the assistant turn with its
+# opening brace stops Claude from wrapping the output in a code fence
+JSON_PREFILL = "{"
+
+def find_json_object(text):
+    """Return the first balanced {...} span in text, skipping braces inside strings"""
+    start = text.find('{')
+    if start == -1:
+        return None
+
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+def prefilled_json_text(response):
+    """Rebuild the JSON text of a prefilled response, dropping any trailing prose"""
+    text = JSON_PREFILL + response.content[0].text
+    span = find_json_object(text)
+    if span is None:
+        # Unbalanced; hand the whole text to the parser so the error is reported
+        return text
+    if len(span) < len(text.rstrip()):
+        logger.warning(f"Dropped {len(text.rstrip()) - len(span)} characters after the JSON object")
+    return span
+
+# Static prompt scaffolds, kept at module level so the cached system prefix
+# is byte-identical across calls; only the transcript goes in the user turn
+STATIC_CALL_OUTCOME_SPEC = """Analyze this marriage coaching sales call to determine the outcome and packages discussed.
 
 PACKAGE INFORMATION:
 - MRL (Marriage Reset Light): $2,300 self-paced course
@@ -248,78 +545,31 @@ CALL WON = Clear commitment to purchase (even if paying later)
 CALL LOST = No commitment, "I need to think about it", "talk to my wife", objections not overcome
 
 Return ONLY this JSON:
-{{
+{
   "call_outcome": "won" or "lost" or "undetermined",
   "confidence": 0.85,
   "packages_positioned": ["MRL", "MRI"],
   "package_purchased": "MRI" or null,
   "purchase_timestamp": "[35:20]" or null,
-  "closing_moment_analysis": {{
+  "closing_moment_analysis": {
     "decision_point_timestamp": "[35:20]",
     "prospect_buying_signals": ["Said 'I need this'", "Asked about payment"],
     "rep_closing_approach": "Assumptive close after addressing wife objection",
     "objections_raised": ["Need to talk to wife", "Concerned about cost"],
     "objections_handled": true,
     "final_commitment_language": "Prospect said 'let's do the intensive'"
-  }},
+  },
   "why_won_or_lost": "Clear analysis of what led to outcome",
   "key_closing_moments": [
     "[33:15] Prospect showed strong buying signal - 'this makes so much sense'",
     "[35:20] Rep handled wife objection perfectly",
     "[36:45] Prospect committed to MRI package"
   ]
-}}
+}
 
 Be PRECISE - only mark as "won" if there's clear commitment. "I'll think about it" = lost."""
 
-        try:
-            response_text = await self._call_api_with_retry(
-                prompt=prompt,
-                max_tokens=1500,
-                operation_name="Call Outcome Detection"
-            )
-
-            # Clean and extract JSON
-            response_text = response_text.replace('```json', '').replace('```', '').strip()
-
-            import re
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                response_text = json_match.group(0)
-
-            result = json.loads(response_text)
-
-            # Add package details
-            if result.get('package_purchased'):
-                package_code = result['package_purchased']
-                if package_code in self.packages:
-                    result['package_details'] = self.packages[package_code]
-
-            logger.info(f"Call outcome: {result.get('call_outcome')} - Package: {result.get('package_purchased')}")
-            return result
-
-        except Exception as e:
-            logger.error(f"Call outcome detection error: {str(e)}")
-            # Return safe fallback
-            return {
-                'call_outcome': 'undetermined',
-                'confidence': 0.0,
-                'packages_positioned': [],
-                'package_purchased': None,
-                'purchase_timestamp': None,
-                'why_won_or_lost': 'Analysis failed - could not determine outcome',
-                'key_closing_moments': []
-            }
-
-    async def detect_discovery_quality(self, content):
-        """
-        Phase 2: Discovery Quality Tracking
-        Detects "switching gears" transition and tracks the 4 key questions.
-        """
-        prompt = f"""Analyze this marriage coaching sales call to evaluate discovery quality.
-
-TRANSCRIPT:
-{content}
+STATIC_DISCOVERY_SPEC = """Analyze this marriage coaching sales call to evaluate discovery quality.
 
 MARRIAGE RESET DISCOVERY FRAMEWORK:
 
@@ -342,51 +592,51 @@ MARRIAGE RESET DISCOVERY FRAMEWORK:
 IMPORTANT: Provide EXACT timestamps for all findings. Mark questions as asked ONLY if clearly present.
 
 Return ONLY this JSON:
-{{
-  "switching_gears_detected": {{
+{
+  "switching_gears_detected": {
     "found": true,
     "timestamp": "[12:45]",
     "exact_phrase": "Let me switch gears here",
     "transition_quality": "smooth|abrupt|missing",
     "context": "Rep transitioned after building rapport"
-  }},
-  "four_key_questions": {{
-    "priority_question": {{
+  },
+  "four_key_questions": {
+    "priority_question": {
       "asked": true,
       "timestamp": "[13:20]",
       "prospect_response_summary": "Said she doesn't feel like a priority",
       "rep_follow_up": "Rep dug deeper into specific examples",
       "emotional_intensity": 8
-    }},
-    "understanding_question": {{
+    },
+    "understanding_question": {
       "asked": true,
       "timestamp": "[15:45]",
       "prospect_response_summary": "Feels husband doesn't understand her needs",
       "rep_follow_up": "Rep asked for clarification",
       "emotional_intensity": 7
-    }},
-    "trust_question": {{
+    },
+    "trust_question": {
       "asked": false,
       "timestamp": null,
       "missed_opportunity": "[16:30] Prospect mentioned broken promises - perfect moment to ask about trust",
       "impact_of_missing": "Missed critical trust issue that affects close probability"
-    }},
-    "emotional_security_question": {{
+    },
+    "emotional_security_question": {
       "asked": true,
       "timestamp": "[18:10]",
       "prospect_response_summary": "Feels anxious and uncertain",
       "rep_follow_up": "Rep validated feelings",
       "emotional_intensity": 9
-    }}
-  }},
-  "conflict_handling": {{
+    }
+  },
+  "conflict_handling": {
     "asked": true,
     "timestamp": "[20:15]",
     "prospect_response_summary": "They avoid conflict, which makes things worse",
     "conflict_pattern_identified": "Avoidance pattern leading to resentment",
     "rep_coaching_response": "Rep explained how avoidance compounds problems"
-  }},
-  "discovery_quality_summary": {{
+  },
+  "discovery_quality_summary": {
     "questions_asked_count": 3,
     "questions_missed_count": 1,
     "completion_percentage": 75,
@@ -401,141 +651,790 @@ Return ONLY this JSON:
       "Could have probed deeper on priority issue"
     ],
     "coaching_prescription": "Practice all 4 questions until they become second nature. Trust question critical for close."
-  }}
-}}
+  }
+}
+
+Be PRECISE with timestamps. Only mark as asked if the question is clearly present."""
+
+STATIC_FRAMEWORK_SPEC = """Analyze this marriage coaching sales call and rate performance in 7 categories using the STRICT SCORING RUBRIC below.
+
+IMPORTANT: Transcript may include timestamps in [MM:SS] format. Use timestamps to provide PRECISE coaching feedback with exact moments to review.
+
+SCORING RUBRIC (use these exact criteria for consistency):
+- 9-10: Exceptional - Demonstrates mastery, multiple strong examples
+- 7-8: Good - Solid performance, few minor improvements needed
+- 5-6: Average - Adequate but significant room for improvement
+- 3-4: Below Average - Major gaps, needs immediate coaching
+- 1-2: Poor - Critical failures, requires urgent intervention
+
+Rate each category 1-10 using the rubric above. Be CONSISTENT - same quality should get same score.
+
+CRITICAL: For "relationship_dynamics_education" - ONLY flag MISSED opportunities when:
+1. Prospect's story REVEALS a dynamic (e.g., describes shutting down when husband yells)
+2. Rep did NOT teach the principle in that moment
+3. Teaching would have been contextually appropriate (not over-educating)
+
+Core principles to watch for:
+- Emotion-first processing: Wife feels what husband says before processing the words
+- Emotional priming: Tone/demeanor sets receptivity for what follows (door-slamming vs. whistling example)
+- Defensive triggers: How emotional state colors interpretation of words
+- Communication patterns: How small interactions compound over time
+
+High score (8-10): Rep identifies dynamics in prospect's story and teaches principles at perfect moments
+Low score (1-4): Rep misses multiple clear teaching opportunities when prospect reveals dynamics
+
+{
+  "framework_scores": {
+    "call_control": {
+      "score": 7,
+      "analysis": "Rep maintained good conversation flow",
+      "coaching_fix": "Ask more guiding questions",
+      "key_moments": ["[12:30] Lost control when prospect went off-topic", "[25:15] Good redirect back to solution"]
+    },
+    "discovery_depth": {
+      "score": 5,
+      "analysis": "Surface-level problem identification",
+      "coaching_fix": "Dig deeper into marriage pain points",
+      "key_moments": ["[08:45] Missed opportunity to explore emotional impact", "[15:20] Good probing question"]
+    },
+    "empathetic_confrontation": {
+      "score": 6,
+      "analysis": "Showed empathy but missed confrontation opportunities",
+      "coaching_fix": "Balance understanding with accountability",
+      "key_moments": ["[18:30] Too much empathy, avoided confrontation", "[22:10] Missed chance to show prospect his role"]
+    },
+    "objection_handling": {
+      "score": 4,
+      "analysis": "Struggled with price objections",
+      "coaching_fix": "Use investment reframes not cost justification",
+      "key_moments": ["[28:45] Price objection handled poorly - justified instead of reframed"]
+    },
+    "value_positioning": {
+      "score": 3,
+      "analysis": "Weak marriage value positioning",
+      "coaching_fix": "Position marriage as most important investment",
+      "key_moments": ["[20:15] Weak value statement - sounded like expense not investment"],
+      "effective_positioning": ["[19:40] 'Your marriage is the foundation everything else sits on'"],
+      "missed_positioning": ["[24:05] Prospect said the kids notice the fighting - could have tied value to the family"],
+      "tesla_analogy_usage": {"used": false, "effectiveness": 0, "context": "Never compared the investment to a car purchase"},
+      "beg_borrow_steal_positioning": {"used": true, "effectiveness": 4, "improvement": "Establish what the marriage is worth before naming the price"}
+    },
+    "closing_strength": {
+      "score": 2,
+      "analysis": "No clear commitment requests",
+      "coaching_fix": "Use assumptive close techniques",
+      "key_moments": ["[32:40] CRITICAL MISS - Client showed buying signal but rep didn't close"]
+    },
+    "relationship_dynamics_education": {
+      "score": 4,
+      "analysis": "Rep missed opportunities to teach core relationship principles when prospect's story revealed them",
+      "coaching_fix": "Identify when prospect describes dynamics, then teach the principle briefly without over-educating",
+      "key_moments": ["[15:45] MISSED - Prospect said 'he yelled and I shut down' - perfect moment to explain emotion-first processing", "[22:10] MISSED - Prospect described communication breakdown - could have taught how tone sets receptivity"],
+      "missed_teaching_opportunities": [
+        {"principle": "Emotion-first processing (wife feels before she hears)", "context": "Prospect described defensive reaction to husband's tone", "timestamp": "[15:45]"},
+        {"principle": "Emotional priming (tone sets receptivity)", "context": "Prospect said arguments escalate from how conversation starts", "timestamp": "[22:10]"}
+      ]
+    }
+  },
+  "total_score": 31,
+  "overall_grade": "C"
+}
+
+Respond with ONLY valid JSON matching this format."""
+
+STATIC_BIG_FIVE_SPEC = """Analyze this prospect's personality from the marriage coaching call.
+
+Rate their Big Five personality traits (1-100):
+
+{
+  "big_five_personality": {
+    "openness": {
+      "score": 75,
+      "confidence": 80,
+      "implications": "Open to new approaches for marriage improvement"
+    },
+    "conscientiousness": {
+      "score": 60,
+      "confidence": 85,
+      "implications": "Moderate follow-through likelihood"
+    },
+    "extraversion": {
+      "score": 45,
+      "confidence": 75,
+      "implications": "Introverted communication style"
+    },
+    "agreeableness": {
+      "score": 70,
+      "confidence": 85,
+      "implications": "Cooperative but conflict-avoidant"
+    },
+    "neuroticism": {
+      "score": 65,
+      "confidence": 80,
+      "implications": "Moderate stress about marriage situation"
+    }
+  },
+  "decision_making_style": {
+    "primary_style": "emotional",
+    "confidence": 85
+  },
+  "emotional_state": {
+    "primary_emotion": "anxious",
+    "intensity": 7,
+    "stability": 5
+  }
+}
+
+Respond with ONLY valid JSON matching this format."""
+
+STATIC_MARRIAGE_SPEC = """Analyze this marriage coaching sales call for marriage-specific elements and coaching effectiveness.
+
+IMPORTANT: Transcript may include timestamps in [MM:SS] format. Include timestamps in ALL coaching feedback for precise review moments.
+
+MARRIAGE ANALOGY CATALOG:
+- garden_analogy: relationship needs tending like a garden
+- bucket_emotional_flexseal: emotional holes need repair like a bucket with flexseal
+- sediment_analogy: relationship problems build up like sediment
+- tipping_scale: marriage problems vs solutions on a tipping scale
+- couch_analogy: comfort zone keeping prospect from action
+- razor_analogy: sharp precision needed in marriage repair
+- road_trip: marriage journey like a planned road trip
+- reading_smoke: marriage warning signs like reading smoke
+
+List in analogies_used ONLY the catalog analogies the rep actually used, one entry each; use an empty array if none were used.
+
+Focus on marriage coaching specifics:
+
+{
+  "marriage_coaching_elements": {
+    "listening_with_intent": {
+      "information_gathering_score": 1-10,
+      "information_callback_score": 1-10,
+      "examples_of_good_listening": ["quotes where rep used earlier info later"],
+      "missed_callback_opportunities": ["info given early that wasn't used later"],
+      "coaching_prescription": "How to improve listening and callback usage"
+    },
+    "empathy_vs_confrontation_balance": {
+      "empathy_score": 1-10,
+      "confrontation_score": 1-10,
+      "balance_effectiveness": 1-10,
+      "empathy_examples": ["quotes showing good empathy"],
+      "confrontation_examples": ["quotes showing prospect his role in problems"],
+      "missed_confrontation_opportunities": ["moments to show prospect his shortcomings"],
+      "coaching_improvement": "Better balance techniques"
+    },
+    "investment_vs_expense_framing": {
+      "score": 1-10,
+      "effective_framing": ["quotes framing as investment"],
+      "expense_framing_mistakes": ["quotes that made it sound like expense"],
+      "coaching_improvement": "Better investment framing scripts"
+    },
+    "marriage_analogies_effectiveness": {
+      "analogies_used": [
+        {
+          "name": "garden_analogy|bucket_emotional_flexseal|sediment_analogy|tipping_scale|couch_analogy|razor_analogy|road_trip|reading_smoke",
+          "effectiveness": 1-10,
+          "context": "how the rep used it",
+          "prospect_response": "how prospect reacted to this analogy",
+          "timing_in_call": "opening|discovery|presentation|closing",
+          "improvement_note": "how to use this analogy better"
+        }
+      ],
+      "analogy_strategy_analysis": {
+        "total_analogies_used": "count of analogies used",
+        "most_effective_analogy": "which analogy resonated most",
+        "analogy_timing_effectiveness": "early|mid|late - when analogies worked best",
+        "prospect_analogy_preference": "which type of analogies this prospect responds to",
+        "overuse_warning": "if too many analogies confused the prospect"
+      },
+      "analogy_recommendations": {
+        "best_analogy_for_this_prospect": "which specific analogy would work best and why based on their situation",
+        "optimal_analogy_timing": "when in conversation to introduce analogies for maximum impact",
+        "missed_analogy_opportunities": ["specific moments where analogies could have created breakthrough"],
+        "next_call_analogy_strategy": "which analogies to use in follow-up based on analysis"
+      }
+    }
+  },
+  "marriage_situation_assessment": {
+    "relationship_status": "same_house_same_bed|same_house_separate_rooms|separated|unclear",
+    "urgency_level": 1-10,
+    "emotional_state": "desperate|hopeful|angry|resigned|confused",
+    "wife_involvement": "supportive|neutral|resistant|unknown",
+    "timeline_pressure": "immediate|weeks|months|no_pressure",
+    "financial_capability": { "assessed": true/false, "ability": "high|medium|low|unknown", "objections": ["financial concerns raised"] }
+  },
+  "coaching_triggers": {
+    "critical_intervention_needed": {
+      "high_probability_miss": {
+        "triggered": true/false,
+        "severity": "low|medium|high|critical",
+        "specific_reasons": ["prospect showed high interest but rep didn't close", "buying signals missed", "emotional peak not leveraged"],
+        "missed_closing_opportunities": ["specific moments where rep should have asked for commitment"],
+        "immediate_coaching_action": "what sales manager needs to address RIGHT NOW"
+      },
+      "empathy_confrontation_imbalance": {
+        "triggered": true/false,
+        "imbalance_type": "too_much_empathy|too_much_confrontation|no_confrontation",
+        "severity": "low|medium|high|critical",
+        "specific_examples": ["quotes showing the imbalance"],
+        "impact_on_sale": "how this imbalance hurt the sales process",
+        "coaching_correction": "specific script/technique to fix this immediately"
+      },
+      "value_positioning_catastrophe": {
+        "triggered": true/false,
+        "severity": "low|medium|high|critical",
+        "positioning_failures": ["made coaching sound like expense", "didn't show marriage value", "weak ROI positioning"],
+        "prospect_price_objections": ["specific price concerns that weren't handled"],
+        "emergency_value_scripts": ["scripts rep needs to learn before next call"]
+      },
+      "listening_and_discovery_failure": {
+        "triggered": true/false,
+        "severity": "low|medium|high|critical",
+        "information_missed": ["critical info prospect gave that wasn't used"],
+        "callback_failures": ["early info that should have been referenced later"],
+        "discovery_gaps": ["essential marriage situation info not gathered"],
+        "coaching_intervention": "immediate discovery training needed"
+      },
+      "emotional_mismanagement": {
+        "triggered": true/false,
+        "severity": "low|medium|high|critical",
+        "emotional_mistakes": ["misread emotional state", "responded poorly to emotion", "created negative emotion"],
+        "missed_emotional_leverage": ["emotional peaks not used for closing"],
+        "emotional_coaching_needed": "specific emotional intelligence training required"
+      },
+      "analogy_and_story_failure": {
+        "triggered": true/false,
+        "severity": "low|medium|high|critical",
+        "missed_story_opportunities": ["moments where analogies could have created breakthrough"],
+        "poor_analogy_execution": ["analogies used poorly or at wrong time"],
+        "story_coaching_priority": "which analogies rep needs to master first"
+      }
+    },
+    "coaching_urgency_assessment": {
+      "immediate_coaching_required": true/false,
+      "coaching_priority_level": "low|medium|high|emergency",
+      "total_critical_triggers": "count of critical issues",
+      "rep_competency_concern": "is this rep capable of closing marriage coaching sales",
+      "recommended_coaching_timeline": "immediate|within_24hrs|this_week|ongoing"
+    },
+    "manager_intervention_recommendations": {
+      "should_manager_jump_on_next_call": true/false,
+      "rep_needs_shadowing": true/false,
+      "script_drilling_required": ["specific scripts rep must practice"],
+      "role_play_scenarios": ["situations rep needs to practice before next call"],
+      "performance_improvement_plan_trigger": true/false
+    }
+  }
+}
+
+Be savage and specific about marriage coaching techniques. This analysis determines if this rep can save marriages.
+
+Respond with ONLY the JSON object."""
+
+STATIC_EMOTIONAL_SPEC = """You are an expert marriage coaching psychologist. Map the prospect's emotional journey through this sales call.
+
+IMPORTANT: Transcript may include timestamps in [MM:SS] format. Use timestamps to track WHEN emotional shifts occur.
+
+Track their emotional progression through 4 phases with PRECISE timestamps:
+
+Return ONLY this JSON:
+{
+  "emotional_journey_phases": [
+    {
+      "phase": "opening",
+      "timestamp": "[02:15]",
+      "emotional_state": "curious",
+      "intensity": 6,
+      "trigger_moment": "[02:15] Learning about the process",
+      "coaching_note": "Rep could have used curiosity to build more engagement - ask more questions"
+    },
+    {
+      "phase": "discovery",
+      "timestamp": "[08:30]",
+      "emotional_state": "vulnerable",
+      "intensity": 8,
+      "trigger_moment": "[08:30] Shared deep marriage pain",
+      "coaching_note": "Peak emotional moment - rep should have acknowledged and used for urgency"
+    }
+  ],
+  "emotional_patterns": {
+    "dominant_emotion": "hopeful",
+    "emotional_shifts": [
+      "[12:45] Became more engaged when solution presented",
+      "[22:10] Showed resistance after price mention"
+    ],
+    "missed_emotional_opportunities": [
+      "[15:20] Client expressed fear but rep didn't address it",
+      "[28:40] High emotional state - rep should have closed here"
+    ]
+  }
+}
+
+Focus on marriage crisis emotions: desperation, hope, fear, skepticism, relief. Include timestamps for ALL key moments."""
+
+STATIC_ARCHETYPE_SPEC = """You are an expert marriage coaching sales psychologist. Analyze this transcript and classify the prospect's psychological archetype.
+
+MARRIAGE COACHING ARCHETYPES:
+1. DESPERATE SAVER - High urgency, crisis-driven, time pressure language
+2. ANALYTICAL RESEARCHER - Wants data, statistics, success rates, proof
+3. HOPEFUL BUILDER - Optimistic, growth-focused, investment-oriented
+4. SKEPTICAL EVALUATOR - Cautious, mentions scams/trust issues
+5. CONSENSUS SEEKER - Needs spouse approval, collaborative language
+
+Return ONLY this JSON:
+{
+  "primary_archetype": "DESPERATE SAVER",
+  "confidence_score": 0.85,
+  "supporting_quotes": ["quote from transcript", "another quote"],
+  "behavioral_indicators": ["behavior pattern 1", "behavior pattern 2"]
+}"""
+
+STATIC_TALK_TRACK_SPEC = """Using the analyses of a marriage coaching sales call below, provide specific talk track improvements and script recommendations.
+
+The analyses were extracted from the call transcript: their key moments, examples and quotes are the evidence to quote from.
+
+Provide surgical talk track improvements:
+
+{
+  "talk_track_analysis": {
+    "opening_improvements": {
+      "current_opening_effectiveness": 1-10,
+      "what_worked": ["effective opening elements with quotes"],
+      "what_failed": ["weak opening elements with quotes"],
+      "improved_opening_script": "specific script improvement for marriage coaching",
+      "hook_recommendations": ["powerful hooks for marriage coaching prospects"],
+      "rapport_building_improvements": "specific rapport techniques for marriage situations"
+    },
+    "discovery_talk_track": {
+      "current_discovery_effectiveness": 1-10,
+      "strong_questions_asked": ["good discovery questions with prospect responses"],
+      "weak_questions_asked": ["poor questions that didn't uncover key info"],
+      "missing_critical_questions": ["essential marriage coaching discovery questions not asked"],
+      "improved_discovery_sequence": [
+        "Question 1: [specific improved question]",
+        "Question 2: [follow-up question based on response]",
+        "Question 3: [deeper discovery question]",
+        "And 7 more sequential questions for marriage coaching discovery..."
+      ],
+      "emotional_discovery_improvements": "how to uncover emotional state more effectively"
+    },
+    "presentation_improvements": {
+      "current_presentation_effectiveness": 1-10,
+      "presentation_strengths": ["what rep presented well with quotes"],
+      "presentation_weaknesses": ["what rep presented poorly with quotes"],
+      "marriage_value_presentation_script": "improved script for positioning marriage coaching value",
+      "analogy_integration": "how to weave analogies into presentation more effectively",
+      "emotional_connection_improvements": "scripts to create deeper emotional connection"
+    },
+    "objection_handling_scripts": {
+      "price_objection_improvements": {
+        "common_price_objections": ["actual objections from transcript"],
+        "current_responses_effectiveness": [{ "objection": "quote", "response": "rep response", "effectiveness": 1-10 }],
+        "improved_price_scripts": [{ "objection": "price concern", "improved_response": "better script response" }],
+        "investment_reframe_scripts": ["scripts to reframe cost as investment in marriage"]
+      },
+      "time_objection_improvements": {
+        "time_concerns_raised": ["actual time objections from transcript"],
+        "urgency_creation_scripts": ["scripts to create urgency about marriage timeline"],
+        "time_value_positioning": "positioning marriage coaching as time-sensitive investment"
+      },
+      "spouse_objection_handling": {
+        "wife_resistance_concerns": ["concerns about spouse buy-in from transcript"],
+        "spouse_involvement_scripts": ["scripts for handling spouse resistance"],
+        "consensus_building_techniques": "talk track for getting spouse on board"
+      }
+    },
+    "closing_improvements": {
+      "current_closing_effectiveness": 1-10,
+      "closing_attempts_analysis": [{ "attempt": "quote of closing attempt", "effectiveness": 1-10, "improvement": "how to close better" }],
+      "improved_closing_sequences": [
+        "Soft Close: [specific script for soft close attempt]",
+        "Medium Close: [script for medium pressure close]",
+        "Hard Close: [script for direct close attempt]"
+      ],
+      "urgency_creation_scripts": ["scripts to create urgency about marriage situation"],
+      "emotional_leverage_closing": "how to use emotions discovered for closing"
+    },
+    "follow_up_talk_track": {
+      "immediate_follow_up_script": "script for following up within 24 hours",
+      "objection_follow_up_scripts": [{ "objection_type": "price|time|spouse", "follow_up_script": "specific follow-up for this objection" }],
+      "value_reinforcement_follow_up": "scripts to reinforce marriage value in follow-up",
+      "urgency_follow_up_techniques": "creating urgency in follow-up conversations"
+    }
+  },
+  "script_drilling_priorities": {
+    "top_3_scripts_to_master": [
+      "Script 1: [specific script with rationale]",
+      "Script 2: [specific script with rationale]",
+      "Script 3: [specific script with rationale]"
+    ],
+    "role_play_scenarios": [
+      "Scenario 1: [specific marriage situation to practice]",
+      "Scenario 2: [specific objection to practice]",
+      "Scenario 3: [specific closing situation to practice]"
+    ],
+    "daily_practice_recommendations": "what rep should practice daily to improve talk track"
+  },
+  "marriage_coaching_specialization": {
+    "marriage_specific_language": {
+      "words_to_use_more": ["marriage", "relationship", "connection", "intimacy", "partnership"],
+      "words_to_avoid": ["coaching", "training", "program" - instead use "solution", "transformation", "breakthrough"],
+      "emotional_language_improvements": "more emotionally resonant language for marriage coaching"
+    },
+    "marriage_situation_adaptations": {
+      "separated_couples_talk_track": "specific scripts for separated couples",
+      "same_house_different_rooms_script": "scripts for couples living together but distant",
+      "high_conflict_couples_approach": "talk track for couples in high conflict",
+      "low_intimacy_couples_positioning": "how to position coaching for intimacy issues"
+    }
+  }
+}
+
+Focus on actionable, specific scripts that will improve marriage coaching sales performance immediately.
+
+Respond with ONLY the JSON object."""
+
+# Per-call user turn pieces; the transcript is concatenated rather than
+# interpolated so only the dynamic parts are built on each call
+TRANSCRIPT_PREFIX = "TRANSCRIPT:\n"
+
+DISCOVERY_CONTEXT_TEMPLATE = """
+
+DISCOVERY QUALITY DATA (Phase 2):
+- Switching gears transition: {found}
+- Key questions asked: {questions_asked}/4
+- Discovery completion: {completion}%
+- Discovery depth score from Phase 2: {depth}/10
+
+Use this data to inform your discovery_depth category score. If Phase 2 shows strong discovery (3-4 questions asked), score should be 7-10. If weak (0-1 questions), score should be 1-4."""
+
+TALK_TRACK_CONTEXT_TEMPLATE = """SALES FRAMEWORK SCORES:
+{framework_scores}
+
+MARRIAGE COACHING ANALYSIS:
+{marriage_elements}
+
+MARRIAGE SITUATION:
+{marriage_situation}"""
+
+# Analyses produced by the batch path's merged call, keyed as in the final result
+ALL_IN_ONE_SECTIONS = (
+    ('call_outcome', STATIC_CALL_OUTCOME_SPEC),
+    ('discovery_quality', STATIC_DISCOVERY_SPEC),
+    ('sales_framework_analysis', STATIC_FRAMEWORK_SPEC),
+    ('psychological_profile', STATIC_BIG_FIVE_SPEC),
+    ('marriage_coaching_analysis', STATIC_MARRIAGE_SPEC),
+    ('emotional_journey', STATIC_EMOTIONAL_SPEC),
+    ('archetype_analysis', STATIC_ARCHETYPE_SPEC),
+)
+
+STATIC_ALL_IN_ONE_SPEC = (
+    "Run every analysis below on the same marriage coaching sales call transcript.\n\n"
+    "Return ONE JSON object with exactly these top-level keys: "
+    + ", ".join(key for key, _ in ALL_IN_ONE_SECTIONS) + ". "
+    "The value of each key must be the JSON object described in its section. "
+    "Use your discovery_quality findings to inform the discovery_depth score in sales_framework_analysis.\n\n"
+    + "\n\n".join(f"=== {key} ===\n{spec}" for key, spec in ALL_IN_ONE_SECTIONS)
+    + "\n\nRespond with ONLY the combined JSON object."
+)
+
+class MarriageCoachingAnalyzer:
+    """Surgical marriage coaching sales analyzer with framework from proven systems"""
+
+    def __init__(self, api_key, max_retries=3, timeout=120, bypass_cache=False):
+        self.api_key = api_key
+        self.bypass_cache = bypass_cache  # Force fresh Claude calls, still refreshing the cache
+        # Model configuration - easy to update when models change
+        self.model = "claude-sonnet-4-5"  # Upgraded to Claude Sonnet 4.5 (latest)
+        # Pattern-matching analyses (personality, emotional journey, archetype)
+        # run on Haiku; scoring and script writing stay on Sonnet
+        self.fast_model = "claude-haiku-4-5"
+        self.max_retries = max_retries
+        self.timeout = timeout
+        # Per-call timings (ms) for the analysis in progress, logged once at the end
+        self.metrics = {}
+        # Result keys of the analyses in progress that returned a fallback
+        # instead of Claude's answer, reported back as degraded_analyses
+        self.degraded = []
+
+        # Marriage Reset package definitions
+        self.packages = {
+            'MRL': {'name': 'Marriage Reset Light', 'price': 2300, 'description': 'Self-paced course'},
+            'MRS': {'name': 'Marriage Reset Standard', 'price': None, 'description': 'Course + 2 coaching calls + weekly group'},
+            'MRP': {'name': 'Marriage Reset Plus', 'price': None, 'description': 'Course + 5 coaching sessions + weekly group'},
+            'MRI': {'name': 'Marriage Reset Intensive', 'price': 11800, 'description': 'Course + 16 coaching sessions + weekly group'}
+        }
+
+    @property
+    def client(self):
+        """Shared AsyncAnthropic client for the current event loop"""
+        return get_client(self.api_key, self.timeout)
+
+    async def _request_json(self, prompt, max_tokens, operation_name="API call", system=None, model=None, defaults=None,
+                            validate=None):
+        """
+        Make API call with exponential backoff retry logic and parse the JSON reply.
+        Parsed replies are cached by request unless the analyzer bypasses the cache;
+        only replies that pass validate are cached, and callers always get a copy
+        they are free to mutate.
+
+        Args:
+            prompt: The prompt to send to Claude
+            max_tokens: Maximum tokens for response
+            operation_name: Name of the operation for logging
+            system: Static instructions sent as a cached system block
+            model: Model override, defaults to self.model
+            defaults: Fallback result used to fill missing or mistyped fields
+            validate: Called with the parsed reply; returns why it is unusable, or None
+
+        Returns:
+            Parsed JSON object
+
+        Raises:
+            Exception: If all retries fail, the reply is truncated, is not valid JSON
+                or fails validation
+        """
+        model = model or self.model
+        cache_key = analysis_cache_key(model, system, prompt)
+        if not self.bypass_cache:
+            cached = ANALYSIS_CACHE.get(cache_key)
+            if cached is not None:
+                logger.info(f"{operation_name} - Cache hit")
+                self.metrics[operation_name] = {'cached': True}
+                return copy.deepcopy(cached)
+
+        response = await self._create_message_with_retry(prompt, max_tokens, operation_name, system, model)
+        result = self._parse_json_message(response, operation_name, defaults)
+        problem = validate(result) if validate else None
+        if problem:
+            raise ValueError(f"{operation_name} reply unusable: {problem}")
+        ANALYSIS_CACHE.set(cache_key, copy.deepcopy(result))
+        return result
+
+    def _parse_json_message(self, response, operation_name, defaults=None):
+        """Parse a prefilled JSON reply, backfilling it from defaults; raises if it is unusable"""
+        if response.stop_reason == "max_tokens":
+            raise ValueError(f"{operation_name} response truncated at max_tokens")
+
+        result = orjson.loads(prefilled_json_text(response))
+        if not isinstance(result, dict):
+            raise ValueError(f"{operation_name} returned {type(result).__name__}, expected a JSON object")
+        if defaults:
+            fill_defaults(result, defaults)
+        return result
+
+    def _message_params(self, prompt, max_tokens, system=None, model=None):
+        """Messages API parameters for one JSON analysis, shared by live and batch requests"""
+        params = {
+            "model": model or self.model,
+            "max_tokens": max_tokens,
+            "temperature": 0.0,  # Greedy decoding for consistent, deterministic scoring
+            "messages": [
+                {"role": "user", "content": prompt},
+                {"role": "assistant", "content": JSON_PREFILL}
+            ]
+        }
+        if system:
+            params["system"] = cached_system(system)
+        return params
+
+    async def _create_message_with_retry(self, prompt, max_tokens, operation_name="API call", system=None, model=None):
+        """Make API call with exponential backoff retry logic, returning the full message"""
+        last_error = None
+
+        for attempt in range(self.max_retries):
+            try:
+                logger.info(f"{operation_name} - Attempt {attempt + 1}/{self.max_retries}")
+
+                params = self._message_params(prompt, max_tokens, system, model)
+                # Stream so the body arrives as it is generated; the final
+                # message is assembled by the SDK as the chunks come in.
+                # Backoff sleeps happen outside the semaphore.
+                async with get_semaphore():
+                    started = time.perf_counter()
+                    first_token = None
+                    async with self.client.messages.stream(**params) as stream:
+                        async for event in stream:
+                            if first_token is None and event.type == "content_block_delta":
+                                first_token = time.perf_counter()
+                        response = await stream.get_final_message()
+                    elapsed = time.perf_counter() - started
+                self.metrics[operation_name] = {
+                    'ms': round(elapsed * 1000),
+                    'ttft_ms': round((first_token - started) * 1000) if first_token else None,
+                    'attempts': attempt + 1
+                }
+
+                usage = getattr(response, 'usage', None)
+                output_tokens = getattr(usage, 'output_tokens', 0) or 0
+                p99, samples = record_output_tokens(operation_name, output_tokens)
+                logger.info(
+                    f"{operation_name} - Success on attempt {attempt + 1} in {elapsed:.1f}s "
+                    f"(cache read: {getattr(usage, 'cache_read_input_tokens', 0) or 0}, "
+                    f"cache write: {getattr(usage, 'cache_creation_input_tokens', 0) or 0} tokens; "
+                    f"output: {output_tokens}/{max_tokens} tokens, p99 {p99} over {samples} calls)"
+                )
+                return response
+
+            except RateLimitError as e:
+                last_error = e
+                wait_time = backoff_seconds(e, attempt, base=2)  # ~2s, 4s, 8s unless Retry-After says otherwise
+                logger.warning(f"{operation_name} - Rate limit hit on attempt {attempt + 1}. Waiting {wait_time:.1f}s before retry...")
+                if attempt < self.max_retries - 1:
+                    await asyncio.sleep(wait_time)
+                else:
+                    logger.error(f"{operation_name} - Rate limit exceeded after {self.max_retries} attempts")
+
+            except APITimeoutError as e:
+                last_error = e
+                logger.warning(f"{operation_name} - Timeout on attempt {attempt + 1}/{self.max_retries}")
+                if attempt < self.max_retries - 1:
+                    await asyncio.sleep(backoff_seconds(e, attempt))  # ~1s, 2s, 4s
+                else:
+                    logger.error(f"{operation_name} - Timeout after {self.max_retries} attempts")
+
+            except APIError as e:
+                last_error = e
+                error_code = getattr(e, 'status_code', 'unknown')
+                logger.warning(f"{operation_name} - API error ({error_code}) on attempt {attempt + 1}: {str(e)}")
+
+                # Don't retry on client errors (4xx) other than timeouts/conflicts,
+                # only on those and server errors (5xx)
+                if str(error_code).startswith('4') and error_code not in RETRYABLE_STATUS_CODES:
+                    logger.error(f"{operation_name} - Client error, not retrying")
+                    raise
+
+                if attempt < self.max_retries - 1:
+                    await asyncio.sleep(backoff_seconds(e, attempt))
+                else:
+                    logger.error(f"{operation_name} - API error persisted after {self.max_retries} attempts")
+
+            except Exception as e:
+                last_error = e
+                logger.error(f"{operation_name} - Unexpected error on attempt {attempt + 1}: {type(e).__name__}: {str(e)}")
+                if attempt < self.max_retries - 1:
+                    await asyncio.sleep(backoff_seconds(e, attempt))
+                else:
+                    logger.error(f"{operation_name} - Failed after {self.max_retries} attempts")
+
+        # If we get here, all retries failed
+        raise Exception(f"{operation_name} failed after {self.max_retries} attempts: {str(last_error)}")
+
+    async def detect_call_outcome(self, content):
+        """
+        Detect if call was won/lost and identify which package was discussed/purchased.
+        Specific to Marriage Reset methodology with early price positioning.
+        """
+        prompt = TRANSCRIPT_PREFIX + content
+
+        try:
+            result = await self._request_json(
+                prompt=prompt,
+                system=STATIC_CALL_OUTCOME_SPEC,
+                max_tokens=SECTION_MAX_TOKENS['call_outcome'],
+                operation_name="Call Outcome Detection",
+                defaults=self.get_fallback_call_outcome()
+            )
+
+            self._add_package_details(result)
+
+            logger.info(f"Call outcome: {result.get('call_outcome')} - Package: {result.get('package_purchased')}")
+            return result
 
-Be PRECISE with timestamps. Only mark as asked if the question is clearly present."""
+        except Exception as e:
+            logger.error(f"Call outcome detection error: {str(e)}")
+            self.degraded.append('call_outcome')
+            return self.get_fallback_call_outcome()
+
+    async def detect_discovery_quality(self, content):
+        """
+        Phase 2: Discovery Quality Tracking
+        Detects "switching gears" transition and tracks the 4 key questions.
+        """
+        prompt = TRANSCRIPT_PREFIX + content
 
         try:
-            response_text = await self._call_api_with_retry(
+            result = await self._request_json(
                 prompt=prompt,
-                max_tokens=2000,
-                operation_name="Discovery Quality Detection"
+                system=STATIC_DISCOVERY_SPEC,
+                max_tokens=SECTION_MAX_TOKENS['discovery_quality'],
+                operation_name="Discovery Quality Detection",
+                defaults=self.get_fallback_discovery_quality()
             )
 
-            # Clean and extract JSON
-            response_text = response_text.replace('```json', '').replace('```', '').strip()
-
-            import re
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                response_text = json_match.group(0)
-
-            result = json.loads(response_text)
-
             logger.info(f"Discovery quality: {result.get('discovery_quality_summary', {}).get('questions_asked_count', 0)}/4 key questions asked")
             return result
 
         except Exception as e:
             logger.error(f"Discovery quality detection error: {str(e)}")
-            # Return safe fallback
-            return {
-                'switching_gears_detected': {
-                    'found': False,
-                    'transition_quality': 'undetermined'
-                },
-                'four_key_questions': {
-                    'priority_question': {'asked': False},
-                    'understanding_question': {'asked': False},
-                    'trust_question': {'asked': False},
-                    'emotional_security_question': {'asked': False}
-                },
-                'conflict_handling': {'asked': False},
-                'discovery_quality_summary': {
-                    'questions_asked_count': 0,
-                    'questions_missed_count': 4,
-                    'completion_percentage': 0,
-                    'discovery_depth_score': 1,
-                    'key_insights_uncovered': [],
-                    'missed_opportunities': ['Analysis failed - could not determine discovery quality'],
-                    'coaching_prescription': 'Review recording manually'
-                }
-            }
+            self.degraded.append('discovery_quality')
+            return self.get_fallback_discovery_quality()
 
     async def analyze_marriage_coaching_call(self, content, filename="transcript.txt", client_name=None, closer_name=None, zoom_meeting_id=None, call_date=None):
         """Complete marriage coaching sales analysis with VTT support"""
-
+        args = (content, filename, client_name, closer_name, zoom_meeting_id, call_date)
+        if self.bypass_cache:
+            return await self._analyze_marriage_coaching_call(*args)
+
+        # Single-flight: a duplicate arriving while the first is still running
+        # awaits the same task. Shielded so one caller disconnecting doesn't
+        # cancel the analysis for the others.
+        key = request_key(*args)
+        task = IN_FLIGHT_ANALYSES.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._analyze_marriage_coaching_call(*args))
+            IN_FLIGHT_ANALYSES[key] = task
+            task.add_done_callback(lambda _: IN_FLIGHT_ANALYSES.pop(key, None))
+        else:
+            logger.info(f"Joining in-flight analysis of {filename}")
+        return await asyncio.shield(task)
+
+    async def _analyze_marriage_coaching_call(self, content, filename, client_name, closer_name, zoom_meeting_id, call_date):
+        started = time.perf_counter()
+        deadline = started + REQUEST_DEADLINE_SECONDS
+        self.metrics = {}
+        self.degraded = []
         try:
-            # Parse VTT format if detected
-            content, is_vtt = parse_vtt_content(content)
-
-            logger.info(f"Content length after VTT parsing: {len(content)} characters")
-
-            # Generate content hash for consistency tracking
-            content_hash = hashlib.md5(content.encode()).hexdigest()[:8]
-            logger.info(f"Content hash: {content_hash} - Use this to identify duplicate analyses")
-
-            # Increased limit to handle full sales calls (45-60 min calls = ~50k chars)
-            # Claude can handle up to ~200k tokens (~800k characters)
-            if len(content) > 100000:
-                logger.warning(f"Content very long ({len(content)} chars), truncating to 100k")
-                content = content[:100000] + "\n\n... [Content truncated for analysis - call exceeded 100k characters]"
-
-            # Run Phase 1 & 2 analyses in parallel (they don't depend on each other)
-            call_outcome, discovery_quality, psychological_analysis, emotional_journey, archetype_classification = await asyncio.gather(
-                self.detect_call_outcome(content),
-                self.detect_discovery_quality(content),
-                self.analyze_psychological_profile(content),
-                self.analyze_emotional_journey(content),
-                self.classify_marriage_archetype(content)
-            )
-
-            # Run analyses that depend on Phase 2 data
-            sales_framework_analysis, marriage_specific_analysis = await asyncio.gather(
-                self.analyze_sales_framework(content, discovery_quality),
-                self.analyze_marriage_coaching_specifics(content)
-            )
-
-            # Run talk track improvements (depends on framework and marriage analysis)
-            talk_track_improvements = await self.analyze_talk_track_improvements(content, sales_framework_analysis, marriage_specific_analysis)
+            content, word_count, skip_reason = self._prepare_transcript(content, filename)
+            if skip_reason:
+                analyses = tuple(fallback() for _, fallback in self._first_stage_fallbacks())
+            else:
+                # Trim once to a token budget; every analysis reuses the trimmed text
+                content = await self.truncate_to_tokens(content)
+
+                # Parallel per-section calls finish in the time of the slowest
+                # section, where one merged reply would have to write all seven;
+                # they stop early enough to leave the talk track its reserve
+                analyses = await self._analyze_individually(content, deadline - TALK_TRACK_RESERVE_SECONDS)
+            (call_outcome, discovery_quality, sales_framework_analysis, psychological_analysis,
+             marriage_specific_analysis, emotional_journey, archetype_classification) = analyses
 
             # Calculate success probability
             success_probability = self.calculate_marriage_success_probability(
                 sales_framework_analysis, marriage_specific_analysis, archetype_classification
             )
 
-            # Determine coaching urgency (75% threshold)
-            coaching_assessment = self.determine_coaching_urgency(success_probability)
+            # Run talk track improvements (depends on framework and marriage analysis)
+            talk_track_improvements = self._skipped_talk_track(skip_reason)
+            if talk_track_improvements is None:
+                talk_track_improvements = await self.analyze_talk_track_improvements(
+                    sales_framework_analysis, marriage_specific_analysis,
+                    timeout=min(ANALYSIS_TIMEOUT_SECONDS, time_left(deadline))
+                )
 
-            # Extract participant names if not provided
-            if not client_name or not closer_name:
-                extracted_names = self.extract_participant_names(content)
-                client_name = client_name or extracted_names.get('client_name')
-                closer_name = closer_name or extracted_names.get('closer_name')
+            result = self.build_result(
+                content, filename, word_count, skip_reason, analyses, talk_track_improvements,
+                success_probability, client_name, closer_name, zoom_meeting_id, call_date, self.degraded
+            )
 
-            return {
+            logger.info("Analysis metrics: " + orjson.dumps({
                 'transcript_id': filename,
-                'analysis_timestamp': datetime.now().isoformat(),
-                'status': 'success',
-                'word_count': len(content.split()),
-
-                # Call metadata
-                'call_metadata': {
-                    'client_name': client_name,
-                    'closer_name': closer_name,
-                    'zoom_meeting_id': zoom_meeting_id,
-                    'call_date': call_date or datetime.now().strftime('%Y-%m-%d'),
-                    'analysis_timestamp': datetime.now().isoformat()
-                },
-
-                # Call outcome (Phase 1 feature)
-                'call_outcome': call_outcome,
-
-                # Discovery quality (Phase 2 feature)
-                'discovery_quality': discovery_quality,
-
-                # Core analyses
-                'sales_framework_analysis': sales_framework_analysis,
-                'psychological_profile': psychological_analysis,
-                'marriage_coaching_analysis': marriage_specific_analysis,
-                'emotional_journey': emotional_journey,
-                'archetype_analysis': archetype_classification,
-                'talk_track_improvements': talk_track_improvements,
-
-                # Calculated metrics
-                'success_probability': success_probability,
-                'coaching_assessment': coaching_assessment
-            }
+                'total_ms': round((time.perf_counter() - started) * 1000),
+                'input_chars': len(content),
+                'stages': self.metrics,
+                'degraded': self.degraded
+            }).decode())
+            return result
 
         except Exception as e:
             logger.error(f"Marriage coaching analysis failed: {str(e)}")
@@ -546,493 +1445,425 @@ Be PRECISE with timestamps. Only mark as asked if the question is clearly presen
                 'analysis_timestamp': datetime.now().isoformat()
             }
 
-    async def analyze_sales_framework(self, content, discovery_quality=None):
-        """Apply the proven 7-category sales framework with temporal analysis"""
+    async def analyze_marriage_batch(self, contents, filenames=None, poll_interval=30):
+        """
+        Bulk analysis through the Message Batches API.
+
+        Batched requests are billed at half the token price but may take
+        minutes to hours to complete, so this path is meant for offline
+        re-scoring - interactive requests use analyze_marriage_coaching_call.
+        It runs as two batches, the merged first-stage analysis and then the
+        talk track, because the talk track builds on the first. Requests that
+        fail in a batch take their fallbacks rather than live retries.
+        """
+        filenames = filenames or [f"transcript_{i}.txt" for i in range(len(contents))]
+        prepared = [self._prepare_transcript(content, filename) for content, filename in zip(contents, filenames)]
+        analysis_contents = await asyncio.gather(*(self.truncate_to_tokens(content) for content, _, _ in prepared))
+
+        messages = await self._run_message_batch({
+            str(i): self._message_params(TRANSCRIPT_PREFIX + content, ALL_IN_ONE_MAX_TOKENS, STATIC_ALL_IN_ONE_SPEC)
+            for i, (content, (_, _, skip_reason)) in enumerate(zip(analysis_contents, prepared)) if not skip_reason
+        }, poll_interval)
+
+        first_stage = []
+        degraded = [[] for _ in contents]
+        for i, (_, _, skip_reason) in enumerate(prepared):
+            combined = self._parse_batch_result(messages, str(i), "All-in-one Analysis")
+            combined = self._complete_all_in_one(combined) if combined is not None else None
+            if combined:
+                first_stage.append(tuple(combined[key] for key, _ in ALL_IN_ONE_SECTIONS))
+            else:
+                first_stage.append(tuple(fallback() for _, fallback in self._first_stage_fallbacks()))
+                if not skip_reason:
+                    degraded[i] = [key for key, _ in ALL_IN_ONE_SECTIONS]
+
+        # Sales framework, marriage analysis and archetype, by ALL_IN_ONE_SECTIONS position
+        probabilities = [
+            self.calculate_marriage_success_probability(analyses[2], analyses[4], analyses[6])
+            for analyses in first_stage
+        ]
+        talk_tracks = [self._skipped_talk_track(skip_reason) for _, _, skip_reason in prepared]
 
-        # Build discovery quality context for enhanced scoring
-        discovery_context = ""
-        if discovery_quality:
-            summary = discovery_quality.get('discovery_quality_summary', {})
-            questions_asked = summary.get('questions_asked_count', 0)
-            discovery_context = f"""
+        messages = await self._run_message_batch({
+            str(i): self._message_params(
+                self._talk_track_prompt(first_stage[i][2], first_stage[i][4]), TALK_TRACK_MAX_TOKENS, STATIC_TALK_TRACK_SPEC
+            )
+            for i, talk_track in enumerate(talk_tracks) if talk_track is None
+        }, poll_interval)
+        for i, talk_track in enumerate(talk_tracks):
+            if talk_track is None:
+                talk_tracks[i] = self._parse_batch_result(messages, str(i), "Talk Track Improvements Analysis",
+                                                          self.get_fallback_talk_track())
+                if talk_tracks[i] is None:
+                    talk_tracks[i] = self.get_fallback_talk_track()
+                    degraded[i].append('talk_track_improvements')
+
+        return [
+            self.build_result(
+                analysis_contents[i], filenames[i], prepared[i][1], prepared[i][2],
+                first_stage[i], talk_tracks[i], probabilities[i], degraded=degraded[i]
+            )
+            for i in range(len(contents))
+        ]
 
-DISCOVERY QUALITY DATA (Phase 2):
-- Switching gears transition: {discovery_quality.get('switching_gears_detected', {}).get('found', False)}
-- Key questions asked: {questions_asked}/4
-- Discovery completion: {summary.get('completion_percentage', 0)}%
-- Discovery depth score from Phase 2: {summary.get('discovery_depth_score', 5)}/10
+    async def _run_message_batch(self, requests, poll_interval):
+        """Submit {custom_id: params} as one batch, wait for it to end and return {custom_id: message}"""
+        if not requests:
+            return {}
+
+        batch = await self.client.messages.batches.create(
+            requests=[{"custom_id": custom_id, "params": params} for custom_id, params in requests.items()]
+        )
+        logger.info(f"Submitted message batch {batch.id} with {len(requests)} requests")
+        while batch.processing_status != "ended":
+            await asyncio.sleep(poll_interval)
+            batch = await self.client.messages.batches.retrieve(batch.id)
+
+        messages = {}
+        async for entry in await self.client.messages.batches.results(batch.id):
+            if entry.result.type == "succeeded":
+                messages[entry.custom_id] = entry.result.message
+            else:
+                logger.error(f"Batch request {entry.custom_id} did not succeed: {entry.result.type}")
+        return messages
+
+    def _parse_batch_result(self, messages, custom_id, operation_name, defaults=None):
+        """Parse one batch reply, or None when it is missing or unusable"""
+        if custom_id not in messages:
+            return None
+        try:
+            return self._parse_json_message(messages[custom_id], operation_name, defaults)
+        except Exception as e:
+            logger.error(f"Batch result {custom_id} unusable: {str(e)}")
+            return None
 
-Use this data to inform your discovery_depth category score. If Phase 2 shows strong discovery (3-4 questions asked), score should be 7-10. If weak (0-1 questions), score should be 1-4."""
+    def _prepare_transcript(self, content, filename):
+        """Parse VTT and pre-check a raw transcript. Returns (content, word_count, skip_reason)"""
+        # Parse VTT format if detected
+        content, is_vtt = parse_vtt_content(content)
 
-        prompt = f"""Analyze this marriage coaching sales call and rate performance in 7 categories using the STRICT SCORING RUBRIC below.
+        logger.info(f"Content length after VTT parsing: {len(content)} characters")
 
-IMPORTANT: Transcript may include timestamps in [MM:SS] format. Use timestamps to provide PRECISE coaching feedback with exact moments to review.
+        # Count words before truncation so the reported length is the real one
+        word_count = len(content.split())
 
-SCORING RUBRIC (use these exact criteria for consistency):
-- 9-10: Exceptional - Demonstrates mastery, multiple strong examples
-- 7-8: Good - Solid performance, few minor improvements needed
-- 5-6: Average - Adequate but significant room for improvement
-- 3-4: Below Average - Major gaps, needs immediate coaching
-- 1-2: Poor - Critical failures, requires urgent intervention
-{discovery_context}
+        # Generate content hash for consistency tracking
+        content_hash = hashlib.md5(content.encode()).hexdigest()[:8]
+        logger.info(f"Content hash: {content_hash} - Use this to identify duplicate analyses")
 
-TRANSCRIPT:
-{content}
+        # Don't spend any Claude calls on test uploads or unrelated transcripts
+        skip_reason = degenerate_transcript_reason(content, word_count)
+        if skip_reason:
+            logger.warning(f"Skipping analysis of {filename}: {skip_reason}")
+        return content, word_count, skip_reason
 
-Rate each category 1-10 using the rubric above. Be CONSISTENT - same quality should get same score.
+    def _skipped_talk_track(self, skip_reason):
+        """Fallback talk track for calls that don't get the Claude call, else None"""
+        if skip_reason:
+            return self.get_fallback_talk_track()
+        return None
 
-CRITICAL: For "relationship_dynamics_education" - ONLY flag MISSED opportunities when:
-1. Prospect's story REVEALS a dynamic (e.g., describes shutting down when husband yells)
-2. Rep did NOT teach the principle in that moment
-3. Teaching would have been contextually appropriate (not over-educating)
+    def build_result(self, content, filename, word_count, skip_reason, analyses, talk_track_improvements,
+                     success_probability, client_name=None, closer_name=None, zoom_meeting_id=None, call_date=None,
+                     degraded=()):
+        """
+        Assemble one call's response from its first-stage analyses (ALL_IN_ONE_SECTIONS order) and talk track.
+        degraded lists the result keys that hold a fallback after a failed or timed-out call.
+        """
+        (call_outcome, discovery_quality, sales_framework_analysis, psychological_analysis,
+         marriage_specific_analysis, emotional_journey, archetype_classification) = analyses
+
+        # Determine coaching urgency (75% threshold)
+        coaching_assessment = self.determine_coaching_urgency(success_probability)
+
+        # Value positioning is scored once, by the sales framework; expose it,
+        # with the marriage analysis' investment framing, under the key the
+        # marriage analysis has always returned. Copied so the cached marriage
+        # analysis (and the talk track key) is untouched.
+        elements = dict(marriage_specific_analysis.get('marriage_coaching_elements', {}))
+        elements['value_vs_price_analysis'] = {
+            'marriage_value_positioning': sales_framework_analysis.get('framework_scores', {}).get('value_positioning', {}),
+            'investment_vs_expense_framing': elements.pop('investment_vs_expense_framing', {})
+        }
+        marriage_specific_analysis = {**marriage_specific_analysis, 'marriage_coaching_elements': elements}
+
+        # Extract participant names if not provided
+        if not client_name or not closer_name:
+            extracted_names = self.extract_participant_names(content)
+            client_name = client_name or extracted_names.get('client_name')
+            closer_name = closer_name or extracted_names.get('closer_name')
+
+        # One clock read so the result and call metadata timestamps agree
+        now = datetime.now()
+        analysis_timestamp = now.isoformat()
+
+        result = {
+            'transcript_id': filename,
+            'analysis_timestamp': analysis_timestamp,
+            'status': 'skipped' if skip_reason else 'success',
+            'word_count': word_count,
+
+            # Call metadata
+            'call_metadata': {
+                'client_name': client_name,
+                'closer_name': closer_name,
+                'zoom_meeting_id': zoom_meeting_id,
+                'call_date': call_date or now.strftime('%Y-%m-%d'),
+                'analysis_timestamp': analysis_timestamp
+            },
 
-Core principles to watch for:
-- Emotion-first processing: Wife feels what husband says before processing the words
-- Emotional priming: Tone/demeanor sets receptivity for what follows (door-slamming vs. whistling example)
-- Defensive triggers: How emotional state colors interpretation of words
-- Communication patterns: How small interactions compound over time
+            # Call outcome (Phase 1 feature)
+            'call_outcome': call_outcome,
 
-High score (8-10): Rep identifies dynamics in prospect's story and teaches principles at perfect moments
-Low score (1-4): Rep misses multiple clear teaching opportunities when prospect reveals dynamics
+            # Discovery quality (Phase 2 feature)
+            'discovery_quality': discovery_quality,
 
-{{
-  "framework_scores": {{
-    "call_control": {{
-      "score": 7,
-      "analysis": "Rep maintained good conversation flow",
-      "coaching_fix": "Ask more guiding questions",
-      "key_moments": ["[12:30] Lost control when prospect went off-topic", "[25:15] Good redirect back to solution"]
-    }},
-    "discovery_depth": {{
-      "score": 5,
-      "analysis": "Surface-level problem identification",
-      "coaching_fix": "Dig deeper into marriage pain points",
-      "key_moments": ["[08:45] Missed opportunity to explore emotional impact", "[15:20] Good probing question"]
-    }},
-    "empathetic_confrontation": {{
-      "score": 6,
-      "analysis": "Showed empathy but missed confrontation opportunities",
-      "coaching_fix": "Balance understanding with accountability",
-      "key_moments": ["[18:30] Too much empathy, avoided confrontation", "[22:10] Missed chance to show prospect his role"]
-    }},
-    "objection_handling": {{
-      "score": 4,
-      "analysis": "Struggled with price objections",
-      "coaching_fix": "Use investment reframes not cost justification",
-      "key_moments": ["[28:45] Price objection handled poorly - justified instead of reframed"]
-    }},
-    "value_positioning": {{
-      "score": 3,
-      "analysis": "Weak marriage value positioning",
-      "coaching_fix": "Position marriage as most important investment",
-      "key_moments": ["[20:15] Weak value statement - sounded like expense not investment"]
-    }},
-    "closing_strength": {{
-      "score": 2,
-      "analysis": "No clear commitment requests",
-      "coaching_fix": "Use assumptive close techniques",
-      "key_moments": ["[32:40] CRITICAL MISS - Client showed buying signal but rep didn't close"]
-    }},
-    "relationship_dynamics_education": {{
-      "score": 4,
-      "analysis": "Rep missed opportunities to teach core relationship principles when prospect's story revealed them",
-      "coaching_fix": "Identify when prospect describes dynamics, then teach the principle briefly without over-educating",
-      "key_moments": ["[15:45] MISSED - Prospect said 'he yelled and I shut down' - perfect moment to explain emotion-first processing", "[22:10] MISSED - Prospect described communication breakdown - could have taught how tone sets receptivity"],
-      "missed_teaching_opportunities": [
-        {{"principle": "Emotion-first processing (wife feels before she hears)", "context": "Prospect described defensive reaction to husband's tone", "timestamp": "[15:45]"}},
-        {{"principle": "Emotional priming (tone sets receptivity)", "context": "Prospect said arguments escalate from how conversation starts", "timestamp": "[22:10]"}}
-      ]
-    }}
-  }},
-  "total_score": 31,
-  "overall_grade": "C"
-}}
+            # Core analyses
+            'sales_framework_analysis': sales_framework_analysis,
+            'psychological_profile': psychological_analysis,
+            'marriage_coaching_analysis': marriage_specific_analysis,
+            'emotional_journey': emotional_journey,
+            'archetype_analysis': archetype_classification,
+            'talk_track_improvements': talk_track_improvements,
 
-Respond with ONLY valid JSON matching this format."""
+            # Calculated metrics
+            'success_probability': success_probability,
+            'coaching_assessment': coaching_assessment,
+
+            # Analyses that fell back after an error or the request deadline
+            'degraded': bool(degraded),
+            'degraded_analyses': list(degraded)
+        }
+        if skip_reason:
+            result['skip_reason'] = skip_reason
+        return result
+
+    async def truncate_to_tokens(self, content):
+        """
+        Limit content to MAX_CONTENT_TOKENS.
+
+        Text short enough to fit at MIN_CHARS_PER_TOKEN cannot exceed it, so
+        tokens are only counted for longer transcripts. The cut is proportional to the
+        measured tokens-per-character ratio; if counting fails we fall back to
+        the character limit. Over-budget calls keep their opening, closing and
+        high-signal middle lines rather than just the head.
+        """
+        if len(content) <= MAX_CONTENT_TOKENS * MIN_CHARS_PER_TOKEN:
+            return content
 
         try:
-            response_text = await self._call_api_with_retry(
-                prompt=prompt,
-                max_tokens=3500,
-                operation_name="Sales Framework Analysis"
+            # Token counts are deterministic, so a re-submitted transcript skips
+            # this round-trip just as its analyses skip theirs
+            cache_key = analysis_cache_key(self.model, 'count_tokens', content)
+            input_tokens = ANALYSIS_CACHE.get(cache_key)
+            if input_tokens is None:
+                async with get_semaphore():
+                    count = await self.client.messages.count_tokens(
+                        model=self.model,
+                        messages=[{"role": "user", "content": content}]
+                    )
+                input_tokens = count.input_tokens
+                ANALYSIS_CACHE.set(cache_key, input_tokens)
+            if input_tokens <= MAX_CONTENT_TOKENS:
+                return content
+            cut = int(len(content) * MAX_CONTENT_TOKENS / input_tokens * 0.95)
+        except Exception as e:
+            logger.error(f"Token count error: {str(e)}")
+            if len(content) <= MAX_CONTENT_CHARS:
+                return content
+            cut = MAX_CONTENT_CHARS
+
+        logger.warning(f"Content very long ({len(content)} chars), truncating to {cut} chars")
+        window = discriminative_window(content, cut)
+        if window is not None:
+            return window + TRUNCATION_SUFFIX
+
+        # No line structure to work with: cut on a word boundary when there is one near the limit
+        boundary = content.rfind(' ', cut - 200, cut)
+        if boundary != -1:
+            cut = boundary
+        return content[:cut] + TRUNCATION_SUFFIX
+
+    async def _analyze_individually(self, content, deadline=None):
+        """Run the first-stage analyses as separate concurrent calls"""
+        # Launch every independent analysis at once; the sales framework only
+        # waits on discovery quality rather than on the whole first batch.
+        # Each gets its own timeout, cut short by the request deadline, and a
+        # timed-out one takes its fallback. Once the deadline has passed the
+        # call isn't started at all.
+        async def bounded(coro):
+            timeout = ANALYSIS_TIMEOUT_SECONDS
+            if deadline is not None:
+                timeout = min(timeout, time_left(deadline))
+            if timeout <= 0:
+                coro.close()
+                raise asyncio.TimeoutError("request deadline passed")
+            return await asyncio.wait_for(coro, timeout)
+
+        discovery_task = asyncio.ensure_future(bounded(self.detect_discovery_quality(content)))
+
+        async def sales_framework_after_discovery():
+            try:
+                # Shielded so that cancelling this wrapper can't cancel discovery,
+                # which is also gathered on its own
+                discovery = await asyncio.shield(discovery_task)
+            except Exception:
+                discovery = None
+            # Timed from here, so a slow discovery doesn't eat the sales budget
+            return await bounded(self.analyze_sales_framework(content, discovery))
+
+        results = await asyncio.gather(
+            bounded(self.detect_call_outcome(content)),
+            discovery_task,
+            sales_framework_after_discovery(),
+            bounded(self.analyze_psychological_profile(content)),
+            bounded(self.analyze_marriage_coaching_specifics(content)),
+            bounded(self.analyze_emotional_journey(content)),
+            bounded(self.classify_marriage_archetype(content)),
+            return_exceptions=True
+        )
+
+        # Map any failed analysis to its fallback so one error doesn't sink the call;
+        # emotional journey and archetype can still be read from keywords
+        keyword_fallbacks = {
+            'emotional_journey': self._fallback_keyword_emotional_journey,
+            'archetype_analysis': self._fallback_keyword_archetype,
+        }
+        analyses = []
+        for result, (key, _), (name, fallback) in zip(results, ALL_IN_ONE_SECTIONS, self._first_stage_fallbacks()):
+            if isinstance(result, BaseException):
+                logger.error(f"{name} failed: {type(result).__name__}: {str(result)}")
+                self.degraded.append(key)
+                result = await keyword_fallbacks[key](content) if key in keyword_fallbacks else fallback()
+            analyses.append(result)
+        return tuple(analyses)
+
+    def _complete_all_in_one(self, result):
+        """Post-process a merged reply in place; None when a section is missing or unusable"""
+        problem = all_in_one_problem(result)
+        if problem:
+            logger.warning(f"All-in-one analysis unusable ({problem}), using fallbacks")
+            return None
+
+        self._add_package_details(result['call_outcome'])
+        self._complete_archetype(result['archetype_analysis'])
+        self._expand_analogies(result['marriage_coaching_analysis'])
+        for (key, _), (_, fallback) in zip(ALL_IN_ONE_SECTIONS, self._first_stage_fallbacks()):
+            fill_defaults(result[key], fallback())
+        return result
+
+    def _first_stage_fallbacks(self):
+        """Operation name and fallback for each first-stage analysis, in ALL_IN_ONE_SECTIONS order"""
+        return (
+            ("Call outcome detection", self.get_fallback_call_outcome),
+            ("Discovery quality detection", self.get_fallback_discovery_quality),
+            ("Sales framework analysis", self.get_fallback_sales_framework),
+            ("Psychological analysis", self.get_fallback_psychological_analysis),
+            ("Marriage coaching analysis", self.get_fallback_marriage_analysis),
+            ("Emotional journey analysis", self.get_fallback_emotional_journey),
+            ("Archetype classification", self.get_fallback_archetype),
+        )
+
+    async def analyze_sales_framework(self, content, discovery_quality=None):
+        """Apply the proven 7-category sales framework with temporal analysis"""
+
+        # Build discovery quality context for enhanced scoring
+        discovery_context = ""
+        if discovery_quality:
+            summary = discovery_quality.get('discovery_quality_summary', {})
+            discovery_context = DISCOVERY_CONTEXT_TEMPLATE.format(
+                found=discovery_quality.get('switching_gears_detected', {}).get('found', False),
+                questions_asked=summary.get('questions_asked_count', 0),
+                completion=summary.get('completion_percentage', 0),
+                depth=summary.get('discovery_depth_score', 5)
             )
 
-            if response_text.startswith('```json'):
-                response_text = response_text.replace('```json', '').replace('```', '').strip()
+        prompt = TRANSCRIPT_PREFIX + content + discovery_context
 
-            return json.loads(response_text)
+        try:
+            return await self._request_json(
+                prompt=prompt,
+                system=STATIC_FRAMEWORK_SPEC,
+                max_tokens=SECTION_MAX_TOKENS['sales_framework_analysis'],
+                operation_name="Sales Framework Analysis",
+                defaults=self.get_fallback_sales_framework()
+            )
 
         except Exception as e:
             logger.error(f"Sales framework analysis error after retries: {str(e)}")
+            self.degraded.append('sales_framework_analysis')
             return self.get_fallback_sales_framework()
 
     async def analyze_psychological_profile(self, content):
         """Big Five personality analysis for marriage coaching prospects"""
 
-        prompt = f"""Analyze this prospect's personality from the marriage coaching call.
-
-TRANSCRIPT:
-{content}
-
-Rate their Big Five personality traits (1-100):
-
-{{
-  "big_five_personality": {{
-    "openness": {{
-      "score": 75,
-      "confidence": 80,
-      "implications": "Open to new approaches for marriage improvement"
-    }},
-    "conscientiousness": {{
-      "score": 60,
-      "confidence": 85,
-      "implications": "Moderate follow-through likelihood"
-    }},
-    "extraversion": {{
-      "score": 45,
-      "confidence": 75,
-      "implications": "Introverted communication style"
-    }},
-    "agreeableness": {{
-      "score": 70,
-      "confidence": 85,
-      "implications": "Cooperative but conflict-avoidant"
-    }},
-    "neuroticism": {{
-      "score": 65,
-      "confidence": 80,
-      "implications": "Moderate stress about marriage situation"
-    }}
-  }},
-  "decision_making_style": {{
-    "primary_style": "emotional",
-    "confidence": 85
-  }},
-  "emotional_state": {{
-    "primary_emotion": "anxious",
-    "intensity": 7,
-    "stability": 5
-  }}
-}}
-
-Respond with ONLY valid JSON matching this format."""
+        prompt = TRANSCRIPT_PREFIX + content
 
         try:
-            response_text = await self._call_api_with_retry(
+            return await self._request_json(
                 prompt=prompt,
-                max_tokens=2000,
-                operation_name="Psychological Profile Analysis"
+                system=STATIC_BIG_FIVE_SPEC,
+                model=self.fast_model,
+                max_tokens=SECTION_MAX_TOKENS['psychological_profile'],
+                operation_name="Psychological Profile Analysis",
+                defaults=self.get_fallback_psychological_analysis()
             )
 
-            if response_text.startswith('```json'):
-                response_text = response_text.replace('```json', '').replace('```', '').strip()
-
-            return json.loads(response_text)
-
         except Exception as e:
             logger.error(f"Psychological analysis error after retries: {str(e)}")
+            self.degraded.append('psychological_profile')
             return self.get_fallback_psychological_analysis()
 
     async def analyze_marriage_coaching_specifics(self, content):
         """Marriage coaching specific analysis"""
 
-        prompt = f"""
-        Analyze this marriage coaching sales call for marriage-specific elements and coaching effectiveness.
-
-        IMPORTANT: Transcript may include timestamps in [MM:SS] format. Include timestamps in ALL coaching feedback for precise review moments.
-
-        TRANSCRIPT:
-        {content}
-
-        Focus on marriage coaching specifics:
-
-        {{
-          "marriage_coaching_elements": {{
-            "listening_with_intent": {{
-              "information_gathering_score": 1-10,
-              "information_callback_score": 1-10,
-              "examples_of_good_listening": ["quotes where rep used earlier info later"],
-              "missed_callback_opportunities": ["info given early that wasn't used later"],
-              "coaching_prescription": "How to improve listening and callback usage"
-            }},
-            "empathy_vs_confrontation_balance": {{
-              "empathy_score": 1-10,
-              "confrontation_score": 1-10,
-              "balance_effectiveness": 1-10,
-              "empathy_examples": ["quotes showing good empathy"],
-              "confrontation_examples": ["quotes showing prospect his role in problems"],
-              "missed_confrontation_opportunities": ["moments to show prospect his shortcomings"],
-              "coaching_improvement": "Better balance techniques"
-            }},
-            "value_vs_price_analysis": {{
-              "marriage_value_positioning": {{
-                "score": 1-10,
-                "effective_positioning": ["quotes positioning marriage as valuable"],
-                "missed_positioning": ["opportunities to reinforce marriage value"],
-                "tesla_analogy_usage": {{ "used": true/false, "effectiveness": 1-10, "context": "how it was used" }},
-                "beg_borrow_steal_positioning": {{ "used": true/false, "effectiveness": 1-10, "improvement": "how to use this better" }}
-              }},
-              "investment_vs_expense_framing": {{
-                "score": 1-10,
-                "effective_framing": ["quotes framing as investment"],
-                "expense_framing_mistakes": ["quotes that made it sound like expense"],
-                "coaching_improvement": "Better investment framing scripts"
-              }}
-            }},
-            "marriage_analogies_effectiveness": {{
-              "analogies_used": {{
-                "garden_analogy": {{
-                  "used": true/false,
-                  "effectiveness": 1-10,
-                  "context": "relationship needs tending like a garden",
-                  "prospect_response": "how prospect reacted to this analogy",
-                  "timing_in_call": "opening|discovery|presentation|closing",
-                  "improvement_note": "how to use this analogy better"
-                }},
-                "bucket_emotional_flexseal": {{
-                  "used": true/false,
-                  "effectiveness": 1-10,
-                  "context": "emotional holes need repair like bucket with flexseal",
-                  "prospect_response": "emotional connection created",
-                  "timing_in_call": "opening|discovery|presentation|closing",
-                  "improvement_note": "better application of this analogy"
-                }},
-                "sediment_analogy": {{
-                  "used": true/false,
-                  "effectiveness": 1-10,
-                  "context": "relationship problems build up like sediment",
-                  "prospect_response": "understanding of problem accumulation",
-                  "timing_in_call": "opening|discovery|presentation|closing",
-                  "improvement_note": "more effective sediment positioning"
-                }},
-                "tipping_scale": {{
-                  "used": true/false,
-                  "effectiveness": 1-10,
-                  "context": "marriage problems vs solutions on tipping scale",
-                  "prospect_response": "urgency created about tipping point",
-                  "timing_in_call": "opening|discovery|presentation|closing",
-                  "improvement_note": "better scale positioning"
-                }},
-                "couch_analogy": {{
-                  "used": true/false,
-                  "effectiveness": 1-10,
-                  "context": "comfort zone keeping prospect from action",
-                  "prospect_response": "recognition of comfort zone trap",
-                  "timing_in_call": "opening|discovery|presentation|closing",
-                  "improvement_note": "more effective comfort zone challenge"
-                }},
-                "razor_analogy": {{
-                  "used": true/false,
-                  "effectiveness": 1-10,
-                  "context": "sharp precision needed in marriage repair",
-                  "prospect_response": "understanding need for precision",
-                  "timing_in_call": "opening|discovery|presentation|closing",
-                  "improvement_note": "sharper analogy delivery"
-                }},
-                "road_trip": {{
-                  "used": true/false,
-                  "effectiveness": 1-10,
-                  "context": "marriage journey like planned road trip",
-                  "prospect_response": "connection to journey concept",
-                  "timing_in_call": "opening|discovery|presentation|closing",
-                  "improvement_note": "better journey positioning"
-                }},
-                "reading_smoke": {{
-                  "used": true/false,
-                  "effectiveness": 1-10,
-                  "context": "marriage warning signs like reading smoke",
-                  "prospect_response": "recognition of warning signs",
-                  "timing_in_call": "opening|discovery|presentation|closing",
-                  "improvement_note": "more effective warning positioning"
-                }}
-              }},
-              "analogy_strategy_analysis": {{
-                "total_analogies_used": "count of analogies used",
-                "most_effective_analogy": "which analogy resonated most",
-                "analogy_timing_effectiveness": "early|mid|late - when analogies worked best",
-                "prospect_analogy_preference": "which type of analogies this prospect responds to",
-                "overuse_warning": "if too many analogies confused the prospect"
-              }},
-              "analogy_recommendations": {{
-                "best_analogy_for_this_prospect": "which specific analogy would work best and why based on their situation",
-                "optimal_analogy_timing": "when in conversation to introduce analogies for maximum impact",
-                "missed_analogy_opportunities": ["specific moments where analogies could have created breakthrough"],
-                "next_call_analogy_strategy": "which analogies to use in follow-up based on analysis"
-              }}
-            }}
-          }},
-          "marriage_situation_assessment": {{
-            "relationship_status": "same_house_same_bed|same_house_separate_rooms|separated|unclear",
-            "urgency_level": 1-10,
-            "emotional_state": "desperate|hopeful|angry|resigned|confused",
-            "wife_involvement": "supportive|neutral|resistant|unknown",
-            "timeline_pressure": "immediate|weeks|months|no_pressure",
-            "financial_capability": {{ "assessed": true/false, "ability": "high|medium|low|unknown", "objections": ["financial concerns raised"] }}
-          }},
-          "coaching_triggers": {{
-            "critical_intervention_needed": {{
-              "high_probability_miss": {{
-                "triggered": true/false,
-                "severity": "low|medium|high|critical",
-                "specific_reasons": ["prospect showed high interest but rep didn't close", "buying signals missed", "emotional peak not leveraged"],
-                "missed_closing_opportunities": ["specific moments where rep should have asked for commitment"],
-                "immediate_coaching_action": "what sales manager needs to address RIGHT NOW"
-              }},
-              "empathy_confrontation_imbalance": {{
-                "triggered": true/false,
-                "imbalance_type": "too_much_empathy|too_much_confrontation|no_confrontation",
-                "severity": "low|medium|high|critical",
-                "specific_examples": ["quotes showing the imbalance"],
-                "impact_on_sale": "how this imbalance hurt the sales process",
-                "coaching_correction": "specific script/technique to fix this immediately"
-              }},
-              "value_positioning_catastrophe": {{
-                "triggered": true/false,
-                "severity": "low|medium|high|critical",
-                "positioning_failures": ["made coaching sound like expense", "didn't show marriage value", "weak ROI positioning"],
-                "prospect_price_objections": ["specific price concerns that weren't handled"],
-                "emergency_value_scripts": ["scripts rep needs to learn before next call"]
-              }},
-              "listening_and_discovery_failure": {{
-                "triggered": true/false,
-                "severity": "low|medium|high|critical",
-                "information_missed": ["critical info prospect gave that wasn't used"],
-                "callback_failures": ["early info that should have been referenced later"],
-                "discovery_gaps": ["essential marriage situation info not gathered"],
-                "coaching_intervention": "immediate discovery training needed"
-              }},
-              "emotional_mismanagement": {{
-                "triggered": true/false,
-                "severity": "low|medium|high|critical",
-                "emotional_mistakes": ["misread emotional state", "responded poorly to emotion", "created negative emotion"],
-                "missed_emotional_leverage": ["emotional peaks not used for closing"],
-                "emotional_coaching_needed": "specific emotional intelligence training required"
-              }},
-              "analogy_and_story_failure": {{
-                "triggered": true/false,
-                "severity": "low|medium|high|critical",
-                "missed_story_opportunities": ["moments where analogies could have created breakthrough"],
-                "poor_analogy_execution": ["analogies used poorly or at wrong time"],
-                "story_coaching_priority": "which analogies rep needs to master first"
-              }}
-            }},
-            "coaching_urgency_assessment": {{
-              "immediate_coaching_required": true/false,
-              "coaching_priority_level": "low|medium|high|emergency",
-              "total_critical_triggers": "count of critical issues",
-              "rep_competency_concern": "is this rep capable of closing marriage coaching sales",
-              "recommended_coaching_timeline": "immediate|within_24hrs|this_week|ongoing"
-            }},
-            "manager_intervention_recommendations": {{
-              "should_manager_jump_on_next_call": true/false,
-              "rep_needs_shadowing": true/false,
-              "script_drilling_required": ["specific scripts rep must practice"],
-              "role_play_scenarios": ["situations rep needs to practice before next call"],
-              "performance_improvement_plan_trigger": true/false
-            }}
-          }}
-        }}
-
-        Be savage and specific about marriage coaching techniques. This analysis determines if this rep can save marriages.
-
-        Respond with ONLY the JSON object.
-        """
+        prompt = TRANSCRIPT_PREFIX + content
 
         try:
-            response_text = await self._call_api_with_retry(
+            result = await self._request_json(
                 prompt=prompt,
-                max_tokens=3500,
+                system=STATIC_MARRIAGE_SPEC,
+                max_tokens=SECTION_MAX_TOKENS['marriage_coaching_analysis'],
                 operation_name="Marriage Coaching Specifics Analysis"
             )
-
-            if response_text.startswith('```json'):
-                response_text = response_text.replace('```json', '').replace('```', '').strip()
-
-            return json.loads(response_text)
+            # Expand the analogy list first so it isn't replaced by the fallback's dict
+            self._expand_analogies(result)
+            return fill_defaults(result, self.get_fallback_marriage_analysis())
 
         except Exception as e:
             logger.error(f"Marriage coaching analysis error after retries: {str(e)}")
+            self.degraded.append('marriage_coaching_analysis')
             return self.get_fallback_marriage_analysis()
 
     async def analyze_emotional_journey(self, content):
         """Track emotional journey throughout the call using Claude Sonnet 4.5"""
 
-        # Use shorter content for reliable analysis
-        content_preview = content[:3000] if len(content) > 3000 else content
+        # Use shorter content for reliable analysis; the keyword fallback
+        # still scans the whole call
+        content_preview = content[:PREVIEW_CHARS]
         logger.info(f"AI emotional journey analysis for content length: {len(content_preview)}")
 
-        prompt = f"""You are an expert marriage coaching psychologist. Map the prospect's emotional journey through this sales call.
-
-IMPORTANT: Transcript may include timestamps in [MM:SS] format. Use timestamps to track WHEN emotional shifts occur.
-
-TRANSCRIPT:
-{content_preview}
-
-Track their emotional progression through 4 phases with PRECISE timestamps:
-
-Return ONLY this JSON:
-{{
-  "emotional_journey_phases": [
-    {{
-      "phase": "opening",
-      "timestamp": "[02:15]",
-      "emotional_state": "curious",
-      "intensity": 6,
-      "trigger_moment": "[02:15] Learning about the process",
-      "coaching_note": "Rep could have used curiosity to build more engagement - ask more questions"
-    }},
-    {{
-      "phase": "discovery",
-      "timestamp": "[08:30]",
-      "emotional_state": "vulnerable",
-      "intensity": 8,
-      "trigger_moment": "[08:30] Shared deep marriage pain",
-      "coaching_note": "Peak emotional moment - rep should have acknowledged and used for urgency"
-    }}
-  ],
-  "emotional_patterns": {{
-    "dominant_emotion": "hopeful",
-    "emotional_shifts": [
-      "[12:45] Became more engaged when solution presented",
-      "[22:10] Showed resistance after price mention"
-    ],
-    "missed_emotional_opportunities": [
-      "[15:20] Client expressed fear but rep didn't address it",
-      "[28:40] High emotional state - rep should have closed here"
-    ]
-  }}
-}}
-
-Focus on marriage crisis emotions: desperation, hope, fear, skepticism, relief. Include timestamps for ALL key moments."""
+        prompt = TRANSCRIPT_PREFIX + content_preview
 
         try:
-            response_text = await self._call_api_with_retry(
+            result = await self._request_json(
                 prompt=prompt,
-                max_tokens=1200,
-                operation_name="Emotional Journey Analysis"
+                system=STATIC_EMOTIONAL_SPEC,
+                model=self.fast_model,
+                max_tokens=SECTION_MAX_TOKENS['emotional_journey'],
+                operation_name="Emotional Journey Analysis",
+                defaults=self.get_fallback_emotional_journey(),
+                validate=emotional_journey_problem
             )
 
-            logger.info(f"AI emotional journey response: {response_text}")
-
-            # Clean and extract JSON
-            response_text = response_text.replace('```json', '').replace('```', '').strip()
-
-            import re
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                response_text = json_match.group(0)
-
-            result = json.loads(response_text)
-
-            # Validate structure
-            if not result.get('emotional_journey_phases'):
-                raise ValueError("Missing emotional_journey_phases")
+            logger.info(f"AI emotional journey response: {result}")
 
             logger.info(f"AI emotional journey analysis successful with {len(result['emotional_journey_phases'])} phases")
             return result
 
         except Exception as e:
             logger.error(f"AI emotional journey analysis failed: {str(e)}")
+            self.degraded.append('emotional_journey')
             # Fallback to keyword approach if AI fails
             logger.info("Falling back to keyword-based emotional journey")
             return await self._fallback_keyword_emotional_journey(content)
@@ -1081,98 +1912,81 @@ Focus on marriage crisis emotions: desperation, hope, fear, skepticism, relief.
     async def classify_marriage_archetype(self, content):
         """Classify into marriage coaching specific archetypes using Claude Sonnet 4.5"""
 
-        # Use shorter content for reliable analysis
-        content_preview = content[:3000] if len(content) > 3000 else content
-        logger.info(f"AI archetype analysis for content length: {len(content_preview)}")
-
-        prompt = f"""You are an expert marriage coaching sales psychologist. Analyze this transcript and classify the prospect's psychological archetype.
+        # Use shorter content for reliable analysis; the keyword fallback
+        # still scans the whole call
+        content_preview = content[:PREVIEW_CHARS]
 
-TRANSCRIPT:
-{content_preview}
+        fast_result = self._fast_archetype(content_preview)
+        if fast_result is not None:
+            return fast_result
 
-MARRIAGE COACHING ARCHETYPES:
-1. DESPERATE SAVER - High urgency, crisis-driven, time pressure language
-2. ANALYTICAL RESEARCHER - Wants data, statistics, success rates, proof
-3. HOPEFUL BUILDER - Optimistic, growth-focused, investment-oriented
-4. SKEPTICAL EVALUATOR - Cautious, mentions scams/trust issues
-5. CONSENSUS SEEKER - Needs spouse approval, collaborative language
+        logger.info(f"AI archetype analysis for content length: {len(content_preview)}")
 
-Return ONLY this JSON:
-{{
-  "primary_archetype": "DESPERATE SAVER",
-  "confidence_score": 0.85,
-  "supporting_quotes": ["quote from transcript", "another quote"],
-  "behavioral_indicators": ["behavior pattern 1", "behavior pattern 2"]
-}}"""
+        prompt = TRANSCRIPT_PREFIX + content_preview
 
         try:
-            response_text = await self._call_api_with_retry(
+            result = await self._request_json(
                 prompt=prompt,
-                max_tokens=800,
+                system=STATIC_ARCHETYPE_SPEC,
+                model=self.fast_model,
+                max_tokens=SECTION_MAX_TOKENS['archetype_analysis'],
                 operation_name="Archetype Classification"
             )
 
-            logger.info(f"AI archetype response: {response_text}")
-
-            # Clean and extract JSON
-            response_text = response_text.replace('```json', '').replace('```', '').strip()
-
-            import re
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                response_text = json_match.group(0)
+            logger.info(f"AI archetype response: {result}")
 
-            result = json.loads(response_text)
-
-            # Add missing fields for frontend compatibility
-            result.setdefault('secondary_archetype', 'Hopeful Builder')
-            result.setdefault('confidence_score', 0.75)
-            result.setdefault('archetype_evidence', {
-                "supporting_quotes": result.get('supporting_quotes', []),
-                "behavioral_indicators": result.get('behavioral_indicators', [])
-            })
+            self._complete_archetype(result)
+            fill_defaults(result, self.get_fallback_archetype())
 
             logger.info(f"AI archetype classification successful: {result.get('primary_archetype')}")
             return result
 
         except Exception as e:
             logger.error(f"AI archetype analysis failed: {str(e)}")
+            self.degraded.append('archetype_analysis')
             # Fallback to keyword approach if AI fails
             logger.info("Falling back to keyword-based classification")
             return await self._fallback_keyword_archetype(content)
 
+    def _fast_archetype(self, content):
+        """
+        Classify from language cues alone when one archetype clearly dominates,
+        with a cue confidence of at least FAST_ARCHETYPE_MIN_CONFIDENCE.
+        Returns None when the call is ambiguous and needs Claude.
+        """
+        scores = archetype_cue_scores(content)
+        (top, top_score), (second, second_score) = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:2]
+        confidence = archetype_cue_confidence(top_score, second_score)
+        if confidence < FAST_ARCHETYPE_MIN_CONFIDENCE:
+            return None
+
+        logger.info(f"Keyword archetype classification: {top} ({top_score} cues, runner-up {second_score})")
+        patterns = ARCHETYPE_LEXICON[top]
+        quotes = [line.strip() for line in content.split('\n') if any(p.search(line) for p in patterns)][:3]
+        return {
+            "primary_archetype": top,
+            "confidence_score": confidence,
+            "secondary_archetype": second.title() if second_score else "Hopeful Builder",
+            "archetype_evidence": {
+                "supporting_quotes": quotes,
+                "behavioral_indicators": [f"{top_score} distinct {top.lower()} language cues"]
+            },
+            "pre_call_validation": {"recommended_questions": [], "archetype_accuracy_prediction": 5}
+        }
+
     async def _fallback_keyword_archetype(self, content):
         """Fallback keyword-based archetype classification if AI fails"""
         logger.info("Using keyword-based fallback archetype classification")
 
-        content_lower = content.lower()
-        archetype_scores = {
-            'DESPERATE SAVER': 0,
-            'ANALYTICAL RESEARCHER': 0,
-            'SKEPTICAL EVALUATOR': 0,
-            'CONSENSUS SEEKER': 0,
-            'HOPEFUL BUILDER': 0
-        }
-
-        # Simplified keyword matching
-        if any(word in content_lower for word in ['urgent', 'crisis', 'desperate', 'emergency', 'last chance']):
-            archetype_scores['DESPERATE SAVER'] += 3
-        if any(word in content_lower for word in ['statistics', 'success rate', 'data', 'proof', 'evidence']):
-            archetype_scores['ANALYTICAL RESEARCHER'] += 3
-        if any(word in content_lower for word in ['scam', 'too good', 'burned before', 'suspicious']):
-            archetype_scores['SKEPTICAL EVALUATOR'] += 3
-        if any(word in content_lower for word in ['my spouse', 'my partner', 'we need to discuss']):
-            archetype_scores['CONSENSUS SEEKER'] += 3
-        if any(word in content_lower for word in ['excited', 'hopeful', 'looking forward', 'improve']):
-            archetype_scores['HOPEFUL BUILDER'] += 3
+        archetype_scores = archetype_cue_scores(content)
 
         # Select highest scoring archetype
-        max_score = max(archetype_scores.values())
-        archetype = 'HOPEFUL BUILDER' if max_score == 0 else max(archetype_scores, key=archetype_scores.get)
+        (top, top_score), (_, second_score) = sorted(archetype_scores.items(), key=lambda item: item[1], reverse=True)[:2]
+        archetype = 'HOPEFUL BUILDER' if top_score == 0 else top
 
         return {
             "primary_archetype": archetype,
-            "confidence_score": 0.70,
+            "confidence_score": archetype_cue_confidence(top_score, second_score),
             "secondary_archetype": "Hopeful Builder",
             "archetype_evidence": {
                 "supporting_quotes": ["Keyword-based fallback analysis"],
@@ -1259,139 +2073,36 @@ Return ONLY this JSON:
         logger.info(f"Extracted names: {names}")
         return names
 
-    async def analyze_talk_track_improvements(self, content, sales_framework, marriage_analysis):
-        """Generate specific talk track improvements for marriage coaching sales"""
-
-        prompt = f"""
-        Analyze this marriage coaching sales call and provide specific talk track improvements and script recommendations.
-
-        TRANSCRIPT:
-        {content}
-
-        SALES FRAMEWORK SCORES:
-        {json.dumps(sales_framework.get('framework_scores', {}), indent=2)}
-
-        MARRIAGE COACHING ANALYSIS:
-        {json.dumps(marriage_analysis.get('marriage_coaching_elements', {}), indent=2)}
-
-        Provide surgical talk track improvements:
-
-        {{
-          "talk_track_analysis": {{
-            "opening_improvements": {{
-              "current_opening_effectiveness": 1-10,
-              "what_worked": ["effective opening elements with quotes"],
-              "what_failed": ["weak opening elements with quotes"],
-              "improved_opening_script": "specific script improvement for marriage coaching",
-              "hook_recommendations": ["powerful hooks for marriage coaching prospects"],
-              "rapport_building_improvements": "specific rapport techniques for marriage situations"
-            }},
-            "discovery_talk_track": {{
-              "current_discovery_effectiveness": 1-10,
-              "strong_questions_asked": ["good discovery questions with prospect responses"],
-              "weak_questions_asked": ["poor questions that didn't uncover key info"],
-              "missing_critical_questions": ["essential marriage coaching discovery questions not asked"],
-              "improved_discovery_sequence": [
-                "Question 1: [specific improved question]",
-                "Question 2: [follow-up question based on response]",
-                "Question 3: [deeper discovery question]",
-                "And 7 more sequential questions for marriage coaching discovery..."
-              ],
-              "emotional_discovery_improvements": "how to uncover emotional state more effectively"
-            }},
-            "presentation_improvements": {{
-              "current_presentation_effectiveness": 1-10,
-              "presentation_strengths": ["what rep presented well with quotes"],
-              "presentation_weaknesses": ["what rep presented poorly with quotes"],
-              "marriage_value_presentation_script": "improved script for positioning marriage coaching value",
-              "analogy_integration": "how to weave analogies into presentation more effectively",
-              "emotional_connection_improvements": "scripts to create deeper emotional connection"
-            }},
-            "objection_handling_scripts": {{
-              "price_objection_improvements": {{
-                "common_price_objections": ["actual objections from transcript"],
-                "current_responses_effectiveness": [{{ "objection": "quote", "response": "rep response", "effectiveness": 1-10 }}],
-                "improved_price_scripts": [{{ "objection": "price concern", "improved_response": "better script response" }}],
-                "investment_reframe_scripts": ["scripts to reframe cost as investment in marriage"]
-              }},
-              "time_objection_improvements": {{
-                "time_concerns_raised": ["actual time objections from transcript"],
-                "urgency_creation_scripts": ["scripts to create urgency about marriage timeline"],
-                "time_value_positioning": "positioning marriage coaching as time-sensitive investment"
-              }},
-              "spouse_objection_handling": {{
-                "wife_resistance_concerns": ["concerns about spouse buy-in from transcript"],
-                "spouse_involvement_scripts": ["scripts for handling spouse resistance"],
-                "consensus_building_techniques": "talk track for getting spouse on board"
-              }}
-            }},
-            "closing_improvements": {{
-              "current_closing_effectiveness": 1-10,
-              "closing_attempts_analysis": [{{ "attempt": "quote of closing attempt", "effectiveness": 1-10, "improvement": "how to close better" }}],
-              "improved_closing_sequences": [
-                "Soft Close: [specific script for soft close attempt]",
-                "Medium Close: [script for medium pressure close]",
-                "Hard Close: [script for direct close attempt]"
-              ],
-              "urgency_creation_scripts": ["scripts to create urgency about marriage situation"],
-              "emotional_leverage_closing": "how to use emotions discovered for closing"
-            }},
-            "follow_up_talk_track": {{
-              "immediate_follow_up_script": "script for following up within 24 hours",
-              "objection_follow_up_scripts": [{{ "objection_type": "price|time|spouse", "follow_up_script": "specific follow-up for this objection" }}],
-              "value_reinforcement_follow_up": "scripts to reinforce marriage value in follow-up",
-              "urgency_follow_up_techniques": "creating urgency in follow-up conversations"
-            }}
-          }},
-          "script_drilling_priorities": {{
-            "top_3_scripts_to_master": [
-              "Script 1: [specific script with rationale]",
-              "Script 2: [specific script with rationale]",
-              "Script 3: [specific script with rationale]"
-            ],
-            "role_play_scenarios": [
-              "Scenario 1: [specific marriage situation to practice]",
-              "Scenario 2: [specific objection to practice]",
-              "Scenario 3: [specific closing situation to practice]"
-            ],
-            "daily_practice_recommendations": "what rep should practice daily to improve talk track"
-          }},
-          "marriage_coaching_specialization": {{
-            "marriage_specific_language": {{
-              "words_to_use_more": ["marriage", "relationship", "connection", "intimacy", "partnership"],
-              "words_to_avoid": ["coaching", "training", "program" - instead use "solution", "transformation", "breakthrough"],
-              "emotional_language_improvements": "more emotionally resonant language for marriage coaching"
-            }},
-            "marriage_situation_adaptations": {{
-              "separated_couples_talk_track": "specific scripts for separated couples",
-              "same_house_different_rooms_script": "scripts for couples living together but distant",
-              "high_conflict_couples_approach": "talk track for couples in high conflict",
-              "low_intimacy_couples_positioning": "how to position coaching for intimacy issues"
-            }}
-          }}
-        }}
-
-        Focus on actionable, specific scripts that will improve marriage coaching sales performance immediately.
-
-        Respond with ONLY the JSON object.
+    async def analyze_talk_track_improvements(self, sales_framework, marriage_analysis, timeout=None):
+        """
+        Generate specific talk track improvements for marriage coaching sales.
+        Works from the distilled analyses only, so the transcript isn't sent again.
+        Falls back when the call takes longer than timeout seconds, retries included.
         """
 
         try:
-            response_text = await self._call_api_with_retry(
-                prompt=prompt,
-                max_tokens=4000,
-                operation_name="Talk Track Improvements Analysis"
-            )
-
-            if response_text.startswith('```json'):
-                response_text = response_text.replace('```json', '').replace('```', '').strip()
-
-            return json.loads(response_text)
+            return await asyncio.wait_for(self._request_json(
+                prompt=self._talk_track_prompt(sales_framework, marriage_analysis),
+                system=STATIC_TALK_TRACK_SPEC,
+                max_tokens=TALK_TRACK_MAX_TOKENS,
+                operation_name="Talk Track Improvements Analysis",
+                defaults=self.get_fallback_talk_track()
+            ), timeout)
 
         except Exception as e:
-            logger.error(f"Talk track analysis error after retries: {str(e)}")
+            logger.error(f"Talk track analysis error after retries: {type(e).__name__}: {str(e)}")
+            self.degraded.append('talk_track_improvements')
             return self.get_fallback_talk_track()
 
+    def _talk_track_prompt(self, sales_framework, marriage_analysis):
+        """User turn for the talk track: the framework and marriage results it builds on"""
+        # Compact JSON - indentation only adds input tokens
+        return TALK_TRACK_CONTEXT_TEMPLATE.format(
+            framework_scores=orjson.dumps(sales_framework.get('framework_scores', {})).decode(),
+            marriage_elements=orjson.dumps(marriage_analysis.get('marriage_coaching_elements', {})).decode(),
+            marriage_situation=orjson.dumps(marriage_analysis.get('marriage_situation_assessment', {})).decode()
+        )
+
     def calculate_marriage_success_probability(self, sales_framework, marriage_analysis, archetype):
         """
         Calculate close probability based on evidence-based marriage coaching conversion factors.
@@ -1407,11 +2118,9 @@ Return ONLY this JSON:
             # Sales Framework Performance (35% weight)
             # Based on professional services industry benchmarks showing high consultation conversion rates
             framework_score = sales_framework.get('framework_scores', {})
-            total_framework_score = 0
-
-            for category in ['call_control', 'discovery_depth', 'empathetic_confrontation',
-                           'objection_handling', 'value_positioning', 'closing_strength']:
-                total_framework_score += framework_score.get(category, {}).get('score', 5)
+            total_framework_score = sum(
+                framework_score.get(category, _EMPTY).get('score', 5) for category in FRAMEWORK_CATEGORIES
+            )
 
             sales_performance = total_framework_score / 60  # Normalize to 0-1
 
@@ -1422,35 +2131,17 @@ Return ONLY this JSON:
             urgency_level = marriage_factors.get('urgency_level', 5) / 10
 
             # Stage of Change Assessment (Transtheoretical Model)
-            change_stage_score = 0.6  # Default (contemplation stage)
-            emotional_state = marriage_factors.get('emotional_state', 'neutral')
-
-            if emotional_state == 'desperate':
-                change_stage_score = 0.85  # Action stage - crisis creates immediate readiness
-            elif emotional_state == 'hopeful':
-                change_stage_score = 0.75  # Preparation stage - motivated and planning
-            elif emotional_state == 'angry':
-                change_stage_score = 0.45  # Precontemplation - resistance to change
-            elif emotional_state == 'analytical':
-                change_stage_score = 0.65  # Late contemplation - weighing options
+            change_stage_score = CHANGE_STAGE_SCORES.get(
+                marriage_factors.get('emotional_state', 'neutral'), DEFAULT_CHANGE_STAGE_SCORE
+            )
 
             behavioral_readiness = (urgency_level * 0.6) + (change_stage_score * 0.4)
 
             # Relationship Investment Theory (15% weight)
             # Rusbult's model: satisfaction, alternatives, investment size predict commitment
-            archetype_name = archetype.get('primary_archetype', 'Mixed Profile')
-            investment_psychology = 0.6  # Default
-
-            if archetype_name == 'DESPERATE SAVER':
-                investment_psychology = 0.9  # High investment, few alternatives, low satisfaction
-            elif archetype_name == 'HOPEFUL BUILDER':
-                investment_psychology = 0.8  # High satisfaction, high investment
-            elif archetype_name == 'ANALYTICAL RESEARCHER':
-                investment_psychology = 0.5  # Methodical decision-making, comparing alternatives
-            elif archetype_name == 'SKEPTICAL EVALUATOR':
-                investment_psychology = 0.3  # Low trust, considering alternatives
-            elif archetype_name == 'CONSENSUS SEEKER':
-                investment_psychology = 0.4  # Dependent on partner buy-in, divided investment
+            investment_psychology = ARCHETYPE_INVESTMENT_SCORES.get(
+                archetype.get('primary_archetype', 'Mixed Profile'), DEFAULT_INVESTMENT_SCORE
+            )
 
             # Trust and Rapport Building (10% weight)
             # Critical for relationship coaching where vulnerability is required
@@ -1473,7 +2164,71 @@ Return ONLY this JSON:
             logger.error(f"Success probability calculation error: {str(e)}")
             return 0.4  # Industry average for professional services consultation calls
 
+    def _add_package_details(self, call_outcome):
+        """Attach the purchased package's definition to a call outcome"""
+        package_code = call_outcome.get('package_purchased')
+        if package_code in self.packages:
+            call_outcome['package_details'] = self.packages[package_code]
+
+    def _complete_archetype(self, archetype):
+        """Add missing fields for frontend compatibility"""
+        archetype.setdefault('secondary_archetype', 'Hopeful Builder')
+        archetype.setdefault('confidence_score', 0.75)
+        archetype.setdefault('archetype_evidence', {
+            "supporting_quotes": archetype.get('supporting_quotes', []),
+            "behavioral_indicators": archetype.get('behavioral_indicators', [])
+        })
+
+    def _expand_analogies(self, marriage_analysis):
+        """
+        Turn the compact analogies_used list into the name-keyed dict the
+        response has always exposed. Only analogies the rep used are listed.
+        """
+        effectiveness = marriage_analysis.get('marriage_coaching_elements', {}).get('marriage_analogies_effectiveness')
+        if not isinstance(effectiveness, dict) or not isinstance(effectiveness.get('analogies_used'), list):
+            return
+        effectiveness['analogies_used'] = {
+            analogy['name']: {'used': True, **{k: v for k, v in analogy.items() if k != 'name'}}
+            for analogy in effectiveness['analogies_used']
+            if isinstance(analogy, dict) and analogy.get('name')
+        }
+
     # Fallback methods
+    def get_fallback_call_outcome(self):
+        return {
+            'call_outcome': 'undetermined',
+            'confidence': 0.0,
+            'packages_positioned': [],
+            'package_purchased': None,
+            'purchase_timestamp': None,
+            'why_won_or_lost': 'Analysis failed - could not determine outcome',
+            'key_closing_moments': []
+        }
+
+    def get_fallback_discovery_quality(self):
+        return {
+            'switching_gears_detected': {
+                'found': False,
+                'transition_quality': 'undetermined'
+            },
+            'four_key_questions': {
+                'priority_question': {'asked': False},
+                'understanding_question': {'asked': False},
+                'trust_question': {'asked': False},
+                'emotional_security_question': {'asked': False}
+            },
+            'conflict_handling': {'asked': False},
+            'discovery_quality_summary': {
+                'questions_asked_count': 0,
+                'questions_missed_count': 4,
+                'completion_percentage': 0,
+                'discovery_depth_score': 1,
+                'key_insights_uncovered': [],
+                'missed_opportunities': ['Analysis failed - could not determine discovery quality'],
+                'coaching_prescription': 'Review recording manually'
+            }
+        }
+
     def get_fallback_sales_framework(self):
         return {
             "framework_scores": {
@@ -1481,7 +2236,8 @@ Return ONLY this JSON:
                 "discovery_depth": {"score": 5, "analysis": "analysis unavailable"},
                 "empathetic_confrontation": {"score": 5, "analysis": "analysis unavailable"},
                 "objection_handling": {"score": 5, "analysis": "analysis unavailable"},
-                "value_positioning": {"score": 5, "analysis": "analysis unavailable"},
+                "value_positioning": {"score": 5, "analysis": "analysis unavailable",
+                                      "effective_positioning": [], "missed_positioning": []},
                 "closing_strength": {"score": 5, "analysis": "analysis unavailable"}
             },
             "total_score": 30,
@@ -1493,7 +2249,7 @@ Return ONLY this JSON:
             "marriage_coaching_elements": {
                 "listening_with_intent": {"information_gathering_score": 5, "information_callback_score": 5},
                 "empathy_vs_confrontation_balance": {"empathy_score": 5, "confrontation_score": 5},
-                "value_vs_price_analysis": {"marriage_value_positioning": {"score": 5}},
+                "investment_vs_expense_framing": {"score": 5, "effective_framing": [], "expense_framing_mistakes": []},
                 "marriage_analogies_effectiveness": {"analogies_used": {}}
             },
             "marriage_situation_assessment": {
@@ -1560,71 +2316,119 @@ Return ONLY this JSON:
             }
         }
 
-# Vercel handler
-class handler(BaseHTTPRequestHandler):
-    def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
+# Vercel ASGI entry point
+# Vercel injects environment variables at container start, so read the key once
+_API_KEY = os.environ.get('ANTHROPIC_API_KEY')
+
+# Static response headers and error bodies, built once per container
+JSON_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'content-type', b'application/json'),
+]
+PREFLIGHT_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-methods', b'POST, OPTIONS'),
+    (b'access-control-allow-headers', b'Content-Type'),
+]
+API_KEY_ERROR = orjson.dumps({
+    'error': 'API key not configured',
+    'message': 'Please set ANTHROPIC_API_KEY environment variable in Vercel'
+})
+INVALID_JSON_ERROR = orjson.dumps({'error': 'Invalid JSON in request body'})
+MISSING_CONTENT_ERROR = orjson.dumps({'error': 'Missing required field: content'})
+CONTENT_TOO_SHORT_ERROR = orjson.dumps({
+    'error': 'Content too short. Please provide at least 100 characters of transcript content.'
+})
+METHOD_NOT_ALLOWED_ERROR = orjson.dumps({'error': 'Method not allowed'})
+
+
+async def handle_post(raw_body):
+    """Marriage coaching analysis for a {content, filename} body. Returns (status, body)"""
+    if not _API_KEY:
+        return 500, API_KEY_ERROR
 
-    def do_POST(self):
-        try:
-            api_key = os.environ.get('ANTHROPIC_API_KEY')
-            if not api_key:
-                self.send_error_response(500, {
-                    'error': 'API key not configured',
-                    'message': 'Please set ANTHROPIC_API_KEY environment variable in Vercel'
-                })
-                return
+    try:
+        body = orjson.loads(raw_body)
+    except orjson.JSONDecodeError:
+        return 400, INVALID_JSON_ERROR
+
+    if not isinstance(body, dict) or 'content' not in body:
+        return 400, MISSING_CONTENT_ERROR
+
+    content = body['content']
+    filename = body.get('filename', 'transcript.txt')
+
+    if not content or len(content.strip()) < 100:
+        return 400, CONTENT_TOO_SHORT_ERROR
+
+    analyzer = MarriageCoachingAnalyzer(
+        api_key=_API_KEY,
+        max_retries=3,  # Retry up to 3 times
+        timeout=120,  # 2 minute timeout per request
+        bypass_cache=bool(body.get('bypass_cache'))
+    )
+    result = await analyzer.analyze_marriage_coaching_call(content, filename)
+    return 200, orjson.dumps(result)
+
+
+async def read_body(receive):
+    """Collect the full ASGI request body"""
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+async def send_body(send, status, body, headers=JSON_HEADERS):
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def lifespan(receive, send):
+    """Close the shared client's connection pool when the container shuts down"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _CLIENT is not None:
+                await _CLIENT.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """
+    ASGI application served by the Vercel Python runtime.
 
-            content_length = int(self.headers.get('Content-Length', 0))
-            post_data = self.rfile.read(content_length)
+    Analyses run on the server's long-lived event loop, so the shared client,
+    semaphore and response cache persist across requests and concurrent
+    requests overlap their Claude calls.
+    """
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
 
-            try:
-                body = json.loads(post_data.decode('utf-8'))
-            except json.JSONDecodeError:
-                self.send_error_response(400, {'error': 'Invalid JSON in request body'})
-                return
-
-            if 'content' not in body:
-                self.send_error_response(400, {'error': 'Missing required field: content'})
-                return
-
-            content = body['content']
-            filename = body.get('filename', 'transcript.txt')
-
-            if not content or len(content.strip()) < 100:
-                self.send_error_response(400, {
-                    'error': 'Content too short. Please provide at least 100 characters of transcript content.'
-                })
-                return
-
-            # Initialize analyzer with retry configuration
-            analyzer = MarriageCoachingAnalyzer(
-                api_key=api_key,
-                max_retries=3,  # Retry up to 3 times
-                timeout=120  # 2 minute timeout per request
-            )
-            result = asyncio.run(analyzer.analyze_marriage_coaching_call(content, filename))
+    method = scope['method']
+    try:
+        if method == 'OPTIONS':
+            # Handle CORS preflight requests
+            await send_body(send, 200, b'', PREFLIGHT_HEADERS)
+            return
+        if method == 'POST':
+            status, body = await handle_post(await read_body(receive))
+        else:
+            status, body = 405, METHOD_NOT_ALLOWED_ERROR
 
-            self.send_response(200)
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(result).encode('utf-8'))
+    except Exception as e:
+        logger.error(f"Marriage coaching analysis error: {str(e)}")
+        status, body = 500, orjson.dumps({
+            'error': 'Internal server error',
+            'message': str(e)
+        })
 
-        except Exception as e:
-            logger.error(f"Marriage coaching analysis error: {str(e)}")
-            self.send_error_response(500, {
-                'error': 'Internal server error',
-                'message': str(e)
-            })
-
-    def send_error_response(self, status_code, error_data):
-        self.send_response(status_code)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Content-Type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps(error_data).encode('utf-8'))
\ No newline at end of file
+    await send_body(send, status, body)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the serverless analyzer in api/analyze.py
+Run with: python -m unittest test_analyze
+"""
+
+import asyncio
+import os
+import sys
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+
+import analyze
+from analyze import (
+    ARCHETYPE_TOOL, MAX_CONTENT_CHARS, MAX_CONTENT_TOKENS, MAX_CHARS_PER_TOKEN, MIN_CHARS_PER_TOKEN,
+    ResponseCache, ServerlessAnalyzer, SimilarTranscriptCache, batch_route, find_json_object, schema_error
+)
+
+VALID_ARCHETYPE = {
+    "primary_archetype": "DESPERATE SAVER",
+    "confidence_score": 0.8,
+    "secondary_archetype": "HOPEFUL BUILDER",
+    "reasoning": "High urgency throughout the call",
+    "key_characteristics": ["urgent", "emotional", "committed"]
+}
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class SchemaErrorTests(unittest.TestCase):
+    schema = ARCHETYPE_TOOL["input_schema"]
+
+    def test_valid_payload(self):
+        self.assertIsNone(schema_error(VALID_ARCHETYPE, self.schema))
+
+    def test_missing_field(self):
+        payload = {k: v for k, v in VALID_ARCHETYPE.items() if k != "reasoning"}
+        self.assertEqual(schema_error(payload, self.schema), "$.reasoning is missing")
+
+    def test_value_outside_enum(self):
+        payload = {**VALID_ARCHETYPE, "primary_archetype": "IMPULSE BUYER"}
+        self.assertIn("$.primary_archetype should be one of", schema_error(payload, self.schema))
+
+    def test_number_out_of_range(self):
+        payload = {**VALID_ARCHETYPE, "confidence_score": 1.5}
+        self.assertEqual(schema_error(payload, self.schema), "$.confidence_score should be between 0 and 1")
+
+    def test_wrong_item_type(self):
+        payload = {**VALID_ARCHETYPE, "key_characteristics": ["urgent", 3]}
+        self.assertEqual(schema_error(payload, self.schema), "$.key_characteristics[1] should be a string")
+
+    def test_bool_is_not_a_number(self):
+        payload = {**VALID_ARCHETYPE, "confidence_score": True}
+        self.assertEqual(schema_error(payload, self.schema), "$.confidence_score should be a number")
+
+
+class JsonExtractionTests(unittest.TestCase):
+
+    def test_trailing_commentary(self):
+        text = '{"score": 7, "note": "closing brace } in a string"}\n\nLet me know if you need more.'
+        self.assertEqual(find_json_object(text), '{"score": 7, "note": "closing brace } in a string"}')
+
+    def test_leading_prose_and_nested_objects(self):
+        text = 'Here is the analysis: {"a": {"b": [1, 2]}, "c": "\\"quoted\\""} Hope this helps {x}'
+        self.assertEqual(find_json_object(text), '{"a": {"b": [1, 2]}, "c": "\\"quoted\\""}')
+
+    def test_unbalanced(self):
+        self.assertIsNone(find_json_object('{"a": {"b": 1}'))
+        self.assertIsNone(find_json_object('no json here'))
+
+    def test_parse_response_with_commentary_and_trailing_comma(self):
+        text = '```json\n{"scores": [1, 2,], "grade": "B",}\n```\nThe rep did well overall.'
+        self.assertEqual(ServerlessAnalyzer.parse_json_response(text), {"scores": [1, 2], "grade": "B"})
+
+
+class ResponseCacheTests(unittest.TestCase):
+
+    def test_ttl_expiry(self):
+        cache = ResponseCache(maxsize=10, ttl=60)
+        with mock.patch.object(analyze.time, 'monotonic', return_value=1000.0):
+            cache.set('key', 'value')
+        with mock.patch.object(analyze.time, 'monotonic', return_value=1059.0):
+            self.assertEqual(cache.get('key'), 'value')
+        with mock.patch.object(analyze.time, 'monotonic', return_value=1061.0):
+            self.assertIsNone(cache.get('key'))
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')  # a is now the most recently used
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+
+class SimilarTranscriptCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = SimilarTranscriptCache(maxsize=10, ttl=60, threshold=0.95)
+        self.cache.set(frozenset(range(100)), {'status': 'success'})
+
+    def test_hit_at_threshold(self):
+        # 95 shared shingles out of 100 in the union: Jaccard 0.95
+        self.assertEqual(self.cache.get(frozenset(range(95))), {'status': 'success'})
+
+    def test_miss_below_threshold(self):
+        # 94 / 100: Jaccard 0.94
+        self.assertIsNone(self.cache.get(frozenset(range(94))))
+
+    def test_expired_entry_is_not_reused(self):
+        with mock.patch.object(analyze.time, 'monotonic', return_value=analyze.time.monotonic() + 61):
+            self.assertIsNone(self.cache.get(frozenset(range(100))))
+
+
+class SingleFlightTests(unittest.TestCase):
+
+    def analyze_twice(self, run_analysis):
+        content = f"single flight transcript {id(run_analysis)} " * 20
+        analyzer = ServerlessAnalyzer('test-key')
+
+        async def both():
+            with mock.patch.object(ServerlessAnalyzer, '_run_analysis', run_analysis):
+                return await asyncio.gather(
+                    analyzer.analyze_transcript_content(content, 'first.txt'),
+                    analyzer.analyze_transcript_content(content, 'second.txt')
+                )
+        return run(both())
+
+    def test_concurrent_duplicates_share_one_analysis(self):
+        calls = []
+
+        async def run_analysis(self, content, filename, content_key, shingles):
+            calls.append(filename)
+            await asyncio.sleep(0.01)
+            return {'transcript_id': filename, 'status': 'success'}
+
+        first, second = self.analyze_twice(run_analysis)
+        self.assertEqual(calls, ['first.txt'])
+        self.assertEqual(first, {'transcript_id': 'first.txt', 'status': 'success'})
+        self.assertEqual(second, {'transcript_id': 'second.txt', 'status': 'success'})
+        self.assertEqual(analyze.IN_FLIGHT_ANALYSES, {})
+
+    def test_failure_reaches_every_waiter(self):
+        calls = []
+
+        async def run_analysis(self, content, filename, content_key, shingles):
+            calls.append(filename)
+            await asyncio.sleep(0.01)
+            raise RuntimeError('overloaded')
+
+        results = self.analyze_twice(run_analysis)
+        self.assertEqual(len(calls), 1)
+        for result, filename in zip(results, ('first.txt', 'second.txt')):
+            self.assertEqual(result['status'], 'error')
+            self.assertEqual(result['error'], 'overloaded')
+            self.assertEqual(result['transcript_id'], filename)
+        self.assertEqual(analyze.IN_FLIGHT_ANALYSES, {})
+
+
+class BatchRouteTests(unittest.TestCase):
+
+    def test_batch_id_in_path(self):
+        self.assertEqual(batch_route('/api/analyze/batch/msgbatch_123'), (True, 'msgbatch_123'))
+
+    def test_batch_id_in_query(self):
+        self.assertEqual(batch_route('/api/analyze.py?batch_id=msgbatch_123'), (True, 'msgbatch_123'))
+
+    def test_batch_submission(self):
+        self.assertEqual(batch_route('/api/analyze/batch'), (True, None))
+        self.assertEqual(batch_route('/api/analyze.py?batch=1'), (True, None))
+
+    def test_interactive_analysis(self):
+        self.assertEqual(batch_route('/api/analyze'), (False, None))
+
+    def asgi_get(self, path, query_string=b''):
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query_string}
+        run(analyze.app(scope, receive, send))
+        return sent[0]['status']
+
+    def test_app_polls_batch_id_from_query_string(self):
+        with mock.patch.object(analyze, '_API_KEY', 'test-key'), \
+                mock.patch.object(ServerlessAnalyzer, 'get_transcript_batch_results',
+                                  autospec=True, return_value={'status': 'ended'}) as results:
+            self.assertEqual(self.asgi_get('/api/analyze.py', b'batch_id=msgbatch_123'), 200)
+        self.assertEqual(results.call_args.args[1], 'msgbatch_123')
+
+    def test_app_get_without_batch_id_is_not_found(self):
+        self.assertEqual(self.asgi_get('/api/analyze'), 404)
+
+
+class FakeCountingAnalyzer(ServerlessAnalyzer):
+    """Analyzer whose count_tokens request reports 4 characters per token"""
+
+    def __init__(self):
+        super().__init__('test-key')
+        self.counted = []
+
+        async def count_tokens(model, messages):
+            self.counted.append(len(messages[0]['content']))
+            return types.SimpleNamespace(input_tokens=len(messages[0]['content']) // 4)
+
+        self._client = types.SimpleNamespace(messages=types.SimpleNamespace(count_tokens=count_tokens))
+
+    @property
+    def client(self):
+        return self._client
+
+
+class TruncateContentTests(unittest.TestCase):
+
+    def setUp(self):
+        analyze.TOKEN_COUNT_CACHE = ResponseCache(maxsize=256, ttl=3600)
+        self.analyzer = FakeCountingAnalyzer()
+
+    def truncate(self, length, word='word'):
+        content = (word + ' ') * (length // (len(word) + 1))
+        return run(self.analyzer.truncate_content(content))
+
+    def test_short_transcript_is_not_counted(self):
+        length = MAX_CONTENT_TOKENS * MIN_CHARS_PER_TOKEN
+        self.assertEqual(len(self.truncate(length)), length)
+        self.assertEqual(self.analyzer.counted, [])
+
+    def test_band_is_counted_once(self):
+        self.assertEqual(len(self.truncate(12000)), 12000)
+        self.assertEqual(len(self.truncate(12000)), 12000)
+        self.assertEqual(self.analyzer.counted, [12000])
+
+    def test_over_budget_band_is_cut_by_measured_ratio(self):
+        truncated = self.truncate(16000)
+        self.assertTrue(truncated.endswith(analyze.TRUNCATION_SUFFIX))
+        self.assertLessEqual(len(truncated) - len(analyze.TRUNCATION_SUFFIX), MAX_CONTENT_TOKENS * 4)
+
+    def test_far_over_budget_is_cut_without_counting(self):
+        truncated = self.truncate(MAX_CONTENT_TOKENS * MAX_CHARS_PER_TOKEN + 1000)
+        self.assertEqual(self.analyzer.counted, [])
+        self.assertLessEqual(len(truncated) - len(analyze.TRUNCATION_SUFFIX), MAX_CONTENT_CHARS)
+        self.assertGreater(len(truncated) - len(analyze.TRUNCATION_SUFFIX), MAX_CONTENT_CHARS - 200)
+
+    def test_longer_transcripts_never_keep_less(self):
+        edge = MAX_CONTENT_TOKENS * MAX_CHARS_PER_TOKEN
+        kept = [len(self.truncate(length)) for length in (edge - 10, edge + 10, edge * 2)]
+        self.assertEqual(kept, sorted(kept))
+
+
+if __name__ == '__main__':
+    unittest.main()